@@ -0,0 +1,42 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""repositories: add repo_size and repo_size_updated_on
+
+Revision ID: ce417b8dcef9
+Revises: f1d9e6a3b2c4
+Create Date: 2026-10-18 17:41:09.264318
+
+"""
+
+# The following opaque hexadecimal identifiers ("revisions") are used
+# by Alembic to track this migration script and its relations to others.
+revision = 'ce417b8dcef9'
+down_revision = 'f1d9e6a3b2c4'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    with op.batch_alter_table('repositories', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('repo_size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('repo_size_updated_on', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('repositories', schema=None) as batch_op:
+        batch_op.drop_column('repo_size_updated_on')
+        batch_op.drop_column('repo_size')
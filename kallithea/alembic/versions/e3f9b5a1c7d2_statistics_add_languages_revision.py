@@ -0,0 +1,40 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""statistics: add languages_revision
+
+Revision ID: e3f9b5a1c7d2
+Revises: a0a1bf09c143
+Create Date: 2026-10-18 10:12:31.508226
+
+"""
+
+# The following opaque hexadecimal identifiers ("revisions") are used
+# by Alembic to track this migration script and its relations to others.
+revision = 'e3f9b5a1c7d2'
+down_revision = 'a0a1bf09c143'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    with op.batch_alter_table('statistics', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('languages_revision', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('statistics', schema=None) as batch_op:
+        batch_op.drop_column('languages_revision')
@@ -0,0 +1,55 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""settings: add permissions_generation
+
+Revision ID: f1d9e6a3b2c4
+Revises: e3f9b5a1c7d2
+Create Date: 2026-10-18 14:02:47.193604
+
+"""
+
+# The following opaque hexadecimal identifiers ("revisions") are used
+# by Alembic to track this migration script and its relations to others.
+revision = 'f1d9e6a3b2c4'
+down_revision = 'e3f9b5a1c7d2'
+branch_labels = None
+depends_on = None
+
+import uuid
+
+from alembic import op
+from sqlalchemy import MetaData, Table
+
+from kallithea.model.db import Setting
+
+
+meta = MetaData()
+
+
+def upgrade():
+    meta.bind = op.get_bind()
+    settings = Table(Setting.__tablename__, meta, autoload=True)
+
+    settings.insert().values(
+        app_settings_name=Setting.PERMISSIONS_GENERATION,
+        app_settings_value=uuid.uuid4().hex,
+        app_settings_type='unicode',
+    ).execute()
+
+
+def downgrade():
+    meta.bind = op.get_bind()
+    settings = Table(Setting.__tablename__, meta, autoload=True)
+
+    settings.delete().where(settings.c.app_settings_name == Setting.PERMISSIONS_GENERATION).execute()
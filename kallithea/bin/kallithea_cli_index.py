@@ -37,7 +37,8 @@ from kallithea.model.repo import RepoModel
 @click.option('--index-only', help='Comma-separated list of repositories to build index on. Default: all')
 @click.option('--update-only', help='Comma-separated list of repositories to re-build index on. Default: all')
 @click.option('-f', '--full/--no-full', 'full_index', help='Recreate the index from scratch')
-def index_create(repo_location, index_only, update_only, full_index):
+@click.option('--workers', type=int, default=1, help='Number of worker processes to use when recreating the index from scratch. Default: 1')
+def index_create(repo_location, index_only, update_only, full_index, workers):
     """Create or update full text search index"""
 
     index_location = kallithea.CONFIG['index_dir']
@@ -55,7 +56,8 @@ def index_create(repo_location, index_only, update_only, full_index):
         WhooshIndexingDaemon(index_location=index_location,
                              repo_location=repo_location,
                              repo_list=repo_list,
-                             repo_update_list=repo_update_list) \
+                             repo_update_list=repo_update_list,
+                             workers=workers) \
             .run(full_index=full_index)
         l.release()
     except LockHeld:
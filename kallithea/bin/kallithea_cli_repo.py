@@ -69,6 +69,10 @@ def repo_update_metadata(repositories):
     Kallithea is not aware of it. In this case, you should manually run this
     command to update the repository cache.
 
+    The size of the repositories on disk is updated too. Running this command
+    regularly keeps the sizes shown on the summary pages accurate after
+    garbage collection and other changes outside Kallithea.
+
     If no repositories are specified, the caches of all repositories are
     updated.
     """
@@ -85,6 +89,7 @@ def repo_update_metadata(repositories):
         # invalidate in-memory VCS object cache... will be repopulated on
         # first access
         repo.set_invalidate()
+        repo.update_repo_size()
 
     Session().commit()
 
@@ -11,7 +11,7 @@ hook will use.
 import os
 import sys
 
-import kallithea.lib.hooks
+import kallithea.lib.hookserver
 
 
 # Set output mode on windows to binary for stderr.
@@ -30,7 +30,10 @@ os.environ['KALLITHEA_HOOK_VER'] = KALLITHEA_HOOK_VER
 def main():
     repo_path = os.path.abspath('.')
     git_stdin_lines = sys.stdin.readlines()
-    sys.exit(kallithea.lib.hooks.handle_git_post_receive(repo_path, git_stdin_lines))
+    if kallithea.lib.hookserver.queue_git_post_receive(repo_path, git_stdin_lines):
+        sys.exit(0)
+    from kallithea.lib import hooks # only imported when not handed over
+    sys.exit(hooks.handle_git_post_receive(repo_path, git_stdin_lines))
 
 
 if __name__ == '__main__':
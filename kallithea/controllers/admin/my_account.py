@@ -73,18 +73,16 @@ class MyAccountController(BaseController):
 
     def _load_my_repos_data(self, watched=False):
         if watched:
-            admin = False
             repos_list = Session().query(Repository) \
                          .join(UserFollowing) \
                          .filter(UserFollowing.user_id ==
                                  request.authuser.user_id).all()
         else:
-            admin = True
             repos_list = Session().query(Repository) \
                          .filter(Repository.owner_id ==
                                  request.authuser.user_id).all()
 
-        return RepoModel().get_repos_as_dict(repos_list, admin=admin)
+        return RepoModel().get_repos_as_dict(repos_list)
 
     def my_account(self):
         c.active = 'profile'
@@ -103,7 +103,7 @@ class ReposController(BaseRepoController):
     def index(self, format='html'):
         repos_list = RepoList(Repository.query(sorted=True).all(), perm_level='admin')
         # the repo list will be filtered to only show repos where the user has read permissions
-        repos_data = RepoModel().get_repos_as_dict(repos_list, admin=True)
+        repos_data = RepoModel().get_repos_as_dict(repos_list)
         # data used to render the grid
         c.data = repos_data
 
@@ -44,6 +44,7 @@ from kallithea.lib.exceptions import HgsubversionImportError
 from kallithea.lib.utils import repo2db_mapper, set_app_settings
 from kallithea.lib.utils2 import safe_str
 from kallithea.lib.vcs import VCSError
+from kallithea.lib.vcs.pool import repository_pool
 from kallithea.model.db import Repository, Setting, Ui
 from kallithea.model.forms import ApplicationSettingsForm, ApplicationUiSettingsForm, ApplicationVisualisationForm
 from kallithea.model.meta import Session
@@ -128,6 +129,8 @@ class SettingsController(BaseController):
 #                sett.ui_active = form_result['extensions_hggit']
 
                 Session().commit()
+                # cached repository instances were created with the old settings
+                repository_pool.invalidate()
 
                 h.flash(_('Updated VCS settings'), category='success')
 
@@ -163,7 +166,7 @@ class SettingsController(BaseController):
                       'install git hooks=%s and '
                       'overwrite git hooks=%s' % (rm_obsolete, install_git_hooks, overwrite_git_hooks))
 
-            filesystem_repos = ScmModel().repo_scan()
+            filesystem_repos = ScmModel().repo_scan(incremental=True)
             added, removed = repo2db_mapper(filesystem_repos, rm_obsolete,
                                             install_git_hooks=install_git_hooks,
                                             user=request.authuser.username,
@@ -37,9 +37,10 @@ import kallithea.lib.helpers as h
 from kallithea.config.routing import url
 from kallithea.lib.auth import HasRepoPermissionLevelDecorator, LoginRequired
 from kallithea.lib.base import BaseRepoController, render
-from kallithea.lib.graphmod import graph_data
+from kallithea.lib.graphmod import changelog_graph_data, graph_data
 from kallithea.lib.page import Page
 from kallithea.lib.utils2 import safe_int
+from kallithea.lib.vcs.backends.base import CollectionGenerator
 from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError, ChangesetError, EmptyRepositoryError, NodeDoesNotExistError, RepositoryError
 
 
@@ -102,23 +103,36 @@ class ChangelogController(BaseRepoController):
             if f_path:
                 log.debug('generating changelog for path %s', f_path)
                 # get the history for the file !
+                # only walk the history up to the shown page - and one more
+                # entry to know if there is a next page
+                offset = max(p - 1, 0) * c.size
                 tip_cs = c.db_repo_scm_instance.get_changeset()
                 try:
-                    collection = tip_cs.get_file_history(f_path)
+                    history = list(tip_cs.iter_file_history(f_path, offset=offset, limit=c.size + 1))
+                    cs = tip_cs
                 except (NodeDoesNotExistError, ChangesetError):
                     # this node is not present at tip !
                     try:
                         cs = self.__get_cs(revision, repo_name)
-                        collection = cs.get_file_history(f_path)
+                        history = list(cs.iter_file_history(f_path, offset=offset, limit=c.size + 1))
                     except RepositoryError as e:
                         h.flash(e, category='warning')
                         raise HTTPFound(location=h.url('changelog_home', repo_name=repo_name))
+                if not history and offset:
+                    # beyond the last page - show the first
+                    p = 1
+                    offset = 0
+                    history = list(cs.iter_file_history(f_path, limit=c.size + 1))
+                collection = CollectionGenerator(c.db_repo_scm_instance,
+                                                 [None] * offset + [entry.raw_id for entry in history])
+                # the total is only known when the end of the history is shown
+                c.total_cs = len(collection) if len(history) <= c.size else None
             else:
-                collection = c.db_repo_scm_instance.get_changesets(start=0, end=revision,
-                                                        branch_name=branch_name, reverse=True)
-            c.total_cs = len(collection)
+                # only fetch the changesets shown on the page
+                collection = c.db_repo_scm_instance.get_changelog(end=revision, branch_name=branch_name)
+                c.total_cs = len(collection)
 
-            c.cs_pagination = Page(collection, page=p, item_count=c.total_cs, items_per_page=c.size,
+            c.cs_pagination = Page(collection, page=p, item_count=len(collection), items_per_page=c.size,
                                    branch=branch_name)
 
             page_revisions = [x.raw_id for x in c.cs_pagination]
@@ -142,7 +156,11 @@ class ChangelogController(BaseRepoController):
         revs = []
         if not f_path:
             revs = [x.revision for x in c.cs_pagination]
-        c.jsdata = graph_data(c.db_repo_scm_instance, revs)
+        if branch_name:
+            c.jsdata = graph_data(c.db_repo_scm_instance, revs)
+        else:
+            # slice the precomputed layout of the full history
+            c.jsdata = changelog_graph_data(c.db_repo_scm_instance, revs)
 
         c.revision = revision # requested revision ref
         c.first_revision = c.cs_pagination[0] # pagination is never empty here!
@@ -360,26 +360,25 @@ class ChangesetController(BaseRepoController):
             context_lcl = get_line_ctx('', request.GET)
             ign_whitespace_lcl = get_ignore_ws('', request.GET)
 
-            raw_diff = diffs.get_diff(c.db_repo_scm_instance, cs1, cs2,
-                ignore_whitespace=ign_whitespace_lcl, context=context_lcl)
             diff_limit = None if c.fulldiff else self.cut_off_limit
             file_diff_data = []
             if method == 'show':
-                diff_processor = diffs.DiffProcessor(raw_diff,
-                                                     vcs=c.db_repo_scm_instance.alias,
-                                                     diff_limit=diff_limit)
-                c.limited_diff = diff_processor.limited_diff
-                for f in diff_processor.parsed:
+                c.limited_diff, files = diffs.get_diff_files(c.db_repo_scm_instance, cs1, cs2,
+                    ignore_whitespace=ign_whitespace_lcl, context=context_lcl,
+                    vcs=c.db_repo_scm_instance.alias, diff_limit=diff_limit,
+                    enable_comments=enable_comments)
+                for f in files:
                     st = f['stats']
                     c.lines_added += st['added']
                     c.lines_deleted += st['deleted']
                     filename = f['filename']
                     fid = h.FID(changeset.raw_id, filename)
                     url_fid = h.FID('', filename)
-                    html_diff = diffs.as_html(enable_comments=enable_comments, parsed_lines=[f])
-                    file_diff_data.append((fid, url_fid, f['operation'], f['old_filename'], filename, html_diff, st))
+                    file_diff_data.append((fid, url_fid, f['operation'], f['old_filename'], filename, f['html'], st))
             else:
                 # downloads/raw we only need RAW diff nothing else
+                raw_diff = diffs.get_diff(c.db_repo_scm_instance, cs1, cs2,
+                    ignore_whitespace=ign_whitespace_lcl, context=context_lcl)
                 file_diff_data.append(('', None, None, None, raw_diff, None))
             c.changes[changeset.raw_id] = (cs1, cs2, file_diff_data)
 
@@ -274,22 +274,19 @@ class CompareController(BaseRepoController):
 
         log.debug('running diff between %s and %s in %s',
                   rev1, c.cs_rev, org_repo.scm_instance.path)
-        raw_diff = diffs.get_diff(org_repo.scm_instance, rev1=rev1, rev2=c.cs_rev,
-                                      ignore_whitespace=ignore_whitespace,
-                                      context=line_context)
-
-        diff_processor = diffs.DiffProcessor(raw_diff, diff_limit=diff_limit)
-        c.limited_diff = diff_processor.limited_diff
+        c.limited_diff, files = diffs.get_diff_files(org_repo.scm_instance, rev1, c.cs_rev,
+                                                     ignore_whitespace=ignore_whitespace,
+                                                     context=line_context,
+                                                     diff_limit=diff_limit)
         c.file_diff_data = []
         c.lines_added = 0
         c.lines_deleted = 0
-        for f in diff_processor.parsed:
+        for f in files:
             st = f['stats']
             c.lines_added += st['added']
             c.lines_deleted += st['deleted']
             filename = f['filename']
             fid = h.FID('', filename)
-            html_diff = diffs.as_html(enable_comments=False, parsed_lines=[f])
-            c.file_diff_data.append((fid, None, f['operation'], f['old_filename'], filename, html_diff, st))
+            c.file_diff_data.append((fid, None, f['operation'], f['old_filename'], filename, f['html'], st))
 
         return render('compare/compare_diff.html')
@@ -70,10 +70,9 @@ class FeedController(BaseRepoController):
         diff_limit = safe_int(CONFIG.get('rss_cut_off_limit', 32 * 1024))
         raw_diff = cs.diff()
         diff_processor = DiffProcessor(raw_diff,
-                                       diff_limit=diff_limit,
-                                       inline_diff=False)
+                                       diff_limit=diff_limit)
 
-        for st in diff_processor.parsed:
+        for st in diff_processor:
             st.update({'added': st['stats']['added'],
                        'removed': st['stats']['deleted']})
             changes.append('\n %(operation)s %(filename)s '
@@ -580,24 +580,25 @@ class PullrequestsController(BaseRepoController):
         log.debug('running diff between %s and %s in %s',
                   c.a_rev, c.cs_rev, org_scm_instance.path)
         try:
-            raw_diff = diffs.get_diff(org_scm_instance, rev1=c.a_rev, rev2=c.cs_rev,
-                                      ignore_whitespace=ignore_whitespace, context=line_context)
+            c.limited_diff, files = diffs.get_diff_files(org_scm_instance, c.a_rev, c.cs_rev,
+                                                         ignore_whitespace=ignore_whitespace,
+                                                         context=line_context,
+                                                         diff_limit=diff_limit,
+                                                         enable_comments=True)
         except ChangesetDoesNotExistError:
-            raw_diff = safe_bytes(_("The diff can't be shown - the PR revisions could not be found."))
-        diff_processor = diffs.DiffProcessor(raw_diff, diff_limit=diff_limit)
-        c.limited_diff = diff_processor.limited_diff
+            # the diff can't be shown - the PR revisions could not be found
+            c.limited_diff, files = False, []
         c.file_diff_data = []
         c.lines_added = 0
         c.lines_deleted = 0
 
-        for f in diff_processor.parsed:
+        for f in files:
             st = f['stats']
             c.lines_added += st['added']
             c.lines_deleted += st['deleted']
             filename = f['filename']
             fid = h.FID('', filename)
-            html_diff = diffs.as_html(enable_comments=True, parsed_lines=[f])
-            c.file_diff_data.append((fid, None, f['operation'], f['old_filename'], filename, html_diff, st))
+            c.file_diff_data.append((fid, None, f['operation'], f['old_filename'], filename, f['html'], st))
 
         # inline comments
         c.inline_cnt = 0
@@ -38,12 +38,13 @@ from tg import tmpl_context as c
 from tg.i18n import ugettext as _
 from webob.exc import HTTPBadRequest
 
+import kallithea
 import kallithea.lib.helpers as h
 from kallithea.config.conf import ALL_EXTS, ALL_READMES, LANGUAGES_EXTENSIONS_MAP
 from kallithea.lib import ext_json
 from kallithea.lib.auth import HasRepoPermissionLevelDecorator, LoginRequired
 from kallithea.lib.base import BaseRepoController, jsonify, render
-from kallithea.lib.celerylib.tasks import get_commits_stats
+from kallithea.lib.celerylib.tasks import get_commits_stats, update_repo_size
 from kallithea.lib.markup_renderer import MarkupRenderer
 from kallithea.lib.page import Page
 from kallithea.lib.utils2 import safe_int, safe_str
@@ -51,6 +52,7 @@ from kallithea.lib.vcs.backends.base import EmptyChangeset
 from kallithea.lib.vcs.exceptions import ChangesetError, EmptyRepositoryError, NodeDoesNotExistError
 from kallithea.lib.vcs.nodes import FileNode
 from kallithea.model.db import Statistics
+from kallithea.model.meta import Session
 
 
 log = logging.getLogger(__name__)
@@ -106,7 +108,7 @@ class SummaryController(BaseRepoController):
         p = safe_int(request.GET.get('page'), 1)
         size = safe_int(request.GET.get('size'), 10)
         try:
-            collection = c.db_repo_scm_instance.get_changesets(reverse=True)
+            collection = c.db_repo_scm_instance.get_changelog()
         except EmptyRepositoryError as e:
             h.flash(e, category='warning')
             collection = []
@@ -156,10 +158,18 @@ class SummaryController(BaseRepoController):
     @HasRepoPermissionLevelDecorator('read')
     @jsonify
     def repo_size(self, repo_name):
-        if request.is_xhr:
-            return c.db_repo._repo_size()
-        else:
+        if not request.is_xhr:
             raise HTTPBadRequest()
+        db_repo = c.db_repo
+        max_age = safe_int(kallithea.CONFIG.get('repo_size_max_age'), 3600)
+        if db_repo.repo_size is None or db_repo.repo_size_outdated(max_age) and not kallithea.CELERY_APP:
+            db_repo.update_repo_size()
+            Session().commit()
+        elif db_repo.repo_size_outdated(max_age):
+            db_repo.repo_size_update_pending()
+            Session().commit()
+            update_repo_size(db_repo.repo_name) # show the old size while updating
+        return h.format_byte_size(db_repo.repo_size)
 
     @LoginRequired(allow_default_user=True)
     @HasRepoPermissionLevelDecorator('read')
@@ -209,6 +219,5 @@ class SummaryController(BaseRepoController):
             c.overview_data = ([[ts_min_y, 0], [ts_max_y, 10]])
             c.trending_languages = []
 
-        recurse_limit = 500  # don't recurse more than 500 times when parsing
-        get_commits_stats(c.db_repo.repo_name, ts_min_y, ts_max_y, recurse_limit)
+        get_commits_stats(c.db_repo.repo_name)
         return render('summary/statistics.html')
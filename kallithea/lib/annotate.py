@@ -25,6 +25,7 @@ Original author and date, and relevant copyright and licensing information is be
 :license: GPLv3, see LICENSE.md for more details.
 """
 
+from beaker.cache import cache_region
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 
@@ -58,6 +59,21 @@ def annotate_highlight(filenode, annotate_from_changeset_func,
     return highlighted
 
 
+def get_annotation(filenode):
+    """
+    Returns list with the raw_id of the changeset that last changed each line
+    of filenode. Annotating is expensive, but the result for a path in a
+    changeset never changes and is cached persistently.
+    """
+    changeset = filenode.changeset
+
+    @cache_region('long_term_file', '_get_annotation_from_cache')
+    def _get_annotation_from_cache(*_cache_keys):  # parameters are not really used - only as caching key
+        return [sha for _lineno, sha, _changeset_loader, _line in filenode.annotate]
+
+    return _get_annotation_from_cache(changeset.repository.path, changeset.raw_id, filenode.path)
+
+
 class AnnotateHtmlFormatter(HtmlFormatter):
 
     def __init__(self, filenode, annotate_from_changeset_func,
@@ -156,8 +172,16 @@ class AnnotateHtmlFormatter(HtmlFormatter):
 #        ln_ = len(ls.splitlines())
 #        if  ln_cs > ln_:
 #            annotate_changesets = annotate_changesets[:ln_ - ln_cs]
-        annotate = ''.join((self.annotate_from_changeset_func(el[2]())
-                            for el in self.filenode.annotate))
+        # the annotate cell is the same for all lines from a changeset
+        repo = self.filenode.changeset.repository
+        annotate_cells = {}
+        annotate_lines = []
+        for raw_id in get_annotation(self.filenode):
+            cell = annotate_cells.get(raw_id)
+            if cell is None:
+                cell = annotate_cells[raw_id] = self.annotate_from_changeset_func(repo.get_changeset(raw_id))
+            annotate_lines.append(cell)
+        annotate = ''.join(annotate_lines)
         # in case you wonder about the seemingly redundant <div> here:
         # since the content in the other cell also is wrapped in a div,
         # some browsers in some configurations seem to mess up the formatting.
@@ -32,6 +32,7 @@ import string
 
 import bcrypt
 import ipaddr
+from beaker.cache import cache_region
 from decorator import decorator
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import ObjectDeletedError
@@ -44,7 +45,7 @@ from kallithea.config.routing import url
 from kallithea.lib.utils import get_repo_group_slug, get_repo_slug, get_user_group_slug
 from kallithea.lib.utils2 import ascii_bytes, ascii_str, safe_bytes
 from kallithea.lib.vcs.utils.lazy import LazyProperty
-from kallithea.model.db import (Permission, UserApiKeys, UserGroup, UserGroupMember, UserGroupRepoGroupToPerm, UserGroupRepoToPerm, UserGroupToPerm,
+from kallithea.model.db import (Permission, Setting, UserApiKeys, UserGroup, UserGroupMember, UserGroupRepoGroupToPerm, UserGroupRepoToPerm, UserGroupToPerm,
                                 UserGroupUserGroupToPerm, UserIpMap, UserToPerm)
 from kallithea.model.meta import Session
 from kallithea.model.user import UserModel
@@ -117,7 +118,44 @@ def check_password(password, hashed):
     return False
 
 
+# The permissions that satisfy each permission level
+PERMISSION_LEVELS = {
+    'repositories': {
+        'read': ['repository.read', 'repository.write', 'repository.admin'],
+        'write': ['repository.write', 'repository.admin'],
+        'admin': ['repository.admin'],
+    },
+    'repositories_groups': {
+        'read': ['group.read', 'group.write', 'group.admin'],
+        'write': ['group.write', 'group.admin'],
+        'admin': ['group.admin'],
+    },
+    'user_groups': {
+        'read': ['usergroup.read', 'usergroup.write', 'usergroup.admin'],
+        'write': ['usergroup.write', 'usergroup.admin'],
+        'admin': ['usergroup.admin'],
+    },
+}
+
+
 def _cached_perms_data(user_id, user_is_admin):
+    """
+    Returns the permission tree for user_id. Computing it is expensive, so it
+    is cached persistently for the current permissions generation - any
+    change to permissions gives a new generation and thus new cache keys.
+    """
+    generation = Setting.get_permissions_generation()
+    if generation is None:
+        return _get_perms_data(user_id, user_is_admin)
+
+    @cache_region('long_term_file', '_get_perms_data_from_cache')
+    def _get_perms_data_from_cache(*_cache_keys):  # parameters are not really used - only as caching key
+        return _get_perms_data(user_id, user_is_admin)
+
+    return _get_perms_data_from_cache(user_id, user_is_admin, generation)
+
+
+def _get_perms_data(user_id, user_is_admin):
     RK = 'repositories'
     GK = 'repositories_groups'
     UK = 'user_groups'
@@ -442,11 +480,7 @@ class AuthUser(object):
         return _cached_perms_data(self.user_id, self.is_admin)
 
     def has_repository_permission_level(self, repo_name, level, purpose=None):
-        required_perms = {
-            'read': ['repository.read', 'repository.write', 'repository.admin'],
-            'write': ['repository.write', 'repository.admin'],
-            'admin': ['repository.admin'],
-        }[level]
+        required_perms = PERMISSION_LEVELS['repositories'][level]
         actual_perm = self.permissions['repositories'].get(repo_name)
         ok = actual_perm in required_perms
         log.debug('Checking if user %r can %r repo %r (%s): %s (has %r)',
@@ -454,11 +488,7 @@ class AuthUser(object):
         return ok
 
     def has_repository_group_permission_level(self, repo_group_name, level, purpose=None):
-        required_perms = {
-            'read': ['group.read', 'group.write', 'group.admin'],
-            'write': ['group.write', 'group.admin'],
-            'admin': ['group.admin'],
-        }[level]
+        required_perms = PERMISSION_LEVELS['repositories_groups'][level]
         actual_perm = self.permissions['repositories_groups'].get(repo_group_name)
         ok = actual_perm in required_perms
         log.debug('Checking if user %r can %r repo group %r (%s): %s (has %r)',
@@ -466,17 +496,47 @@ class AuthUser(object):
         return ok
 
     def has_user_group_permission_level(self, user_group_name, level, purpose=None):
-        required_perms = {
-            'read': ['usergroup.read', 'usergroup.write', 'usergroup.admin'],
-            'write': ['usergroup.write', 'usergroup.admin'],
-            'admin': ['usergroup.admin'],
-        }[level]
+        required_perms = PERMISSION_LEVELS['user_groups'][level]
         actual_perm = self.permissions['user_groups'].get(user_group_name)
         ok = actual_perm in required_perms
         log.debug('Checking if user %r can %r user group %r (%s): %s (has %r)',
             self.username, level, user_group_name, purpose, ok, actual_perm)
         return ok
 
+    @LazyProperty
+    def _permitted_names_cache(self):
+        return {}
+
+    def _permitted_names(self, kind, level):
+        """
+        Returns the set of names of kind that the user has level permission
+        on - computed once per AuthUser.
+        """
+        try:
+            return self._permitted_names_cache[kind, level]
+        except KeyError:
+            required_perms = PERMISSION_LEVELS[kind][level]
+            names = frozenset(name for name, perm in self.permissions[kind].items()
+                              if perm in required_perms)
+            self._permitted_names_cache[kind, level] = names
+            return names
+
+    def filter_repository_names(self, repo_names, level):
+        """
+        Returns the names in repo_names that the user has level permission on,
+        in the same order - for checking many repositories at once.
+        """
+        permitted = self._permitted_names('repositories', level)
+        return [repo_name for repo_name in repo_names if repo_name in permitted]
+
+    def filter_repository_group_names(self, repo_group_names, level):
+        permitted = self._permitted_names('repositories_groups', level)
+        return [repo_group_name for repo_group_name in repo_group_names if repo_group_name in permitted]
+
+    def filter_user_group_names(self, user_group_names, level):
+        permitted = self._permitted_names('user_groups', level)
+        return [user_group_name for user_group_name in user_group_names if user_group_name in permitted]
+
     @property
     def api_keys(self):
         return self._get_api_keys()
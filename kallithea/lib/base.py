@@ -48,6 +48,7 @@ from kallithea.config.routing import url
 from kallithea.lib import auth_modules, ext_json
 from kallithea.lib.auth import AuthUser, HasPermissionAnyMiddleware
 from kallithea.lib.exceptions import UserCreationError
+from kallithea.lib.pushqueue import start_push_queue_worker
 from kallithea.lib.utils import get_repo_slug, is_valid_repo
 from kallithea.lib.utils2 import AttributeDict, ascii_bytes, safe_int, safe_str, set_hook_environment, str2bool
 from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError, EmptyRepositoryError, RepositoryError
@@ -188,6 +189,44 @@ class BasicAuth(paste.auth.basic.AuthBasicAuthenticator):
     __call__ = authenticate
 
 
+class _CountingInput(object):
+    """Wrapper of wsgi.input counting the bytes read."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.size = 0
+
+    def read(self, *args):
+        data = self.fd.read(*args)
+        if data:
+            self.size += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.fd.readline(*args)
+        if data:
+            self.size += len(data)
+        return data
+
+
+class _ClosingResponse(object):
+    """Response iterable calling ``callback`` when the response is closed."""
+
+    def __init__(self, result, callback):
+        self.result = result
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.callback()
+
+
 class BaseVCSController(object):
     """Base controller for handling Mercurial/Git protocol requests
     (coming from a VCS client, and not a browser).
@@ -305,6 +344,10 @@ class BaseVCSController(object):
         return _get_ip_addr(environ)
 
     def __call__(self, environ, start_response):
+        if self.config.get('push_queue_dir'):
+            # only processes serving requests process the queue - not CLI commands or Celery workers
+            from kallithea.lib.celerylib.tasks import process_push_queue # after CELERY_APP has been set
+            start_push_queue_worker(self.config, process_push_queue)
         try:
             # try parsing a request for this VCS - if it fails, call the wrapped app
             parsed_request = self.parse_request(environ)
@@ -340,6 +383,8 @@ class BaseVCSController(object):
                 log.info('%s action on %s repo "%s" by "%s" from %s',
                          parsed_request.action, self.scm_alias, parsed_request.repo_name, user.username, ip_addr)
                 app = self._make_app(parsed_request)
+                if parsed_request.action == 'push':
+                    return self._count_pushed_size(app, parsed_request.repo_name, environ, start_response)
                 return app(environ, start_response)
             except Exception:
                 log.error(traceback.format_exc())
@@ -348,6 +393,30 @@ class BaseVCSController(object):
         except webob.exc.HTTPException as e:
             return e(environ, start_response)
 
+    def _count_pushed_size(self, app, repo_name, environ, start_response):
+        """
+        Call ``app`` and add the size of the pushed bundle or pack to the
+        stored size of the repository, so pushes don't require scanning the
+        repository.
+        """
+        pushed_on = datetime.datetime.now()
+        environ['wsgi.input'] = counting_input = _CountingInput(environ['wsgi.input'])
+
+        def pushed():
+            if not counting_input.size:
+                return
+            try:
+                repo = Repository.get_by_repo_name(repo_name)
+                if repo is not None:
+                    repo.add_repo_size(counting_input.size, pushed_on)
+                    meta.Session().commit()
+            except Exception:
+                log.error('failed updating size of %s:\n%s', repo_name, traceback.format_exc())
+            finally:
+                meta.Session.remove()
+
+        return _ClosingResponse(app(environ, start_response), pushed)
+
 
 class BaseController(TGController):
 
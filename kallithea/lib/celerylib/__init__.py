@@ -51,6 +51,9 @@ class FakeTask(object):
     def failed(self):
         return False
 
+    def ready(self):
+        return True
+
     traceback = None # if failed
 
     task_id = None
@@ -28,26 +28,27 @@ Original author and date, and relevant copyright and licensing information is be
 
 import email.utils
 import os
+import time
 import traceback
-from collections import OrderedDict
-from operator import itemgetter
-from time import mktime
 
 import celery.utils.log
 from tg import config
 
 import kallithea
 from kallithea.lib import celerylib, ext_json
+from kallithea.lib import pushqueue
 from kallithea.lib.helpers import person
-from kallithea.lib.hooks import log_create_repository
+from kallithea.lib.hooks import log_create_repository, process_pushes
 from kallithea.lib.rcmail.smtp_mailer import SmtpMailer
+from kallithea.lib.statistics import CommitActivity, get_language_stats
 from kallithea.lib.utils import action_logger
-from kallithea.lib.utils2 import ascii_bytes, str2bool
+from kallithea.lib.utils2 import ascii_bytes, safe_int, str2bool
 from kallithea.lib.vcs.utils import author_email
 from kallithea.model.db import RepoGroup, Repository, Statistics, User
+from kallithea.model.meta import Session
 
 
-__all__ = ['whoosh_index', 'get_commits_stats', 'send_email']
+__all__ = ['whoosh_index', 'get_commits_stats', 'process_push_queue', 'update_repo_size', 'send_email']
 
 
 log = celery.utils.log.get_task_logger(__name__)
@@ -71,164 +72,129 @@ def akc(k):
     return person(k).replace('"', '')
 
 
+# save progress of long running statistics tasks this often (in seconds)
+STATS_CHECKPOINT_INTERVAL = 60
+
+
 @celerylib.task
 @celerylib.dbsession
-def get_commits_stats(repo_name, ts_min_y, ts_max_y, recurse_limit=100):
+def get_commits_stats(repo_name):
+    """
+    Update the statistics of a repository with the changesets added since
+    last run. Without Celery, only ``commit_parse_limit`` changesets are
+    processed per invocation. With Celery, all changesets are processed and
+    progress is saved every STATS_CHECKPOINT_INTERVAL seconds so an
+    interrupted run can be resumed.
+    """
     DBS = celerylib.get_session()
-    lockkey = celerylib.__get_lockkey('get_commits_stats', repo_name, ts_min_y,
-                            ts_max_y)
+    lockkey = celerylib.__get_lockkey('get_commits_stats', repo_name)
     lockkey_path = config.get('cache_dir') or config['app_conf']['cache_dir']  # Backward compatibility for TurboGears < 2.4
 
     log.info('running task with lockkey %s', lockkey)
 
     try:
         lock = celerylib.DaemonLock(os.path.join(lockkey_path, lockkey))
+    except celerylib.LockHeld:
+        log.info('Task with key %s already running', lockkey)
+        return 'Task with key %s already running' % lockkey
 
-        co_day_auth_aggr = {}
-        commits_by_day_aggregate = {}
-        repo = Repository.get_by_repo_name(repo_name)
-        if repo is None:
+    try:
+        dbrepo = DBS.query(Repository) \
+            .filter(Repository.repo_name == repo_name).scalar()
+        if dbrepo is None:
             return True
 
-        repo = repo.scm_instance
+        repo = dbrepo.scm_instance
         repo_size = repo.count()
         # return if repo have no revisions
         if repo_size < 1:
-            lock.release()
             return True
 
-        skip_date_limit = True
-        parse_limit = int(config.get('commit_parse_limit'))
-        last_rev = None
-        last_cs = None
-        timegetter = itemgetter('time')
-
-        dbrepo = DBS.query(Repository) \
-            .filter(Repository.repo_name == repo_name).scalar()
         cur_stats = DBS.query(Statistics) \
             .filter(Statistics.repository == dbrepo).scalar()
 
-        if cur_stats is not None:
-            last_rev = cur_stats.stat_on_revision
+        if cur_stats is not None and cur_stats.stat_on_revision < repo_size:
+            start = cur_stats.stat_on_revision + 1
+            activity = CommitActivity(cur_stats.commit_activity,
+                                      cur_stats.commit_activity_combined)
+        else:
+            # no statistics yet - or the repository has been stripped
+            start = 0
+            activity = CommitActivity()
 
-        if last_rev == repo.get_changeset().revision and repo_size > 1:
-            # pass silently without any work if we're not on first revision or
-            # current state of parsing revision(from db marker) is the
-            # last revision
-            lock.release()
+        if start >= repo_size:
+            # pass silently without any work - all revisions have been parsed
             return True
 
-        if cur_stats:
-            commits_by_day_aggregate = OrderedDict(ext_json.loads(
-                                        cur_stats.commit_activity_combined))
-            co_day_auth_aggr = ext_json.loads(cur_stats.commit_activity)
-
-        log.debug('starting parsing %s', parse_limit)
-
-        last_rev = last_rev + 1 if last_rev and last_rev >= 0 else 0
-        log.debug('Getting revisions from %s to %s',
-             last_rev, last_rev + parse_limit
-        )
-        for cs in repo[last_rev:last_rev + parse_limit]:
-            log.debug('parsing %s', cs)
-            last_cs = cs  # remember last parsed changeset
-            tt = cs.date.timetuple()
-            k = mktime(tt[:3] + (0, 0, 0, 0, 0, 0))
-
-            if akc(cs.author) in co_day_auth_aggr:
-                try:
-                    l = [timegetter(x) for x in
-                         co_day_auth_aggr[akc(cs.author)]['data']]
-                    time_pos = l.index(k)
-                except ValueError:
-                    time_pos = None
-
-                if time_pos is not None and time_pos >= 0:
-                    datadict = \
-                        co_day_auth_aggr[akc(cs.author)]['data'][time_pos]
-
-                    datadict["commits"] += 1
-                    datadict["added"] += len(cs.added)
-                    datadict["changed"] += len(cs.changed)
-                    datadict["removed"] += len(cs.removed)
-
-                else:
-                    if k >= ts_min_y and k <= ts_max_y or skip_date_limit:
-
-                        datadict = {"time": k,
-                                    "commits": 1,
-                                    "added": len(cs.added),
-                                    "changed": len(cs.changed),
-                                    "removed": len(cs.removed),
-                                   }
-                        co_day_auth_aggr[akc(cs.author)]['data'] \
-                            .append(datadict)
-
-            else:
-                if k >= ts_min_y and k <= ts_max_y or skip_date_limit:
-                    co_day_auth_aggr[akc(cs.author)] = {
-                                        "label": akc(cs.author),
-                                        "data": [{"time": k,
-                                                 "commits": 1,
-                                                 "added": len(cs.added),
-                                                 "changed": len(cs.changed),
-                                                 "removed": len(cs.removed),
-                                                 }],
-                                        "schema": ["commits"],
-                                        }
-
-            # gather all data by day
-            if k in commits_by_day_aggregate:
-                commits_by_day_aggregate[k] += 1
-            else:
-                commits_by_day_aggregate[k] = 1
-
-        overview_data = sorted(commits_by_day_aggregate.items(),
-                               key=itemgetter(0))
-
-        if not co_day_auth_aggr:
-            co_day_auth_aggr[akc(repo.contact)] = {
-                "label": akc(repo.contact),
-                "data": [0, 1],
-                "schema": ["commits"],
-            }
+        if kallithea.CELERY_APP:
+            end = repo_size
+        else:
+            end = min(start + safe_int(config.get('commit_parse_limit'), 25), repo_size)
+        log.debug('Getting revisions from %s to %s', start, end)
 
         stats = cur_stats if cur_stats else Statistics()
-        stats.commit_activity = ascii_bytes(ext_json.dumps(co_day_auth_aggr))
-        stats.commit_activity_combined = ascii_bytes(ext_json.dumps(overview_data))
-
-        log.debug('last revision %s', last_rev)
-        leftovers = len(repo.revisions[last_rev:])
-        log.debug('revisions to parse %s', leftovers)
-
-        if last_rev == 0 or leftovers < parse_limit:
-            log.debug('getting code trending stats')
-            stats.languages = ascii_bytes(ext_json.dumps(__get_codes_stats(repo_name)))
+        stats.repository = dbrepo
+        log.debug('getting code trending stats')
+        if start == 0:
+            languages, stats.languages_revision = get_language_stats(repo)
+        else:
+            languages, stats.languages_revision = get_language_stats(repo,
+                ext_json.loads(stats.languages), stats.languages_revision)
+        stats.languages = ascii_bytes(ext_json.dumps(languages))
+
+        checkpoint = time.time()
+        for cs in repo.get_changesets_metadata(start, end):
+            activity.add(akc(cs.author), cs.date,
+                         len(cs.added), len(cs.changed), len(cs.removed))
+            if time.time() - checkpoint > STATS_CHECKPOINT_INTERVAL:
+                log.debug('saving statistics checkpoint at revision %s', cs.revision)
+                _save_commits_stats(DBS, stats, activity, cs.revision, akc(repo.contact))
+                checkpoint = time.time()
 
         try:
-            stats.repository = dbrepo
-            stats.stat_on_revision = last_cs.revision if last_cs else 0
-            DBS.add(stats)
-            DBS.commit()
+            _save_commits_stats(DBS, stats, activity, end - 1, akc(repo.contact))
         except:
             log.error(traceback.format_exc())
             DBS.rollback()
-            lock.release()
             return False
-
-        # final release
+        return True
+    finally:
         lock.release()
 
-        # execute another task if celery is enabled
-        if len(repo.revisions) > 1 and kallithea.CELERY_APP and recurse_limit > 0:
-            get_commits_stats(repo_name, ts_min_y, ts_max_y, recurse_limit - 1)
-        elif recurse_limit <= 0:
-            log.debug('Not recursing - limit has been reached')
-        else:
-            log.debug('Not recursing')
-    except celerylib.LockHeld:
-        log.info('Task with key %s already running', lockkey)
-        return 'Task with key %s already running' % lockkey
+
+def _save_commits_stats(DBS, stats, activity, revision, contact_label):
+    stats.commit_activity, stats.commit_activity_combined = activity.dump(contact_label)
+    stats.stat_on_revision = revision
+    DBS.add(stats)
+    DBS.commit()
+
+
+@celerylib.task
+@celerylib.dbsession
+def process_push_queue():
+    """
+    Process the pushes queued in push_queue_dir, and update the statistics of
+    the repositories that have them enabled.
+    """
+    def process(repo_name, pushes):
+        process_pushes(repo_name, pushes)
+        dbrepo = Repository.get_by_repo_name(repo_name)
+        if dbrepo is not None and dbrepo.enable_statistics:
+            get_commits_stats(repo_name)
+
+    try:
+        pushqueue.process_push_queue(pushqueue.get_push_queue_dir(), process)
+    finally:
+        Session.remove() # without Celery, run in a thread of its own
+
+
+@celerylib.task
+@celerylib.dbsession
+def update_repo_size(repo_name):
+    dbrepo = Repository.get_by_repo_name(repo_name)
+    if dbrepo is not None:
+        dbrepo.update_repo_size()
+        Session().commit()
 
 
 @celerylib.task
@@ -477,22 +443,3 @@ def create_repo_fork(form_data, cur_user):
         raise
 
     return True
-
-
-def __get_codes_stats(repo_name):
-    from kallithea.config.conf import LANGUAGES_EXTENSIONS_MAP
-    repo = Repository.get_by_repo_name(repo_name).scm_instance
-
-    tip = repo.get_changeset()
-    code_stats = {}
-
-    for _topnode, _dirnodes, filenodes in tip.walk('/'):
-        for filenode in filenodes:
-            ext = filenode.extension.lower()
-            if ext in LANGUAGES_EXTENSIONS_MAP and not filenode.is_binary:
-                if ext in code_stats:
-                    code_stats[ext] += 1
-                else:
-                    code_stats[ext] = 1
-
-    return code_stats or {}
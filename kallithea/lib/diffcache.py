@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+kallithea.lib.diffcache
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Persistent cache of parsed and rendered diffs.
+
+The diff between two changesets never changes, so the result of parsing and
+rendering it can be kept on disk and shared by all worker processes. Entries
+are identified by a hash of the changeset hashes and the diff options, and
+contain a sequence of pickled records. They are written to a temporary file
+and renamed into place, so readers in other processes never see partial
+entries. When the cache grows beyond its size limit, the least recently used
+entries are removed.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from kallithea.lib.utils2 import safe_int
+
+
+log = logging.getLogger(__name__)
+
+
+class DiffCache(object):
+    """
+    Directory with cache entries named by their key, with at most
+    ``max_size`` bytes of entries. Reading an entry updates its mtime, which
+    is used for evicting the least recently used entries.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        # check the size of the cache on the first write in this process
+        self._written = max_size
+
+    @staticmethod
+    def key(*args):
+        """Return the cache key for the given (repr-able) arguments."""
+        return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """
+        Return the list of records stored for ``key``, or None if there is no
+        valid entry.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                records = []
+                while True:
+                    try:
+                        records.append(pickle.load(f))
+                    except EOFError:
+                        break
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning('removing invalid diff cache entry %s: %s', entry_path, e)
+            self._remove(entry_path)
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass # evicted by another process - it was still complete when read
+        return records
+
+    def put(self, key, records):
+        """Store the list ``records`` as the entry for ``key``."""
+        entry_path = self._entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=entry_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for record in records:
+                    pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+        self._written += size
+        if self._written >= self.max_size // 10:
+            self._written = 0
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size is below
+        ``max_size``. Several processes might do this at the same time.
+        """
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for fn in filenames:
+                if fn.startswith('.tmp'):
+                    continue
+                entry_path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry_path))
+                total += st.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        removed = 0
+        for mtime, size, entry_path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(entry_path)
+            total -= size
+            removed += 1
+        log.debug('removed %s entries from diff cache %s', removed, self.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+_diff_cache = None
+
+
+def get_diff_cache():
+    """
+    Return the DiffCache configured with ``diff_cache_dir`` (default is a
+    ``diffcache`` directory in ``cache_dir``) and ``diff_cache_size`` in MB -
+    or None if the size is 0 or there is no cache directory.
+    """
+    global _diff_cache
+    from kallithea import CONFIG
+    max_size = safe_int(CONFIG.get('diff_cache_size'), 256) * 1024 * 1024
+    path = CONFIG.get('diff_cache_dir')
+    if not path and CONFIG.get('cache_dir'):
+        path = os.path.join(CONFIG['cache_dir'], 'diffcache')
+    if not path or max_size <= 0:
+        return None
+    if _diff_cache is None or _diff_cache.path != path or _diff_cache.max_size != max_size:
+        _diff_cache = DiffCache(path, max_size)
+    return _diff_cache
@@ -25,17 +25,19 @@ Original author and date, and relevant copyright and licensing information is be
 :copyright: (c) 2013 RhodeCode GmbH, and others.
 :license: GPLv3, see LICENSE.md for more details.
 """
-import difflib
+import collections
 import logging
 import re
 
 from tg.i18n import ugettext as _
 
+from kallithea.lib import diffcache
 from kallithea.lib import helpers as h
-from kallithea.lib.utils2 import safe_str
+from kallithea.lib.utils2 import safe_int, safe_str
 from kallithea.lib.vcs.backends.base import EmptyChangeset
 from kallithea.lib.vcs.exceptions import VCSError
 from kallithea.lib.vcs.nodes import FileNode, SubModuleNode
+from kallithea.lib.vcs.utils.lazy import LazyProperty
 
 
 log = logging.getLogger(__name__)
@@ -66,9 +68,11 @@ def _safe_id(idstring):
 def as_html(table_class='code-difftable', line_class='line',
             old_lineno_class='lineno old', new_lineno_class='lineno new',
             no_lineno_class='lineno',
-            code_class='code', enable_comments=False, parsed_lines=None):
+            code_class='code', enable_comments=False, parsed_lines=None,
+            inline_diff=True):
     """
-    Return given diff as html table with customized css classes
+    Return given diff as html table with customized css classes.
+    Optionally, add extra markup of one-liner changes.
     """
     def _link_to_if(condition, label, url):
         """
@@ -90,29 +94,32 @@ def as_html(table_class='code-difftable', line_class='line',
     })
 
     for diff in parsed_lines:
+        budget = InlineDiffBudget() if inline_diff else None
         for line in diff['chunks']:
             _html_empty = False
+            if inline_diff:
+                line = _inline_diff(line, budget)
             for change in line:
                 _html.append('''<tr class="%(lc)s %(action)s">\n''' % {
                     'lc': line_class,
-                    'action': change['action']
+                    'action': change.action
                 })
                 anchor_old_id = ''
                 anchor_new_id = ''
                 anchor_old = "%(filename)s_o%(oldline_no)s" % {
                     'filename': _safe_id(diff['filename']),
-                    'oldline_no': change['old_lineno']
+                    'oldline_no': change.old_lineno
                 }
                 anchor_new = "%(filename)s_n%(oldline_no)s" % {
                     'filename': _safe_id(diff['filename']),
-                    'oldline_no': change['new_lineno']
+                    'oldline_no': change.new_lineno
                 }
-                cond_old = (change['old_lineno'] != '...' and
-                            change['old_lineno'])
-                cond_new = (change['new_lineno'] != '...' and
-                            change['new_lineno'])
-                no_lineno = (change['old_lineno'] == '...' and
-                             change['new_lineno'] == '...')
+                cond_old = (change.old_lineno != '...' and
+                            change.old_lineno)
+                cond_new = (change.new_lineno != '...' and
+                            change.new_lineno)
+                no_lineno = (change.old_lineno == '...' and
+                             change.new_lineno == '...')
                 if cond_old:
                     anchor_old_id = 'id="%s"' % anchor_old
                 if cond_new:
@@ -127,7 +134,7 @@ def as_html(table_class='code-difftable', line_class='line',
                 })
 
                 _html.append('''%(link)s''' % {
-                    'link': _link_to_if(not no_lineno, change['old_lineno'],
+                    'link': _link_to_if(not no_lineno, change.old_lineno,
                                         '#%s' % anchor_old)
                 })
                 _html.append('''</td>\n''')
@@ -142,7 +149,7 @@ def as_html(table_class='code-difftable', line_class='line',
                     })
 
                     _html.append('''%(link)s''' % {
-                        'link': _link_to_if(True, change['new_lineno'],
+                        'link': _link_to_if(True, change.new_lineno,
                                             '#%s' % anchor_new)
                     })
                     _html.append('''</td>\n''')
@@ -155,7 +162,7 @@ def as_html(table_class='code-difftable', line_class='line',
                     'inc': comments
                 })
                 _html.append('''\n\t\t<div class="add-bubble"><div>&nbsp;</div></div><pre>%(code)s</pre>\n''' % {
-                    'code': change['line']
+                    'code': change.line
                 })
 
                 _html.append('''\t</td>''')
@@ -166,6 +173,33 @@ def as_html(table_class='code-difftable', line_class='line',
     return ''.join(_html)
 
 
+class DiffHtml(object):
+    """
+    HTML table for the diff of one file as parsed by DiffProcessor. It is
+    rendered by as_html when converted to str - when the template gets to the
+    file. The parsed lines of the file are released when it has been
+    rendered, so they are only kept for the files that haven't been rendered
+    yet. The markup itself ends up in the page buffer anyway and is kept as
+    ``html``.
+
+    If ``rendered`` is given, it is called when the diff has been rendered.
+    """
+
+    def __init__(self, parsed_file, enable_comments=False, rendered=None):
+        self.parsed_file = parsed_file
+        self.enable_comments = enable_comments
+        self.rendered = rendered
+        self.html = None
+
+    def __str__(self):
+        if self.html is None:
+            self.html = as_html(enable_comments=self.enable_comments, parsed_lines=[self.parsed_file]) or ''
+            self.parsed_file = None
+            if self.rendered is not None:
+                self.rendered()
+        return self.html
+
+
 def wrap_to_table(html):
     """Given a string with html, return it wrapped in a table, similar to what
     DiffProcessor returns."""
@@ -264,6 +298,90 @@ def get_diff(scm_instance, rev1, rev2, path=None, ignore_whitespace=False, conte
         return b''
 
 
+# bump when the parsed or rendered diffs change, invalidating the diff cache
+DIFF_CACHE_VERSION = 2
+
+
+def get_diff_files(scm_instance, rev1, rev2, ignore_whitespace=False, context=3,
+                   vcs='hg', diff_limit=None, enable_comments=False):
+    """
+    Return a tuple with limited_diff and a list of dicts for the files in the
+    diff between the changeset hashes ``rev1`` and ``rev2``. The dicts have
+    the meta info from DiffProcessor and the diff as 'html'.
+
+    The diff only depends on the changesets and options, so the files are
+    kept in the persistent diff cache and the repository is only diffed on
+    the first request. When not cached, 'html' is a DiffHtml that is rendered
+    when the template gets to it, and the files are put in the cache when all
+    of them have been rendered.
+    """
+    diff_cache = diffcache.get_diff_cache()
+    if diff_cache is not None:
+        budget = InlineDiffBudget()
+        key = diff_cache.key(DIFF_CACHE_VERSION, rev1, rev2, ignore_whitespace,
+                             context, vcs, diff_limit, enable_comments,
+                             budget.line_budget, budget.file_budget)
+        records = diff_cache.get(key)
+        if records is not None:
+            return records[0], records[1:]
+
+    raw_diff = get_diff(scm_instance, rev1, rev2,
+                        ignore_whitespace=ignore_whitespace, context=context)
+    diff_processor = DiffProcessor(raw_diff, vcs=vcs, diff_limit=diff_limit)
+    files = []
+    # an empty diff might also be get_diff failing - don't cache that
+    writer = None
+    if diff_cache is not None and raw_diff:
+        writer = _DiffCacheWriter(diff_cache, key, files)
+    for f in diff_processor:
+        files.append({
+            'old_filename': f['old_filename'],
+            'filename': f['filename'],
+            'operation': f['operation'],
+            'stats': f['stats'],
+            'html': DiffHtml(f, enable_comments=enable_comments,
+                             rendered=writer.rendered if writer is not None else None),
+        })
+    if writer is not None:
+        writer.start(diff_processor.limited_diff)
+    return diff_processor.limited_diff, files
+
+
+class _DiffCacheWriter(object):
+    """
+    Put the list of files with DiffHtml in the diff cache when the last of
+    them has been rendered.
+    """
+
+    def __init__(self, diff_cache, key, files):
+        self.diff_cache = diff_cache
+        self.key = key
+        self.files = files
+        self.limited_diff = None
+        self.pending = None
+
+    def start(self, limited_diff):
+        """Called when all files have been added."""
+        self.limited_diff = limited_diff
+        self.pending = len(self.files)
+        if not self.pending:
+            self._put()
+
+    def rendered(self):
+        self.pending -= 1
+        if not self.pending:
+            self._put()
+
+    def _put(self):
+        records = [self.limited_diff]
+        for f in self.files:
+            records.append(dict(f, html=f['html'].html))
+        try:
+            self.diff_cache.put(self.key, records)
+        except (IOError, OSError) as e:
+            log.warning('Failed writing diff cache entry %s: %s', self.key, e)
+
+
 NEW_FILENODE = 1
 DEL_FILENODE = 2
 MOD_FILENODE = 3
@@ -273,15 +391,19 @@ CHMOD_FILENODE = 6
 BIN_FILENODE = 7
 
 
+DiffLine = collections.namedtuple('DiffLine', ['action', 'old_lineno', 'new_lineno', 'line'])
+
+
 class DiffProcessor(object):
     """
-    Give it a unified or git diff and it returns a list of the files that were
+    Give it a unified or git diff and iterate it to get the files that were
     mentioned in the diff together with a dict of meta information that
-    can be used to render it in a HTML template.
+    can be used to render it in a HTML template. Each file is parsed when it
+    is reached, and diff lines are ``DiffLine`` tuples.
     """
     _diff_git_re = re.compile(b'^diff --git', re.MULTILINE)
 
-    def __init__(self, diff, vcs='hg', diff_limit=None, inline_diff=True):
+    def __init__(self, diff, vcs='hg', diff_limit=None):
         """
         :param diff:   a text in diff format
         :param vcs: type of version control hg or git
@@ -298,153 +420,120 @@ class DiffProcessor(object):
         self.diff_limit = diff_limit
         self.limited_diff = False
         self.vcs = vcs
-        self.parsed = self._parse_gitdiff(inline_diff=inline_diff)
-
-    def _parse_gitdiff(self, inline_diff):
-        """Parse self._diff and return a list of dicts with meta info and chunks for each file.
-        Might set limited_diff.
-        Optionally, do an extra pass and to extra markup of one-liner changes.
-        """
-        _files = [] # list of dicts with meta info and chunks
 
         starts = [m.start() for m in self._diff_git_re.finditer(self._diff)]
         starts.append(len(self._diff))
-
+        self._file_ranges = []
         for start, end in zip(starts, starts[1:]):
             if self.diff_limit and end > self.diff_limit:
                 self.limited_diff = True
                 continue
-
-            head, diff_lines = _get_header(self.vcs, self._diff[start:end])
-
-            op = None
-            stats = {
-                'added': 0,
-                'deleted': 0,
-                'binary': False,
-                'ops': {},
-            }
-
-            if head['deleted_file_mode']:
-                op = 'removed'
+            self._file_ranges.append((start, end))
+
+    def __iter__(self):
+        """Parse self._diff and yield a dict with meta info and chunks for each file."""
+        for start, end in self._file_ranges:
+            yield self._parse_file(self._diff[start:end])
+
+    def __len__(self):
+        return len(self._file_ranges)
+
+    @LazyProperty
+    def parsed(self):
+        """List of dicts with meta info and chunks for all files."""
+        return list(self)
+
+    def _parse_file(self, diff_chunk):
+        head, diff_lines = _get_header(self.vcs, diff_chunk)
+
+        op = None
+        stats = {
+            'added': 0,
+            'deleted': 0,
+            'binary': False,
+            'ops': {},
+        }
+
+        if head['deleted_file_mode']:
+            op = 'removed'
+            stats['binary'] = True
+            stats['ops'][DEL_FILENODE] = 'deleted file'
+
+        elif head['new_file_mode']:
+            op = 'added'
+            stats['binary'] = True
+            stats['ops'][NEW_FILENODE] = 'new file %s' % head['new_file_mode']
+        else:  # modify operation, can be cp, rename, chmod
+            # CHMOD
+            if head['new_mode'] and head['old_mode']:
+                op = 'modified'
                 stats['binary'] = True
-                stats['ops'][DEL_FILENODE] = 'deleted file'
-
-            elif head['new_file_mode']:
-                op = 'added'
+                stats['ops'][CHMOD_FILENODE] = ('modified file chmod %s => %s'
+                                    % (head['old_mode'], head['new_mode']))
+            # RENAME
+            if (head['rename_from'] and head['rename_to']
+                  and head['rename_from'] != head['rename_to']):
+                op = 'renamed'
                 stats['binary'] = True
-                stats['ops'][NEW_FILENODE] = 'new file %s' % head['new_file_mode']
-            else:  # modify operation, can be cp, rename, chmod
-                # CHMOD
-                if head['new_mode'] and head['old_mode']:
-                    op = 'modified'
-                    stats['binary'] = True
-                    stats['ops'][CHMOD_FILENODE] = ('modified file chmod %s => %s'
-                                        % (head['old_mode'], head['new_mode']))
-                # RENAME
-                if (head['rename_from'] and head['rename_to']
-                      and head['rename_from'] != head['rename_to']):
-                    op = 'renamed'
-                    stats['binary'] = True
-                    stats['ops'][RENAMED_FILENODE] = ('file renamed from %s to %s'
-                                    % (head['rename_from'], head['rename_to']))
-                # COPY
-                if head.get('copy_from') and head.get('copy_to'):
-                    op = 'modified'
+                stats['ops'][RENAMED_FILENODE] = ('file renamed from %s to %s'
+                                % (head['rename_from'], head['rename_to']))
+            # COPY
+            if head.get('copy_from') and head.get('copy_to'):
+                op = 'modified'
+                stats['binary'] = True
+                stats['ops'][COPIED_FILENODE] = ('file copied from %s to %s'
+                                    % (head['copy_from'], head['copy_to']))
+            # FALL BACK: detect missed old style add or remove
+            if op is None:
+                if not head['a_file'] and head['b_file']:
+                    op = 'added'
                     stats['binary'] = True
-                    stats['ops'][COPIED_FILENODE] = ('file copied from %s to %s'
-                                        % (head['copy_from'], head['copy_to']))
-                # FALL BACK: detect missed old style add or remove
-                if op is None:
-                    if not head['a_file'] and head['b_file']:
-                        op = 'added'
-                        stats['binary'] = True
-                        stats['ops'][NEW_FILENODE] = 'new file'
-
-                    elif head['a_file'] and not head['b_file']:
-                        op = 'removed'
-                        stats['binary'] = True
-                        stats['ops'][DEL_FILENODE] = 'deleted file'
-
-                # it's not ADD not DELETE
-                if op is None:
-                    op = 'modified'
+                    stats['ops'][NEW_FILENODE] = 'new file'
+
+                elif head['a_file'] and not head['b_file']:
+                    op = 'removed'
                     stats['binary'] = True
-                    stats['ops'][MOD_FILENODE] = 'modified file'
-
-            # a real non-binary diff
-            if head['a_file'] or head['b_file']:
-                chunks, added, deleted = _parse_lines(diff_lines)
-                stats['binary'] = False
-                stats['added'] = added
-                stats['deleted'] = deleted
-                # explicit mark that it's a modified file
-                if op == 'modified':
-                    stats['ops'][MOD_FILENODE] = 'modified file'
-            else:  # Git binary patch (or empty diff)
-                # Git binary patch
-                if head['bin_patch']:
-                    stats['ops'][BIN_FILENODE] = 'binary diff not shown'
-                chunks = []
-
-            if op == 'removed' and chunks:
-                # a way of seeing deleted content could perhaps be nice - but
-                # not with the current UI
-                chunks = []
-
-            chunks.insert(0, [{
-                'old_lineno': '',
-                'new_lineno': '',
-                'action':     'context',
-                'line':       msg,
-                } for _op, msg in stats['ops'].items()
-                  if _op not in [MOD_FILENODE]])
-
-            _files.append({
-                'old_filename':     head['a_path'],
-                'filename':         head['b_path'],
-                'old_revision':     head['a_blob_id'],
-                'new_revision':     head['b_blob_id'],
-                'chunks':           chunks,
-                'operation':        op,
-                'stats':            stats,
-            })
-
-        if not inline_diff:
-            return _files
-
-        # highlight inline changes when one del is followed by one add
-        for diff_data in _files:
-            for chunk in diff_data['chunks']:
-                lineiter = iter(chunk)
-                try:
-                    peekline = next(lineiter)
-                    while True:
-                        # find a first del line
-                        while peekline['action'] != 'del':
-                            peekline = next(lineiter)
-                        delline = peekline
-                        peekline = next(lineiter)
-                        # if not followed by add, eat all following del lines
-                        if peekline['action'] != 'add':
-                            while peekline['action'] == 'del':
-                                peekline = next(lineiter)
-                            continue
-                        # found an add - make sure it is the only one
-                        addline = peekline
-                        try:
-                            peekline = next(lineiter)
-                        except StopIteration:
-                            # add was last line - ok
-                            _highlight_inline_diff(delline, addline)
-                            raise
-                        if peekline['action'] != 'add':
-                            # there was only one add line - ok
-                            _highlight_inline_diff(delline, addline)
-                except StopIteration:
-                    pass
-
-        return _files
+                    stats['ops'][DEL_FILENODE] = 'deleted file'
+
+            # it's not ADD not DELETE
+            if op is None:
+                op = 'modified'
+                stats['binary'] = True
+                stats['ops'][MOD_FILENODE] = 'modified file'
+
+        # a real non-binary diff
+        if head['a_file'] or head['b_file']:
+            chunks, added, deleted = _parse_lines(diff_lines)
+            stats['binary'] = False
+            stats['added'] = added
+            stats['deleted'] = deleted
+            # explicit mark that it's a modified file
+            if op == 'modified':
+                stats['ops'][MOD_FILENODE] = 'modified file'
+        else:  # Git binary patch (or empty diff)
+            # Git binary patch
+            if head['bin_patch']:
+                stats['ops'][BIN_FILENODE] = 'binary diff not shown'
+            chunks = []
+
+        if op == 'removed' and chunks:
+            # a way of seeing deleted content could perhaps be nice - but
+            # not with the current UI
+            chunks = []
+
+        chunks.insert(0, [DiffLine('context', '', '', msg)
+                          for _op, msg in stats['ops'].items()
+                          if _op not in [MOD_FILENODE]])
+
+        return {
+            'old_filename':     head['a_path'],
+            'filename':         head['b_path'],
+            'old_revision':     head['a_blob_id'],
+            'new_revision':     head['b_blob_id'],
+            'chunks':           chunks,
+            'operation':        op,
+            'stats':            stats,
+        }
 
     def stat(self):
         """
@@ -552,8 +641,8 @@ _newline_marker = re.compile(r'^\\ No newline at end of file')
 
 def _parse_lines(diff_lines):
     """
-    Given an iterator of diff body lines, parse them and return a dict per
-    line and added/removed totals.
+    Given an iterator of diff body lines, parse them and return a list of
+    ``DiffLine`` per chunk and added/removed totals.
     """
     added = deleted = 0
     old_line = old_end = new_line = new_end = None
@@ -584,12 +673,7 @@ def _parse_lines(diff_lines):
             if context:
                 # skip context only if it's first line
                 if int(gr[0]) > 1:
-                    lines.append({
-                        'old_lineno': '...',
-                        'new_lineno': '...',
-                        'action':     'context',
-                        'line':       line,
-                    })
+                    lines.append(DiffLine('context', '...', '...', line))
 
             line = next(diff_lines)
 
@@ -617,24 +701,17 @@ def _parse_lines(diff_lines):
                 if not _newline_marker.match(line):
                     old_line += affects_old
                     new_line += affects_new
-                    lines.append({
-                        'old_lineno':   affects_old and old_line or '',
-                        'new_lineno':   affects_new and new_line or '',
-                        'action':       action,
-                        'line':         line[1:],
-                    })
+                    lines.append(DiffLine(action,
+                                          affects_old and old_line or '',
+                                          affects_new and new_line or '',
+                                          line[1:]))
 
                 line = next(diff_lines)
 
                 if _newline_marker.match(line):
                     # we need to append to lines, since this is not
                     # counted in the line specs of diff
-                    lines.append({
-                        'old_lineno':   '...',
-                        'new_lineno':   '...',
-                        'action':       'context',
-                        'line':         line,
-                    })
+                    lines.append(DiffLine('context', '...', '...', line))
                     line = next(diff_lines)
             if old_line > old_end:
                 raise Exception('error parsing diff - more than %s "-" lines at -%s+%s' % (old_end, old_line, new_line))
@@ -651,23 +728,62 @@ def _parse_lines(diff_lines):
 _token_re = re.compile(r'()(&amp;|&lt;|&gt;|<u>\t</u>|<u class="cr"></u>| <i></i>|\W+?)')
 
 
-def _highlight_inline_diff(old, new):
+class InlineDiffBudget(object):
     """
-    Highlight simple add/remove in two lines given as info dicts. They are
-    modified in place and given markup with <del>/<ins>.
+    Bound the cost of inline highlighting of the lines of one file. Each line
+    pair may cost at most ``line_budget`` and all lines ``file_budget``, in
+    units of tokens compared. Lines that are too different are highlighted
+    as changed between their common prefix and suffix, and no lines are
+    highlighted when the file budget has been spent.
     """
-    assert old['action'] == 'del'
-    assert new['action'] == 'add'
 
-    oldwords = _token_re.split(old['line'])
-    newwords = _token_re.split(new['line'])
-    sequence = difflib.SequenceMatcher(None, oldwords, newwords)
+    def __init__(self, line_budget=None, file_budget=None):
+        if line_budget is None or file_budget is None:
+            from kallithea import CONFIG
+            if line_budget is None:
+                line_budget = safe_int(CONFIG.get('inline_diff_line_budget'), 50000)
+            if file_budget is None:
+                file_budget = safe_int(CONFIG.get('inline_diff_file_budget'), 500000)
+        self.line_budget = line_budget
+        self.file_budget = file_budget
+
+
+def _inline_diff(lines, budget=None):
+    """
+    Return list of ``DiffLine`` with inline highlighting of changes where one
+    del line is followed by one add line.
+    """
+    if budget is None:
+        budget = InlineDiffBudget()
+    lines = list(lines)
+    for i in range(len(lines) - 1):
+        if budget.file_budget <= 0:
+            break
+        if (lines[i].action == 'del' and lines[i + 1].action == 'add' and
+            (i == 0 or lines[i - 1].action != 'del') and
+            (i + 2 == len(lines) or lines[i + 2].action != 'add')):
+            old, new, cost = _highlight_inline_diff(lines[i].line, lines[i + 1].line,
+                                                    min(budget.line_budget, budget.file_budget))
+            budget.file_budget -= cost
+            lines[i] = lines[i]._replace(line=old)
+            lines[i + 1] = lines[i + 1]._replace(line=new)
+    return lines
+
+
+def _highlight_inline_diff(old, new, max_cost=None):
+    """
+    Highlight simple add/remove in two lines given as strings. Return them
+    with markup with <del>/<ins>, and the cost of finding the changes.
+    """
+    oldwords = _token_re.split(old)
+    newwords = _token_re.split(new)
+    opcodes, cost = _diff_tokens(oldwords, newwords, max_cost)
 
     oldfragments, newfragments = [], []
-    for tag, i1, i2, j1, j2 in sequence.get_opcodes():
+    for equal, i1, i2, j1, j2 in opcodes:
         oldfrag = ''.join(oldwords[i1:i2])
         newfrag = ''.join(newwords[j1:j2])
-        if tag != 'equal':
+        if not equal:
             if oldfrag:
                 oldfrag = '<del>%s</del>' % oldfrag
             if newfrag:
@@ -675,5 +791,101 @@ def _highlight_inline_diff(old, new):
         oldfragments.append(oldfrag)
         newfragments.append(newfrag)
 
-    old['line'] = "".join(oldfragments)
-    new['line'] = "".join(newfragments)
+    return "".join(oldfragments), "".join(newfragments), cost
+
+
+def _diff_tokens(a, b, max_cost=None):
+    """
+    Compare the token lists ``a`` and ``b`` and return a list of
+    ``(equal, i1, i2, j1, j2)`` for the ranges that are equal or changed, and
+    the cost in tokens compared.
+
+    After stripping the common prefix and suffix, the Myers algorithm finds
+    the shortest edit script in O((N+M)D) time, where D is the number of
+    tokens removed and added. If that would cost more than ``max_cost``,
+    everything between the common prefix and suffix is one change.
+    """
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+    cost = prefix + suffix + 1
+
+    matches = []
+    if prefix < n - suffix and prefix < m - suffix:
+        remaining = None if max_cost is None else max_cost - cost
+        matches, myers_cost = _myers_matches(a, b, prefix, n - suffix, prefix, m - suffix, remaining)
+        cost += myers_cost
+        if matches is None:
+            matches = []
+
+    opcodes = []
+    i = j = 0
+    for x, y in ([(x, x) for x in range(prefix)] + matches +
+                 [(n - x, m - x) for x in range(suffix, 0, -1)] + [(n, m)]):
+        if x > i or y > j:
+            opcodes.append((False, i, x, j, y))
+        if x < n or y < m:
+            if opcodes and opcodes[-1][0]:
+                opcodes[-1] = (True, opcodes[-1][1], x + 1, opcodes[-1][3], y + 1)
+            else:
+                opcodes.append((True, x, x + 1, y, y + 1))
+        i, j = x + 1, y + 1
+    return opcodes, cost
+
+
+def _myers_matches(a, b, a_start, a_end, b_start, b_end, max_cost=None):
+    """
+    Return a list of ``(i, j)`` positions where ``a[i] == b[j]`` in a longest
+    common subsequence of ``a[a_start:a_end]`` and ``b[b_start:b_end]``, and
+    the cost. The list is None if the cost would exceed ``max_cost``.
+    """
+    n = a_end - a_start
+    m = b_end - b_start
+    cost = 0
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_start + x] == b[b_start + y]:
+                x += 1
+                y += 1
+                cost += 1
+            v[k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            cost += d + 1
+            if max_cost is not None and cost > max_cost:
+                return None, cost
+            continue
+        break
+
+    # walk back through the trace and collect the matches on the way
+    matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((a_start + x, b_start + y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches, cost
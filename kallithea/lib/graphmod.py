@@ -15,10 +15,55 @@
 Modified mercurial DAG graph functions that re-uses VCS structure
 
 It allows to have a shared codebase for DAG generation for hg and git repos
+
+The layout of the full history is also persisted in a file in the repository
+control directory, so the default changelog can slice precomputed rows instead
+of walking the DAG for every page. The file is extended incrementally when new
+revisions show up: the new revisions are laid out on top of the old rows until
+the lanes converge with what was computed before, and the remaining old rows
+are reused - with colors renumbered if necessary.
+
+File layout (all integers are big endian int32)::
+
+    magic | count | nheads | state key (20) | heads (nheads * (rev, name hash)) | index (count * (rev, offset)) | rows
+
+Each row is a sequence of integers::
+
+    rev, col, color, newcolor, nparents, parents..., nedges, (col, nextcol, color, lane rev)...
+
+Rows are stored in descending revision order and the index is in ascending
+order. Lane revs are stored instead of obsolete flags for edges, so flags that
+can change over time are looked up when rows are used.
+
+For Git, the branch heads the layout was computed with are stored too: they
+are used for coloring, and when they change, the layout is recomputed at least
+down to the oldest revision that became or stopped being a branch head.
 """
 
+import array
+import binascii
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from kallithea.lib.vcs.utils import ascii_bytes, ascii_str, safe_str
+
+
+log = logging.getLogger(__name__)
+
 nullrev = -1
 
+LAYOUT_FILENAME = 'kallithea-graphlayout'
+
+_LAYOUT_MAGIC = b'KGL2'
+_LAYOUT_HEADER = struct.Struct('>4sII20s')
+_ENTRY = struct.Struct('>ii')
+_INT = struct.Struct('>i')
+
 
 def _first_known_ancestors(parentrev_func, minrev, knownrevs, head):
     """
@@ -52,7 +97,7 @@ def graph_data(repo, revs):
 
     For each DAG node this function emits tuples::
 
-      ((col, color), [(col, nextcol, color)])
+      ((col, color), [(col, nextcol, color, obsolete)], closing, obsolete, bumped, divergent, extinct, unstable)
 
     with the following new elements:
 
@@ -64,60 +109,65 @@ def graph_data(repo, revs):
     return list(_colored(repo, dag))
 
 
+def _parentrev_func(repo):
+    """Return a function returning the parent revision numbers of a revision."""
+    if repo.alias == 'hg':
+        return repo._repo.changelog.parentrevs
+
+    revisions = repo.revisions
+    object_store = repo._repo.object_store
+
+    def parentrev_func(rev):
+        # use the raw commits - there is no need for full changeset objects
+        parents = []
+        for parent_id in object_store[ascii_bytes(revisions[rev])].parents:
+            try:
+                parents.append(revisions.index(ascii_str(parent_id)))
+            except ValueError:  # not reachable from the revision filter
+                pass
+        return parents
+    return parentrev_func
+
+
 def _dagwalker(repo, revs):
     """Iterate over revs, yielding revs (highest first) and parents to show in the graph."""
     if not revs:
         return
 
-    if repo.alias == 'hg':
-        parentrev_func = repo._repo.changelog.parentrevs
-    elif repo.alias == 'git':
-        def parentrev_func(rev):
-            return [x.revision for x in repo[rev].parents]
-
+    parentrev_func = _parentrev_func(repo)
     minrev = revs[-1] # assuming sorted with highest revision numbers first
     knownrevs = set(revs)
     acache = {}
     for rev in revs:
-        parents = set(parentrev_func(rev)) - set([nullrev])
-        dagparents = parents & knownrevs
-        # Calculate indirect parents
-        for p in parents - dagparents:
-            ancestors = acache.get(p)
-            if ancestors is None:
-                ancestors = acache[p] = _first_known_ancestors(parentrev_func, minrev, knownrevs, p)
-            dagparents.update(ancestors)
+        yield (rev, _dagparents(parentrev_func, minrev, knownrevs, acache, rev))
 
-        yield (rev, sorted(dagparents))
 
+def _dagparents(parentrev_func, minrev, knownrevs, acache, rev):
+    """Return the sorted parents of rev to show in a graph of knownrevs."""
+    parents = set(parentrev_func(rev)) - set([nullrev])
+    dagparents = parents & knownrevs
+    # Calculate indirect parents
+    for p in parents - dagparents:
+        ancestors = acache.get(p)
+        if ancestors is None:
+            ancestors = acache[p] = _first_known_ancestors(parentrev_func, minrev, knownrevs, p)
+        dagparents.update(ancestors)
+    return sorted(dagparents)
 
-def _colored(repo, dag):
-    """annotates a DAG with colored edge information
 
-    For each DAG node this function emits tuples::
+def _layout(dag, branch, row=None, colors=None, newcolor=1):
+    """Compute lanes and colors for a DAG
 
-      ((col, color), [(col, nextcol, color)])
+    For each DAG node this function emits tuples::
 
-    with the following new elements:
+      (rev, col, color, [(col, nextcol, color, lane rev)], nextrow, newcolor)
 
-      - Tuple (col, color) with column and color index for the current node
-      - A list of tuples indicating the edges between the current node and its
-        parents.
+    where nextrow is the list of revisions the columns are tracking after this
+    node, and newcolor is the next available color. row and colors can be
+    given to continue a layout with a known state.
     """
-    branch_cache = {}
-
-    def branch(rev):
-        """Return branch for rev, using cache for efficiency.
-        For Mercurial, always return the named branch name (which may be 'default').
-        For Git, return a branch name for branch heads, otherwise None."""
-        if rev not in branch_cache:
-            branch_cache[rev] = repo[rev].branch
-        return branch_cache[rev]
-
-    row = []  # the ancestor revision that each column is tracking
-    colors = {}  # color number for revisions - set by descendants
-    obs = {}  # obsolete flag for revisions - set by descendants
-    newcolor = 1  # the next available color
+    row = [] if row is None else row  # the ancestor revision that each column is tracking
+    colors = {} if colors is None else colors  # color number for revisions - set by descendants
 
     for (rev, dagparents) in dag:
 
@@ -125,7 +175,6 @@ def _colored(repo, dag):
         if rev not in row:
             row.append(rev)  # new head
             colors[rev] = newcolor
-            obs[rev] = int(repo[rev].obsolete)
             newcolor += 1
 
         col = row.index(rev)
@@ -141,15 +190,13 @@ def _colored(repo, dag):
                 nextrow.append(r)
             else:
                 colors.pop(r)
-                obs.pop(r)
 
-        # Let color and obs for this rev be "inherited" by the first "parent"
+        # Let color for this rev be "inherited" by the first "parent"
         color = colors.pop(rev)
         if addparents:
             b = branch(rev)
             searching = True
             for p in reversed(addparents):
-                obs[p] = int(repo[p].obsolete) if p >= 0 else 0
                 if searching and branch(abs(p)) in [b, None]:
                     # This is the first parent on the same branch - inherit the color
                     colors[p] = color
@@ -162,17 +209,366 @@ def _colored(repo, dag):
         edges = []
         for ecol, ep in enumerate(row):
             if ep in nextrow:
-                edges.append((ecol, nextrow.index(ep), colors[ep], obs[ep]))
+                edges.append((ecol, nextrow.index(ep), colors[ep], ep))
             elif ep == rev:
                 for p in dagparents:
-                    edges.append((ecol, nextrow.index(p), colors[p], obs[p]))
+                    edges.append((ecol, nextrow.index(p), colors[p], p))
 
         # Yield and move on
-        closing = int(repo[rev].closesbranch)
-        obsolete = int(repo[rev].obsolete)
-        bumped = int(repo[rev].bumped)
-        divergent = int(repo[rev].divergent)
-        extinct = int(repo[rev].extinct)
-        unstable = int(repo[rev].unstable)
-        yield ((col, color), edges, closing, obsolete, bumped, divergent, extinct, unstable)
+        yield rev, col, color, edges, nextrow, newcolor
         row = nextrow
+
+
+def _colored(repo, dag):
+    """annotates a DAG with colored edge information
+
+    For each DAG node this function emits tuples::
+
+      ((col, color), [(col, nextcol, color, obsolete)], closing, obsolete, bumped, divergent, extinct, unstable)
+
+    with the following new elements:
+
+      - Tuple (col, color) with column and color index for the current node
+      - A list of tuples indicating the edges between the current node and its
+        parents.
+    """
+    branch_cache = {}
+    obs_cache = {}
+
+    def branch(rev):
+        """Return branch for rev, using cache for efficiency.
+        For Mercurial, always return the named branch name (which may be 'default').
+        For Git, return a branch name for branch heads, otherwise None."""
+        if rev not in branch_cache:
+            branch_cache[rev] = repo[rev].branch
+        return branch_cache[rev]
+
+    def obs(rev):
+        """Return obsolete flag for the revision tracked by a lane."""
+        if rev not in obs_cache:
+            obs_cache[rev] = int(repo[rev].obsolete) if rev >= 0 else 0
+        return obs_cache[rev]
+
+    for rev, col, color, edges, _nextrow, _newcolor in _layout(dag, branch):
+        cs = repo[rev]
+        closing = int(cs.closesbranch)
+        obsolete = int(cs.obsolete)
+        bumped = int(cs.bumped)
+        divergent = int(cs.divergent)
+        extinct = int(cs.extinct)
+        unstable = int(cs.unstable)
+        yield ((col, color), [(ecol, nextcol, ecolor, obs(ep)) for ecol, nextcol, ecolor, ep in edges],
+               closing, obsolete, bumped, divergent, extinct, unstable)
+
+
+def changelog_graph_data(repo, revs):
+    """Return the same as graph_data for revs, but using the persisted layout
+    of the full history if revs is a range of it, highest revision first.
+
+    The graph will show the lanes of the full history, also for revisions
+    outside revs.
+    """
+    if not revs:
+        return []
+    layout = get_graph_layout(repo)
+    pos = layout.position(revs[0])
+    if pos is None or pos + 1 < len(revs):
+        return graph_data(repo, revs)
+    rows = [layout.row(pos - i) for i in range(len(revs))]
+    if [r[0] for r in rows] != list(revs):
+        return graph_data(repo, revs)
+
+    flags, obsolete_revs = _revision_flags(repo)
+    result = []
+    for rev, col, color, _newcolor, _parents, edges in rows:
+        result.append(((col, color),
+                       [(ecol, nextcol, ecolor, int(ep in obsolete_revs)) for ecol, nextcol, ecolor, ep in edges])
+                      + flags(rev))
+    return result
+
+
+def _revision_flags(repo):
+    """Return a function returning the flags shown in the graph for a revision
+    as (closing, obsolete, bumped, divergent, extinct, unstable) - and the set
+    of obsolete revisions."""
+    if repo.alias != 'hg':
+        return (lambda rev: (0, 0, 0, 0, 0, 0)), frozenset()
+    from mercurial import obsolete
+    changelog = repo._repo.changelog
+    revsets = [obsolete.getrevs(repo._repo, name)
+               for name in [b'obsolete', b'phasedivergent', b'contentdivergent', b'extinct', b'orphan']]
+
+    def flags(rev):
+        return (int(changelog.branchinfo(rev)[1]),) + tuple(int(rev in revset) for revset in revsets)
+    return flags, revsets[0]
+
+
+class GraphLayout(object):
+    """
+    Rows of the graph layout of a full repository history, backed by a buffer
+    in the layout file format.
+    """
+
+    def __init__(self, buf):
+        self._buf = buf
+        magic, self.count, nheads, self.key = _LAYOUT_HEADER.unpack_from(buf, 0)
+        if magic != _LAYOUT_MAGIC:
+            raise ValueError('Not a graph layout')
+        self._index_offset = _LAYOUT_HEADER.size + nheads * _ENTRY.size
+        self._rows_offset = self._index_offset + self.count * _ENTRY.size
+        if len(buf) < self._rows_offset:
+            raise ValueError('Truncated graph layout')
+        self.heads = dict(_ENTRY.unpack_from(buf, _LAYOUT_HEADER.size + i * _ENTRY.size)
+                          for i in range(nheads))
+
+    @classmethod
+    def from_rows(cls, key, heads, revs, offsets, rows):
+        """
+        Create layout content from ``key``, a dict with name hash of the
+        branch heads by rev, arrays with rev and row offset for each position,
+        and the array of row integers.
+        """
+        index = array.array('i')
+        for rev, name_hash in sorted(heads.items()):
+            index.append(rev)
+            index.append(name_hash)
+        for rev, offset in zip(revs, offsets):
+            index.append(rev)
+            index.append(offset)
+        if sys.byteorder == 'little':
+            index.byteswap()
+            rows.byteswap()
+        return cls(_LAYOUT_HEADER.pack(_LAYOUT_MAGIC, len(revs), len(heads), key) + index.tobytes() + rows.tobytes())
+
+    def _entry(self, pos):
+        return _ENTRY.unpack_from(self._buf, self._index_offset + pos * _ENTRY.size)
+
+    def position(self, rev):
+        """Return the position of rev in the layout - or None."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            r = self._entry(mid)[0]
+            if r < rev:
+                lo = mid + 1
+            elif r > rev:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def row_ints(self, pos):
+        """Return the integers of the row at pos."""
+        offset = self._rows_offset + self._entry(pos)[1] * _INT.size
+        nparents = _INT.unpack_from(self._buf, offset + 4 * _INT.size)[0]
+        nedges = _INT.unpack_from(self._buf, offset + (5 + nparents) * _INT.size)[0]
+        return struct.unpack_from('>%di' % (6 + nparents + 4 * nedges), self._buf, offset)
+
+    def row(self, pos):
+        """Return (rev, col, color, newcolor, parents, edges) for the row at pos."""
+        return _decode_row(self.row_ints(pos))
+
+    @property
+    def raw_rows(self):
+        return self._buf[self._rows_offset:]
+
+
+def _encode_row(rev, col, color, newcolor, parents, edges):
+    ints = [rev, col, color, newcolor, len(parents)]
+    ints.extend(parents)
+    ints.append(len(edges))
+    for edge in edges:
+        ints.extend(edge)
+    return ints
+
+
+def _decode_row(ints):
+    rev, col, color, newcolor, nparents = ints[:5]
+    parents = list(ints[5:5 + nparents])
+    e = 6 + nparents
+    edges = [tuple(ints[i:i + 4]) for i in range(e, len(ints), 4)]
+    return rev, col, color, newcolor, parents, edges
+
+
+def _lanes(edges):
+    """Return list of (lane rev, color) for the next row from edges."""
+    lanes = {}
+    for _ecol, nextcol, ecolor, ep in edges:
+        lanes[nextcol] = (ep, ecolor)
+    return [lanes[i] for i in range(len(lanes))]
+
+
+def _revision_numbers(repo):
+    if repo.alias == 'hg':
+        return list(repo._repo.filtered(b'visible').changelog.revs())
+    return range(len(repo.revisions))
+
+
+def _layout_path(repo):
+    if repo.alias == 'hg':
+        return os.path.join(safe_str(repo._repo.path), LAYOUT_FILENAME)
+    return os.path.join(safe_str(repo._repo.controldir()), LAYOUT_FILENAME)
+
+
+def _state_key(repo, revnums, count):
+    """
+    Return a binary hash identifying the first count revisions of repo, or
+    None if it can't be computed.
+    """
+    if repo.alias == 'hg':
+        # revision numbers are stable - only hiding changes the history
+        tiprev = revnums[count - 1]
+        hidden = repo._repo.filtered(b'visible').changelog.filteredrevs
+        h = hashlib.sha1(binascii.unhexlify(repo.revisions[count - 1]))
+        for r in sorted(r for r in hidden if r <= tiprev):
+            h.update(_INT.pack(r))
+        return h.digest()
+    raw = repo.revisions.raw_revisions
+    if len(raw) < count * 20:
+        return None
+    return hashlib.sha1(raw[:count * 20]).digest()
+
+
+def _name_hash(name):
+    return _INT.unpack(hashlib.sha1(name).digest()[:_INT.size])[0]
+
+
+def _read_layout(path):
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):  # ValueError: empty file can't be mapped
+        return None
+    try:
+        return GraphLayout(buf)
+    except (ValueError, struct.error):
+        log.warning('Ignoring invalid graph layout %s', path)
+        return None
+
+
+def _write_layout(path, layout):
+    """
+    Atomically replace the layout file at ``path``. Failure to write is not
+    fatal - the layout will just be computed again next time.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=LAYOUT_FILENAME, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(layout._buf)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except (IOError, OSError) as e:
+        log.warning('Failed writing graph layout %s: %s', path, e)
+
+
+def get_graph_layout(repo):
+    """
+    Return a ``GraphLayout`` for the full history of the vcs repository
+    ``repo``, bringing the persisted layout up to date if necessary.
+    """
+    revnums = _revision_numbers(repo)
+    count = len(revnums)
+    if not count:
+        return GraphLayout.from_rows(b'\0' * 20, {}, [], [], array.array('i'))
+    key = _state_key(repo, revnums, count)
+
+    if repo.alias == 'hg':
+        changelog = repo._repo.changelog
+        heads = {}  # named branches are part of the revisions
+
+        def branch(rev):
+            return changelog.branchinfo(rev)[0]
+    else:
+        revisions = repo.revisions
+        branch_names = {}
+        for sha, name in repo._heads(reverse=False).items():
+            try:
+                branch_names[revisions.index(ascii_str(sha))] = name
+            except ValueError:  # not a commit
+                pass
+        heads = dict((rev, _name_hash(name)) for rev, name in branch_names.items())
+
+        def branch(rev):
+            return branch_names.get(rev) or None
+
+    path = _layout_path(repo)
+    old = _read_layout(path)
+    if old is not None and old.count == count and key is not None and old.key == key and old.heads == heads:
+        return old
+    if old is not None and not (0 < old.count <= count and _state_key(repo, revnums, old.count) == old.key):
+        log.debug('History of %s has changed - rebuilding graph layout', repo.path)
+        old = None
+    start = old.count if old is not None else 0
+    # Rows must be laid out again down to the oldest revision that changed
+    # branch head - revision numbers are positions for Git
+    converge_pos = count
+    if old is not None:
+        changed_heads = [rev for rev in set(heads).union(old.heads) if heads.get(rev) != old.heads.get(rev)]
+        if changed_heads:
+            converge_pos = min(changed_heads)
+
+    parentrev_func = _parentrev_func(repo)
+    minrev = revnums[0]
+    knownrevs = set(revnums)
+    acache = {}
+    current = {}  # the old row and parents of the revision being laid out
+
+    def dag():
+        for pos in range(count - 1, -1, -1):
+            rev = revnums[pos]
+            if pos >= start:
+                current['parents'] = _dagparents(parentrev_func, minrev, knownrevs, acache, rev)
+            else:
+                current['old_row'] = old.row(pos)
+                current['parents'] = current['old_row'][4]
+            yield rev, current['parents']
+
+    rows = array.array('i')
+    offsets = array.array('i', [0]) * count
+    tail = None
+    pos = count
+    for rev, col, color, edges, nextrow, newcolor in _layout(dag(), branch):
+        pos -= 1
+        offsets[pos] = len(rows)
+        rows.extend(_encode_row(rev, col, color, newcolor, current['parents'], edges))
+        if pos < start and pos <= converge_pos:
+            old_lanes = _lanes(current['old_row'][5])
+            if [lane for lane, c in old_lanes] == nextrow:
+                tail = pos, old_lanes, current['old_row'][3], _lanes(edges), newcolor
+                break
+
+    if tail is not None:
+        # The lanes converged with the old layout - reuse the remaining rows
+        pos, old_lanes, old_newcolor, new_lanes, newcolor = tail
+        color_map = dict((old_c, new_c) for (_lane, old_c), (_lane, new_c) in zip(old_lanes, new_lanes))
+        delta = newcolor - old_newcolor
+        if pos and delta == 0 and all(o == n for o, n in color_map.items()):
+            old_offset = old._entry(pos - 1)[1]
+            new_offset = len(rows)
+            old_rows = array.array('i')
+            old_rows.frombytes(old.raw_rows[old_offset * _INT.size:])
+            if sys.byteorder == 'little':
+                old_rows.byteswap()
+            rows.extend(old_rows)
+            for p in range(pos):
+                offsets[p] = old._entry(p)[1] - old_offset + new_offset
+        else:
+            def remap(c):
+                if c in color_map:
+                    return color_map[c]
+                if c >= old_newcolor:
+                    return c + delta
+                return c
+            for p in range(pos - 1, -1, -1):
+                old_rev, old_col, old_color, old_newcolor_p, old_parents, old_edges = old.row(p)
+                offsets[p] = len(rows)
+                rows.extend(_encode_row(old_rev, old_col, remap(old_color), old_newcolor_p + delta, old_parents,
+                                        [(ecol, nextcol, remap(ecolor), ep) for ecol, nextcol, ecolor, ep in old_edges]))
+
+    layout = GraphLayout.from_rows(key or b'\0' * 20, heads, revnums, offsets, rows)
+    if key is not None:
+        _write_layout(path, layout)
+    return layout
@@ -31,54 +31,34 @@ import time
 
 import mercurial.scmutil
 
-from kallithea.lib import helpers as h
+import kallithea
 from kallithea.lib.exceptions import UserCreationError
-from kallithea.lib.utils import action_logger, make_ui
-from kallithea.lib.utils2 import HookEnvironmentError, ascii_str, get_hook_environment, safe_bytes, safe_str
+from kallithea.lib.middleware.responsecache import response_cache
+from kallithea.lib.pushqueue import enqueue_push, get_push_queue_dir
+from kallithea.lib.utils import action_logger, load_rcextensions, set_app_settings, set_vcs_config
+from kallithea.lib.utils2 import AttributeDict, HookEnvironmentError, ascii_str, get_hook_environment, safe_bytes, safe_str
 from kallithea.lib.vcs.backends.base import EmptyChangeset
+from kallithea.model import meta
 from kallithea.model.db import Repository, User
 
 
-def _get_scm_size(alias, root_path):
-    if not alias.startswith('.'):
-        alias += '.'
-
-    size_scm, size_root = 0, 0
-    for path, dirs, files in os.walk(root_path):
-        if path.find(alias) != -1:
-            for f in files:
-                try:
-                    size_scm += os.path.getsize(os.path.join(path, f))
-                except OSError:
-                    pass
-        else:
-            for f in files:
-                try:
-                    size_root += os.path.getsize(os.path.join(path, f))
-                except OSError:
-                    pass
-
-    size_scm_f = h.format_byte_size(size_scm)
-    size_root_f = h.format_byte_size(size_root)
-    size_total_f = h.format_byte_size(size_root + size_scm)
-
-    return size_scm_f, size_root_f, size_total_f
-
-
 def repo_size(ui, repo, hooktype=None, **kwargs):
-    """Show size of Mercurial repository.
+    """Show stored size of Mercurial repository.
 
     Called as Mercurial hook changegroup.repo_size after push.
+
+    The repository is not scanned - the size of the pushed data is added to
+    the stored size when the push has been received over HTTP, and the size
+    is rescanned when it gets older than repo_size_max_age.
     """
-    size_hg_f, size_root_f, size_total_f = _get_scm_size('.hg', safe_str(repo.root))
+    from kallithea.lib import helpers as h # not imported by Git hooks
 
-    last_cs = repo[len(repo) - 1]
+    db_repo = Repository.get_by_full_path(safe_str(repo.root))
+    if db_repo is not None and db_repo.repo_size is not None:
+        ui.status(safe_bytes('Repository size: %s\n' % h.format_byte_size(db_repo.repo_size)))
 
-    msg = ('Repository size .hg: %s Checkout: %s Total: %s\n'
-           'Last revision is now r%s:%s\n') % (
-        size_hg_f, size_root_f, size_total_f, last_cs.rev(), ascii_str(last_cs.hex())[:12]
-    )
-    ui.status(safe_bytes(msg))
+    last_cs = repo[len(repo) - 1]
+    ui.status(safe_bytes('Last revision is now r%s:%s\n' % (last_cs.rev(), ascii_str(last_cs.hex())[:12])))
 
 
 def log_pull_action(ui, repo, **kwargs):
@@ -119,29 +99,56 @@ def log_push_action(ui, repo, node, node_last, **kwargs):
     return 0
 
 
-def process_pushed_raw_ids(revs):
+def process_pushed_raw_ids(revs, ex=None):
     """
     Register that changes have been added to the repo - log the action *and* invalidate caches.
 
     Called from Mercurial changegroup.kallithea_log_push_action calling hook log_push_action,
     or from the Git post-receive hook calling handle_git_post_receive ...
     or from scm _handle_push.
+
+    The hook environment ``ex`` is by default taken from KALLITHEA_EXTRAS.
+    When push_queue_dir is set, the push is only queued and processed later.
     """
-    ex = get_hook_environment()
+    if ex is None:
+        ex = get_hook_environment()
+
+    queue_dir = get_push_queue_dir()
+    if queue_dir:
+        enqueue_push(queue_dir, ex, revs)
+        return
 
-    action = '%s:%s' % (ex.action, ','.join(revs))
-    action_logger(ex.username, action, ex.repository, ex.ip, commit=True)
+    process_pushes(ex['repository'], [(ex, revs)])
 
-    from kallithea.model.scm import ScmModel
-    ScmModel().mark_for_invalidation(ex.repository)
+
+def process_pushes(repo_name, pushes):
+    """
+    Log pushes to the repository ``repo_name``, invalidate its caches and call
+    the PUSH_HOOK extension. ``pushes`` is a list of hook environments and the
+    revisions pushed, in the order they were pushed. The caches are only
+    updated once.
+    """
+    for ex, revs in pushes:
+        action = '%s:%s' % (ex['action'], ','.join(revs))
+        action_logger(ex['username'], action, ex['repository'], ex['ip'])
+    meta.Session().commit()
+
+    # like ScmModel.mark_for_invalidation - without importing ScmModel in Git hooks
+    repo = Repository.get_by_repo_name(repo_name)
+    if repo is not None:
+        response_cache.invalidate(repo.repo_full_path)
+        repo.set_invalidate()
+        repo.update_changeset_cache()
+        meta.Session().commit()
 
     # extension hook call
     from kallithea import EXTENSIONS
     callback = getattr(EXTENSIONS, 'PUSH_HOOK', None)
     if callable(callback):
-        kw = {'pushed_revs': revs}
-        kw.update(ex)
-        callback(**kw)
+        for ex, revs in pushes:
+            kw = {'pushed_revs': revs}
+            kw.update(ex)
+            callback(**kw)
 
 
 def log_create_repository(repository_dict, created_by, **kwargs):
@@ -299,23 +306,44 @@ def log_delete_user(user_dict, deleted_by, **kwargs):
 
 def _hook_environment(repo_path):
     """
-    Create a light-weight environment for stand-alone scripts and return an UI and the
+    Create a light-weight environment for stand-alone scripts and return the
     db repository.
 
     Git hooks are executed as subprocess of Git while Kallithea is waiting, and
-    they thus need enough info to be able to create an app environment and
-    connect to the database.
+    they thus need enough info to be able to connect to the database. Only the
+    database, the vcs library and rcextensions are set up - not the full
+    application.
     """
-    import paste.deploy
-    import kallithea.config.middleware
+    import configparser
+    import mercurial.encoding
+    import sqlalchemy
+    import kallithea.model.base
 
     extras = get_hook_environment()
 
     path_to_ini_file = extras['config']
-    kallithea.CONFIG = paste.deploy.appconfig('config:' + path_to_ini_file)
+    # read the app section like paste.deploy does - without loading the app
+    cp = configparser.ConfigParser({'here': os.path.dirname(path_to_ini_file), '__file__': path_to_ini_file}, strict=False)
+    cp.optionxform = str
+    cp.read(path_to_ini_file)
+    config = dict(cp.items('app:main'))
     #logging.config.fileConfig(ini_file_path) # Note: we are in a different process - don't use configured logging
-    kallithea.config.middleware.make_app(kallithea.CONFIG.global_conf, **kallithea.CONFIG.local_conf)
 
+    # Mercurial sets encoding at module import time, so we have to monkey patch it
+    hgencoding = config.get('hgencoding')
+    if hgencoding:
+        mercurial.encoding.encoding = hgencoding
+    kallithea.CONFIG = config
+    kallithea.model.base.init_model(sqlalchemy.engine_from_config(config, 'sqlalchemy.'))
+    load_rcextensions(root_path=config['here'])
+    set_app_settings(config)
+    set_vcs_config(config)
+
+    return _get_git_db_repo(repo_path)
+
+
+def _get_git_db_repo(repo_path):
+    """Return the db repository for the Git repository at ``repo_path``"""
     # fix if it's not a bare repo
     if repo_path.endswith(os.sep + '.git'):
         repo_path = repo_path[:-5]
@@ -323,9 +351,7 @@ def _hook_environment(repo_path):
     repo = Repository.get_by_full_path(repo_path)
     if not repo:
         raise OSError('Repository %s not found in database' % repo_path)
-
-    baseui = make_ui()
-    return baseui, repo
+    return repo
 
 
 def handle_git_pre_receive(repo_path, git_stdin_lines):
@@ -337,11 +363,35 @@ def handle_git_pre_receive(repo_path, git_stdin_lines):
 def handle_git_post_receive(repo_path, git_stdin_lines):
     """Called from Git post-receive hook"""
     try:
-        baseui, repo = _hook_environment(repo_path)
+        repo = _hook_environment(repo_path)
     except HookEnvironmentError as e:
         sys.stderr.write("Skipping Kallithea Git post-recieve hook %r.\nGit was apparently not invoked by Kallithea: %s\n" % (sys.argv[0], e))
         return 0
 
+    _process_git_post_receive(repo, git_stdin_lines, get_hook_environment())
+    return 0
+
+
+def handle_queued_git_post_receive(message):
+    """
+    Called in the Kallithea process listening on git_hook_socket with the
+    message sent by a Git post-receive hook calling
+    kallithea.lib.hookserver.queue_git_post_receive .
+    """
+    try:
+        repo = _get_git_db_repo(message['repo_path'])
+        _process_git_post_receive(repo, message['git_stdin_lines'], AttributeDict(message['extras']),
+                                  message.get('heads'))
+    finally:
+        meta.Session.remove()
+
+
+def _process_git_post_receive(repo, git_stdin_lines, ex, heads=None):
+    """
+    Find the pushed revisions from the post-receive ref updates and process
+    them. ``heads`` is a dict with the hash of each branch head when the hook
+    was run - by default, the current branch heads are used.
+    """
     # the post push hook should never use the cached instance
     scm_repo = repo.scm_instance_no_cache()
 
@@ -368,14 +418,17 @@ def handle_git_post_receive(repo_path, git_stdin_lines):
                         b'refs/heads/%s' % safe_bytes(push_ref['name']))
 
                 # build exclude list without the ref
-                cmd = ['for-each-ref', '--format=%(refname)', 'refs/heads/*']
-                stdout = scm_repo.run_git_command(cmd)
                 ref = push_ref['ref']
-                heads = [head for head in stdout.splitlines() if head != ref]
+                if heads is None:
+                    cmd = ['for-each-ref', '--format=%(refname)', 'refs/heads/*']
+                    stdout = scm_repo.run_git_command(cmd)
+                    exclude = [head for head in stdout.splitlines() if head != ref]
+                else:
+                    exclude = [raw_id for head, raw_id in sorted(heads.items()) if head != ref]
                 # now list the git revs while excluding from the list
                 cmd = ['log', push_ref['new_rev'], '--reverse', '--pretty=format:%H']
                 cmd.append('--not')
-                cmd.extend(heads) # empty list is ok
+                cmd.extend(exclude) # empty list is ok
                 stdout = scm_repo.run_git_command(cmd)
                 git_revs += stdout.splitlines()
 
@@ -391,9 +444,7 @@ def handle_git_post_receive(repo_path, git_stdin_lines):
         elif _type == 'tags':
             git_revs += ['tag=>%s' % push_ref['name']]
 
-    process_pushed_raw_ids(git_revs)
-
-    return 0
+    process_pushed_raw_ids(git_revs, ex)
 
 
 # Almost exactly like Mercurial contrib/hg-ssh:
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+kallithea.lib.hookserver
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Hand over the work of Git post-receive hooks to a running Kallithea process.
+
+When ``git_hook_socket`` is configured, one Kallithea process serving Git
+requests listens on that Unix socket. The Git post-receive hook sends the hook
+environment and the ref updates there and exits as soon as they have been
+received - without reading the Kallithea configuration or connecting to the
+database. For new branches, the hook also sends the branch heads, as the
+revisions that are new can only be found while the heads are unchanged. If no
+process is listening, the hook does the work itself.
+
+Received messages are written to a ``.queue`` directory next to the socket
+before the hook is told they have been accepted. The listening process logs
+the push and invalidates caches in a background thread and removes the
+message when done. Messages that fail are moved to the ``failed`` directory
+in the queue directory, and messages left by a process that died are handled
+by the next process listening.
+
+The other processes wait for the listening process to go away and will then
+take over. An exclusive lock on a ``.lock`` file next to the socket decides
+which process is listening.
+
+This module is imported by the Git hooks and must only import the standard
+library.
+"""
+
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+# seconds the hook will wait for the server to accept the ref updates
+SEND_TIMEOUT = 10
+# seconds between attempts to take over as the listening process
+RETRY_INTERVAL = 10
+
+
+def send_message(socket_path, message):
+    """
+    Send ``message`` (a dict that can be serialized as JSON) to the process
+    listening on ``socket_path``. Return True if it was accepted.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(SEND_TIMEOUT)
+            s.connect(socket_path)
+            s.sendall(json.dumps(message).encode('utf-8'))
+            s.shutdown(socket.SHUT_WR)
+            return s.recv(2) == b'ok'
+    except (OSError, AttributeError): # AttributeError: no AF_UNIX on this platform
+        return False
+
+
+def queue_git_post_receive(repo_path, git_stdin_lines):
+    """
+    Called from the Git post-receive hook. Return True if the ref updates
+    were handed over to the process listening on the hook socket - or False
+    if the hook must handle them itself.
+    """
+    try:
+        extras = json.loads(os.environ['KALLITHEA_EXTRAS'])
+    except (KeyError, ValueError):
+        return False
+    socket_path = extras.get('hook_socket')
+    if not socket_path:
+        return False
+    message = {
+        'extras': extras,
+        'repo_path': repo_path,
+        'git_stdin_lines': git_stdin_lines,
+    }
+    if any(l.startswith('0' * 40 + ' ') and ' refs/heads/' in l for l in git_stdin_lines):
+        # new branches - the pushed revisions are the ones not in the other heads
+        try:
+            out = subprocess.check_output([extras.get('git_path') or 'git', 'for-each-ref',
+                                           '--format=%(refname) %(objectname)', 'refs/heads/'])
+        except (OSError, subprocess.CalledProcessError):
+            return False
+        message['heads'] = dict(l.split(' ', 1) for l in out.decode('utf-8').splitlines())
+    return send_message(socket_path, message)
+
+
+class HookServer(object):
+    """
+    Accept messages on the Unix socket ``socket_path`` and call ``handler``
+    with each of them in a single worker thread, in the order they were
+    received. Each connection is received in a thread of its own. Messages
+    are stored in the directory ``socket_path + '.queue'`` until they have
+    been handled.
+    """
+
+    def __init__(self, socket_path, handler):
+        self.socket_path = socket_path
+        self.queue_dir = socket_path + '.queue'
+        self.handler = handler
+        self.queue = queue.Queue() # paths of stored messages
+        self._lock_file = None
+        self._sock = None
+
+    def start(self):
+        """Start listening now or as soon as no other process is listening."""
+        threading.Thread(target=self._run, name='hookserver', daemon=True).start()
+
+    def _acquire(self):
+        """Take the lock and bind the socket. Return False if another process holds the lock."""
+        import fcntl
+        lock_file = open(self.socket_path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file # keep it open - and locked - as long as the process lives
+
+        try:
+            os.unlink(self.socket_path) # left by a process that went away
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600) # only the user running Kallithea and its Git hooks
+        sock.listen(16)
+        os.makedirs(self.queue_dir, exist_ok=True)
+        self._sock = sock
+        return True
+
+    def _run(self):
+        try:
+            while not self._acquire():
+                time.sleep(RETRY_INTERVAL)
+        except Exception:
+            log.error('failed to listen on Git hook socket %s:\n%s', self.socket_path, traceback.format_exc())
+            return
+        log.info('listening for Git hooks on %s', self.socket_path)
+        # messages left by a process that went away
+        for name in sorted(fn for fn in os.listdir(self.queue_dir) if fn.endswith('.json')):
+            self.queue.put(os.path.join(self.queue_dir, name))
+        threading.Thread(target=self._work, name='hookserver-worker', daemon=True).start()
+        while True:
+            conn, addr = self._sock.accept()
+            # a slow hook must not keep the others waiting
+            threading.Thread(target=self._handle_connection, args=(conn,), name='hookserver-connection', daemon=True).start()
+
+    def _handle_connection(self, conn):
+        try:
+            self._receive(conn)
+        except Exception:
+            log.error('failed to receive message on %s:\n%s', self.socket_path, traceback.format_exc())
+        finally:
+            conn.close()
+
+    def _receive(self, conn):
+        conn.settimeout(SEND_TIMEOUT)
+        chunks = []
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        data = b''.join(chunks)
+        json.loads(data.decode('utf-8')) # don't accept invalid messages
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=self.queue_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # names sort in the order the messages were received
+            name = '%016d%s.json' % (time.time() * 1000000, os.path.basename(tmp_path)[len('.tmp'):])
+            path = os.path.join(self.queue_dir, name)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.queue.put(path)
+        conn.sendall(b'ok')
+
+    def _work(self):
+        while True:
+            path = self.queue.get()
+            try:
+                with open(path, 'rb') as f:
+                    message = json.loads(f.read().decode('utf-8'))
+                self.handler(message)
+            except Exception:
+                log.error('failed to handle Git hook message %s:\n%s', path, traceback.format_exc())
+                self._remove(path, failed=True)
+            else:
+                self._remove(path)
+            finally:
+                self.queue.task_done()
+
+    def _remove(self, path, failed=False):
+        """Remove the message at ``path`` from the queue - or move it to the failed directory."""
+        try:
+            if failed:
+                failed_dir = os.path.join(self.queue_dir, 'failed')
+                os.makedirs(failed_dir, exist_ok=True)
+                os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+            else:
+                os.unlink(path)
+        except OSError as e:
+            log.error('failed to remove Git hook message %s: %s', path, e)
+
+
+_hook_server = None
+
+
+def start_hook_server(socket_path, handler):
+    """Start the HookServer for this process - unless it already has been started."""
+    global _hook_server
+    if _hook_server is None:
+        _hook_server = HookServer(socket_path, handler)
+        _hook_server.start()
+    return _hook_server
@@ -27,8 +27,11 @@ Original author and date, and relevant copyright and licensing information is be
 
 
 import logging
+import multiprocessing
 import os
 import sys
+import tempfile
+import time
 import traceback
 from os.path import dirname
 from shutil import rmtree
@@ -38,8 +41,12 @@ from whoosh.index import create_in, exists_in, open_dir
 from whoosh.qparser import QueryParser
 
 from kallithea.config.conf import INDEX_EXTENSIONS, INDEX_FILENAMES
+from kallithea.lib import ext_json
 from kallithea.lib.indexers import CHGSET_IDX_NAME, CHGSETS_SCHEMA, IDX_NAME, SCHEMA
+from kallithea.lib.utils import make_ui
 from kallithea.lib.utils2 import safe_str
+from kallithea.lib.vcs.backends import get_repo
+from kallithea.lib.vcs.conf import settings
 from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError, ChangesetError, NodeDoesNotExistError, RepositoryError
 from kallithea.model.db import Repository
 from kallithea.model.scm import ScmModel
@@ -55,59 +62,11 @@ sys.path.append(project_path)
 log = logging.getLogger('whoosh_indexer')
 
 
-class WhooshIndexingDaemon(object):
+class RepositoryIndexer(object):
     """
-    Daemon for atomic indexing jobs
+    Indexing of the files and changesets of a single repository
     """
 
-    def __init__(self, indexname=IDX_NAME, index_location=None,
-                 repo_location=None, repo_list=None,
-                 repo_update_list=None):
-        self.indexname = indexname
-
-        self.index_location = index_location
-        if not index_location:
-            raise Exception('You have to provide index location')
-
-        self.repo_location = repo_location
-        if not repo_location:
-            raise Exception('You have to provide repositories location')
-
-        self.repo_paths = ScmModel().repo_scan(self.repo_location)
-
-        # filter repo list
-        if repo_list:
-            repo_list = set(repo_list)
-            self.filtered_repo_paths = {}
-            for repo_name, repo in self.repo_paths.items():
-                if repo_name in repo_list:
-                    self.filtered_repo_paths[repo_name] = repo
-
-            self.repo_paths = self.filtered_repo_paths
-
-        # filter update repo list
-        self.filtered_repo_update_paths = {}
-        if repo_update_list:
-            self.filtered_repo_update_paths = {}
-            for repo_name, repo in self.repo_paths.items():
-                if repo_name in repo_update_list:
-                    self.filtered_repo_update_paths[repo_name] = repo
-            self.repo_paths = self.filtered_repo_update_paths
-
-        self.initial = True
-        if not os.path.isdir(self.index_location):
-            os.makedirs(self.index_location)
-            log.info('Cannot run incremental index since it does not '
-                     'yet exist - running full build')
-        elif not exists_in(self.index_location, IDX_NAME):
-            log.info('Running full index build, as the file content '
-                     'index does not exist')
-        elif not exists_in(self.index_location, CHGSET_IDX_NAME):
-            log.info('Running full index build, as the changeset '
-                     'index does not exist')
-        else:
-            self.initial = False
-
     def _get_index_revision(self, repo):
         db_repo = Repository.get_by_repo_name(repo.name)
         landing_rev = 'tip'
@@ -122,14 +81,14 @@ class WhooshIndexingDaemon(object):
         cs = repo.get_changeset(index_rev)
         return cs
 
-    def get_paths(self, repo):
+    def get_paths(self, repo, index_rev=None):
         """
         recursive walk in root dir and return a set of all path in that dir
         based on repository walk function
         """
         index_paths_ = set()
         try:
-            cs = self._get_index_changeset(repo)
+            cs = self._get_index_changeset(repo, index_rev=index_rev)
             for _topnode, _dirs, files in cs.walk('/'):
                 for f in files:
                     index_paths_.add(os.path.join(repo.path, f.path))
@@ -221,47 +180,53 @@ class WhooshIndexingDaemon(object):
         """
 
         if start_rev is None:
-            start_rev = repo[0].raw_id
+            start = 0
+        else:
+            start = repo.get_changeset(start_rev).revision
 
         log.debug('Indexing changesets in %s, starting at rev %s',
                   repo_name, start_rev)
 
         indexed = 0
-        cs_iter = repo.get_changesets(start=start_rev)
-        total = len(cs_iter)
-        for cs in cs_iter:
+        total = len(repo) - start
+        last_raw_id = repo.revisions[-1]
+        # bulk retrieval of the metadata without creating changeset objects
+        for cs in repo.get_changesets_metadata(start):
             indexed += 1
-            log.debug('    >> %s %s/%s', cs, indexed, total)
+            log.debug('    >> %s %s/%s', cs.raw_id, indexed, total)
             writer.add_document(
                 raw_id=cs.raw_id,
                 owner=repo.contact,
-                date=cs._timestamp,
+                date=mktime(cs.date.timetuple()),
                 repository_rawname=repo_name,
                 repository=repo_name,
                 author=cs.author,
                 message=cs.message,
-                last=cs.last,
-                added=' '.join(node.path for node in cs.added).lower(),
-                removed=' '.join(node.path for node in cs.removed).lower(),
-                changed=' '.join(node.path for node in cs.changed).lower(),
-                parents=' '.join(cs.raw_id for cs in cs.parents),
+                last=cs.raw_id == last_raw_id,
+                added=' '.join(cs.added).lower(),
+                removed=' '.join(cs.removed).lower(),
+                changed=' '.join(cs.changed).lower(),
+                parents=' '.join(cs.parents),
             )
 
         return indexed
 
-    def index_files(self, file_idx_writer, repo_name, repo):
+    def index_files(self, file_idx_writer, repo_name, repo, index_rev=None):
         """
         Index files for given repo_name
 
         :param file_idx_writer: the whoosh index writer to add to
         :param repo_name: name of the repository we're indexing
         :param repo: instance of vcs repo
+        :param index_rev: the revision to index - default is the landing
+          revision of the repository
         """
         i_cnt = iwc_cnt = 0
+        if not index_rev:
+            index_rev = self._get_index_revision(repo)
         log.debug('Building file index for %s @revision:%s', repo_name,
-                                                self._get_index_revision(repo))
-        index_rev = self._get_index_revision(repo)
-        for idx_path in self.get_paths(repo):
+                                                index_rev)
+        for idx_path in self.get_paths(repo, index_rev):
             i, iwc = self.add_doc(file_idx_writer, idx_path, repo, repo_name, index_rev)
             i_cnt += i
             iwc_cnt += iwc
@@ -270,6 +235,76 @@ class WhooshIndexingDaemon(object):
                   i_cnt + iwc_cnt, iwc_cnt, repo.path)
         return i_cnt, iwc_cnt
 
+    def index_repository(self, file_idx_writer, chgset_idx_writer, repo_name, repo, index_rev=None):
+        """
+        Index files and changesets of given repo_name and return tuple with
+        number of files, files with content and changesets and the time it
+        took
+        """
+        start = time.time()
+        i_cnt, iwc_cnt = self.index_files(file_idx_writer, repo_name, repo, index_rev)
+        cs_cnt = self.index_changesets(chgset_idx_writer, repo_name, repo)
+        return i_cnt + iwc_cnt, iwc_cnt, cs_cnt, time.time() - start
+
+
+class WhooshIndexingDaemon(RepositoryIndexer):
+    """
+    Daemon for atomic indexing jobs
+    """
+
+    def __init__(self, indexname=IDX_NAME, index_location=None,
+                 repo_location=None, repo_list=None,
+                 repo_update_list=None, workers=1):
+        self.indexname = indexname
+        self.workers = workers
+
+        self.index_location = index_location
+        if not index_location:
+            raise Exception('You have to provide index location')
+
+        self.repo_location = repo_location
+        if not repo_location:
+            raise Exception('You have to provide repositories location')
+
+        self.repo_paths = ScmModel().repo_scan(self.repo_location)
+
+        # filter repo list
+        if repo_list:
+            repo_list = set(repo_list)
+            self.filtered_repo_paths = {}
+            for repo_name, repo in self.repo_paths.items():
+                if repo_name in repo_list:
+                    self.filtered_repo_paths[repo_name] = repo
+
+            self.repo_paths = self.filtered_repo_paths
+
+        # filter update repo list
+        self.filtered_repo_update_paths = {}
+        if repo_update_list:
+            self.filtered_repo_update_paths = {}
+            for repo_name, repo in self.repo_paths.items():
+                if repo_name in repo_update_list:
+                    self.filtered_repo_update_paths[repo_name] = repo
+            self.repo_paths = self.filtered_repo_update_paths
+
+        baseui = make_ui()
+        self.repo_paths = dict((repo_name, repo.scm_instance(baseui))
+                               for repo_name, repo in self.repo_paths.items())
+
+        self.initial = True
+        if not os.path.isdir(self.index_location):
+            os.makedirs(self.index_location)
+            log.info('Cannot run incremental index since it does not '
+                     'yet exist - running full build')
+        elif not exists_in(self.index_location, IDX_NAME):
+            log.info('Running full index build, as the file content '
+                     'index does not exist')
+        elif not exists_in(self.index_location, CHGSET_IDX_NAME):
+            log.info('Running full index build, as the changeset '
+                     'index does not exist')
+        else:
+            self.initial = False
+
     def update_changeset_index(self):
         idx = open_dir(self.index_location, indexname=CHGSET_IDX_NAME)
 
@@ -330,56 +365,22 @@ class WhooshIndexingDaemon(object):
                     log.debug('>> NOTHING TO COMMIT TO CHANGESET INDEX<<')
 
     def update_file_index(self):
+        """
+        Update the file index of each repository with the files added,
+        changed and removed between the previously indexed revision and the
+        current landing revision. Repositories without a known previously
+        indexed revision are reindexed from scratch.
+        """
         log.debug('STARTING INCREMENTAL INDEXING UPDATE FOR EXTENSIONS %s '
                   'AND REPOS %s', INDEX_EXTENSIONS, ' and '.join(self.repo_paths))
 
         idx = open_dir(self.index_location, indexname=self.indexname)
-        # The set of all paths in the index
-        indexed_paths = set()
-        # The set of all paths we need to re-index
-        to_index = set()
+        index_revisions = self._read_index_revisions()
+        new_index_revisions = dict(index_revisions)
 
         writer = idx.writer()
         writer_is_dirty = False
         try:
-            with idx.reader() as reader:
-
-                # Loop over the stored fields in the index
-                for fields in reader.all_stored_fields():
-                    indexed_path = fields['path']
-                    indexed_repo_path = fields['repository']
-                    indexed_paths.add(indexed_path)
-
-                    if indexed_repo_path not in self.filtered_repo_update_paths:
-                        continue
-
-                    repo = self.repo_paths[indexed_repo_path]
-
-                    try:
-                        node = self.get_node(repo, indexed_path)
-                        # Check if this file was changed since it was indexed
-                        indexed_time = fields['modtime']
-                        mtime = self.get_node_mtime(node)
-                        if mtime > indexed_time:
-                            # The file has changed, delete it and add it to
-                            # the list of files to reindex
-                            log.debug(
-                                'adding to reindex list %s mtime: %s vs %s',
-                                    indexed_path, mtime, indexed_time
-                            )
-                            writer.delete_by_term('fileid', indexed_path)
-                            writer_is_dirty = True
-
-                            to_index.add(indexed_path)
-                    except (ChangesetError, NodeDoesNotExistError):
-                        # This file was deleted since it was indexed
-                        log.debug('removing from index %s', indexed_path)
-                        writer.delete_by_term('path', indexed_path)
-                        writer_is_dirty = True
-
-            # Loop over the files in the filesystem
-            # Assume we have a function that gathers the filenames of the
-            # documents to be indexed
             ri_cnt_total = 0  # indexed
             riwc_cnt_total = 0  # indexed with content
             for repo_name, repo in sorted(self.repo_paths.items()):
@@ -387,32 +388,86 @@ class WhooshIndexingDaemon(object):
                 # skip indexing if there aren't any revisions
                 if len(repo) < 1:
                     continue
-                ri_cnt = 0   # indexed
-                riwc_cnt = 0  # indexed with content
-                for path in self.get_paths(repo):
-                    if path in to_index or path not in indexed_paths:
-                        # This is either a file that's changed, or a new file
-                        # that wasn't indexed before. So index it!
-                        i, iwc = self.add_doc(writer, path, repo, repo_name)
-                        writer_is_dirty = True
+                index_rev = self._get_index_raw_id(repo)
+                if index_rev is None:
+                    continue
+                old_index_rev = index_revisions.get(repo_name)
+                if index_rev == old_index_rev:
+                    continue
+
+                changed_files = None
+                if old_index_rev is not None:
+                    try:
+                        changed_files = repo.get_changed_files(old_index_rev, index_rev)
+                    except ChangesetDoesNotExistError:
+                        log.debug('previously indexed revision %s not found in %s', old_index_rev, repo_name)
+
+                if changed_files is None:
+                    log.debug('reindexing all files of repo %s', repo_name)
+                    writer.delete_by_term('repository_rawname', repo_name)
+                    ri_cnt, riwc_cnt = self.index_files(writer, repo_name, repo, index_rev)
+                else:
+                    added, changed, removed = changed_files
+                    ri_cnt = riwc_cnt = 0
+                    for path in changed + removed:
+                        log.debug('removing from index %s', path)
+                        writer.delete_by_term('fileid', os.path.join(repo.path, path))
+                    for path in added + changed:
+                        i, iwc = self.add_doc(writer, os.path.join(repo.path, path), repo, repo_name, index_rev)
                         ri_cnt += i
-                        ri_cnt_total += 1
                         riwc_cnt += iwc
-                        riwc_cnt_total += iwc
-                log.debug('added %s files %s with content for repo %s',
-                             ri_cnt + riwc_cnt, riwc_cnt, repo.path
-                )
+                    log.debug('added %s files %s with content and removed %s files for repo %s',
+                              ri_cnt + riwc_cnt, riwc_cnt, len(removed), repo.path)
+                writer_is_dirty = True
+                new_index_revisions[repo_name] = index_rev
+                ri_cnt_total += ri_cnt + riwc_cnt
+                riwc_cnt_total += riwc_cnt
             log.debug('indexed %s files in total and %s with content',
                         ri_cnt_total, riwc_cnt_total
             )
-        finally:
-            if writer_is_dirty:
-                log.debug('>> COMMITING CHANGES TO FILE INDEX <<')
-                writer.commit(merge=True)
-                log.debug('>>> FINISHED REBUILDING FILE INDEX <<<')
-            else:
-                log.debug('>> NOTHING TO COMMIT TO FILE INDEX <<')
-                writer.cancel()
+        except:
+            writer.cancel()
+            raise
+        if writer_is_dirty:
+            log.debug('>> COMMITING CHANGES TO FILE INDEX <<')
+            writer.commit(merge=True)
+            self._write_index_revisions(new_index_revisions)
+            log.debug('>>> FINISHED REBUILDING FILE INDEX <<<')
+        else:
+            log.debug('>> NOTHING TO COMMIT TO FILE INDEX <<')
+            writer.cancel()
+
+    def _get_index_raw_id(self, repo):
+        """
+        Return the raw_id of the landing revision of repo, or None if it
+        can't be found
+        """
+        try:
+            return self._get_index_changeset(repo).raw_id
+        except RepositoryError:
+            log.debug(traceback.format_exc())
+            return None
+
+    def _index_revisions_path(self):
+        return os.path.join(self.index_location, '%s_REVISIONS.json' % self.indexname)
+
+    def _read_index_revisions(self):
+        """
+        Return dict with the revision each repository was indexed at when the
+        file index was last updated
+        """
+        try:
+            with open(self._index_revisions_path()) as f:
+                return ext_json.load(f)
+        except (IOError, ValueError):
+            log.debug(traceback.format_exc())
+            return {}
+
+    def _write_index_revisions(self, index_revisions):
+        tmp_path = self._index_revisions_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            ext_json.dump(index_revisions, f)
+        os.replace(tmp_path, self._index_revisions_path())
 
     def build_indexes(self):
         if os.path.exists(self.index_location):
@@ -431,20 +486,58 @@ class WhooshIndexingDaemon(object):
         log.debug('BUILDING INDEX FOR EXTENSIONS %s '
                   'AND REPOS %s', INDEX_EXTENSIONS, ' and '.join(self.repo_paths))
 
-        for repo_name, repo in sorted(self.repo_paths.items()):
-            log.debug('Updating indices for repo %s', repo_name)
+        index_revisions = {}
+        for repo_name, repo in self.repo_paths.items():
             # skip indexing if there aren't any revisions
             if len(repo) < 1:
                 continue
+            index_revisions[repo_name] = self._get_index_raw_id(repo)
 
-            self.index_files(file_idx_writer, repo_name, repo)
-            self.index_changesets(chgset_idx_writer, repo_name, repo)
+        if self.workers > 1:
+            self._build_indexes_parallel(file_idx_writer, chgset_idx_writer, index_revisions)
+        else:
+            for repo_name, index_rev in sorted(index_revisions.items()):
+                log.debug('Updating indices for repo %s', repo_name)
+                _log_throughput(repo_name, self.index_repository(
+                    file_idx_writer, chgset_idx_writer, repo_name, self.repo_paths[repo_name], index_rev))
 
         log.debug('>> COMMITING CHANGES <<')
         file_idx_writer.commit(merge=True)
         chgset_idx_writer.commit(merge=True)
+        self._write_index_revisions(dict((repo_name, index_rev)
+                                         for repo_name, index_rev in index_revisions.items()
+                                         if index_rev is not None))
         log.debug('>>> FINISHED BUILDING INDEX <<<')
 
+    def _build_indexes_parallel(self, file_idx_writer, chgset_idx_writer, index_revisions):
+        """
+        Index repositories in a pool of worker processes. Each worker reads
+        and tokenizes a repository into separate indexes that are merged into
+        the main index writers.
+        """
+        jobs = []
+        try:
+            for repo_name, index_rev in sorted(index_revisions.items()):
+                repo = self.repo_paths[repo_name]
+                segment_location = tempfile.mkdtemp(prefix='worker-', dir=self.index_location)
+                jobs.append((repo_name, repo.path, index_rev or self._get_index_revision(repo), segment_location))
+
+            log.debug('Indexing %s repositories with %s workers', len(jobs), self.workers)
+            vcs_settings = dict((k, getattr(settings, k)) for k in ['GIT_EXECUTABLE_PATH', 'GIT_REV_FILTER'])
+            with multiprocessing.Pool(self.workers, _init_worker, (vcs_settings,)) as pool:
+                for repo_name, segment_location, stats in pool.imap_unordered(_index_repository, jobs):
+                    _log_throughput(repo_name, stats)
+                    for writer, indexname in [(file_idx_writer, IDX_NAME), (chgset_idx_writer, CHGSET_IDX_NAME)]:
+                        segment_idx = open_dir(segment_location, indexname=indexname)
+                        with segment_idx.reader() as reader:
+                            writer.add_reader(reader)
+                        segment_idx.close()
+                    rmtree(segment_location)
+        finally:
+            # also remove the directories of workers that failed or never ran
+            for job in jobs:
+                rmtree(job[-1], ignore_errors=True)
+
     def update_indexes(self):
         self.update_file_index()
         self.update_changeset_index()
@@ -455,3 +548,31 @@ class WhooshIndexingDaemon(object):
             self.build_indexes()
         else:
             self.update_indexes()
+
+
+def _log_throughput(repo_name, stats):
+    files, files_w_content, changesets, elapsed = stats
+    elapsed = max(elapsed, 0.001)
+    log.info('Indexed %s: %s files (%s with content) and %s changesets in %.1fs - %.1f files/s, %.1f changesets/s',
+             repo_name, files, files_w_content, changesets, elapsed, files / elapsed, changesets / elapsed)
+
+
+def _init_worker(vcs_settings):
+    for k, v in vcs_settings.items():
+        setattr(settings, k, v)
+
+
+def _index_repository(job):
+    """
+    Index a repository in a worker process, writing to new indexes in a
+    separate directory. No database access - the index revision is given.
+    """
+    repo_name, repo_path, index_rev, segment_location = job
+    repo = get_repo(repo_path)
+    file_idx_writer = create_in(segment_location, SCHEMA, indexname=IDX_NAME).writer()
+    chgset_idx_writer = create_in(segment_location, CHGSETS_SCHEMA, indexname=CHGSET_IDX_NAME).writer()
+    stats = RepositoryIndexer().index_repository(file_idx_writer, chgset_idx_writer,
+                                                 repo_name, repo, index_rev)
+    file_idx_writer.commit()
+    chgset_idx_writer.commit()
+    return repo_name, segment_location, stats
@@ -33,8 +33,10 @@ import traceback
 from webob import Request, Response, exc
 
 import kallithea
+from kallithea.lib.middleware.responsecache import file_token, response_cache
 from kallithea.lib.utils2 import ascii_bytes
 from kallithea.lib.vcs import subprocessio
+from kallithea.lib.vcs.backends.git.repository import GitRepository as GitVcsRepository
 
 
 log = logging.getLogger(__name__)
@@ -116,18 +118,31 @@ class GitRepository(object):
         _git_path = kallithea.CONFIG.get('git_path', 'git')
         cmd = [_git_path, git_command[4:],
                '--stateless-rpc', '--advertise-refs', self.content_path]
-        log.debug('handling cmd %s', cmd)
-        try:
-            out = subprocessio.SubprocessIOChunker(cmd,
-                starting_values=[ascii_bytes(packet_len + server_advert + '0000')]
-            )
-        except EnvironmentError as e:
-            log.error(traceback.format_exc())
-            raise exc.HTTPExpectationFailed()
+        # the advertisement only changes when refs or config change
+        cache_key = ('git', self.content_path, git_command, _git_path)
+        token = (GitVcsRepository.path_state_token(self.content_path),
+                 file_token(os.path.join(self.content_path, 'config')))
+        advertisement = response_cache.get(cache_key, token)
+        if advertisement is None:
+            log.debug('handling cmd %s', cmd)
+            try:
+                out = subprocessio.SubprocessIOChunker(cmd,
+                    starting_values=[ascii_bytes(packet_len + server_advert + '0000')]
+                )
+                try:
+                    advertisement = b''.join(out)
+                finally:
+                    out.close()
+            except EnvironmentError as e:
+                log.error(traceback.format_exc())
+                raise exc.HTTPExpectationFailed()
+            response_cache.put(cache_key, token, advertisement)
+        else:
+            log.debug('using cached advertisement for %s', cmd)
         resp = Response()
         resp.content_type = 'application/x-%s-advertisement' % str(git_command)
         resp.charset = None
-        resp.app_iter = out
+        resp.body = advertisement
         return resp
 
     def backend(self, req, environ):
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+kallithea.lib.middleware.responsecache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Per process cache of responses to VCS protocol requests that only depend on
+the refs of a repository.
+
+Clients polling for changes start by asking for the refs or heads of the
+repository. Most of the time nothing has changed, and the answer can be
+given without forking git or opening the Mercurial repository. Responses are
+stored with the state token of the repository they were made for, and are
+only used while the token is unchanged. Processing a push also removes the
+responses for the repository from the cache of the process.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import kallithea
+from kallithea.lib.utils2 import safe_int
+
+
+log = logging.getLogger(__name__)
+
+
+def file_token(path):
+    """Return stat info that changes when the file at ``path`` changes."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class ResponseCache(object):
+    """
+    LRU of responses keyed by request. The size is ``protocol_cache_size``
+    responses per process; 0 disables caching.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, token):
+        """Return the response cached for ``key`` with ``token`` - or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != token:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, token, response):
+        size = safe_int(kallithea.CONFIG.get('protocol_cache_size'), 200)
+        if size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (token, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, repo_path):
+        """Remove the responses for the repository at ``repo_path``."""
+        repo_path = os.path.normpath(repo_path)
+        with self._lock:
+            for key in list(self._entries):
+                path = os.path.normpath(key[1])
+                if path == repo_path or path.startswith(repo_path + os.sep):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
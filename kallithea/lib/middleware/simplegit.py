@@ -32,7 +32,8 @@ import logging
 import re
 
 from kallithea.lib.base import BaseVCSController, get_path_info
-from kallithea.lib.hooks import log_pull_action
+from kallithea.lib.hooks import handle_queued_git_post_receive, log_pull_action
+from kallithea.lib.hookserver import start_hook_server
 from kallithea.lib.middleware.pygrack import make_wsgi_app
 from kallithea.lib.utils import make_ui
 from kallithea.model.db import Repository
@@ -80,6 +81,9 @@ class SimpleGit(BaseVCSController):
         """
         Return a pygrack wsgi application.
         """
+        if self.config.get('git_hook_socket'):
+            # only processes serving Git requests handle the hooks
+            start_hook_server(self.config['git_hook_socket'], handle_queued_git_post_receive)
         pygrack_app = make_wsgi_app(parsed_request.repo_name, self.basepath)
 
         def wrapper_app(environ, start_response):
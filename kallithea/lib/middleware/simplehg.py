@@ -35,8 +35,10 @@ import urllib.parse
 import mercurial.hgweb
 
 from kallithea.lib.base import BaseVCSController, get_path_info
+from kallithea.lib.middleware.responsecache import file_token, response_cache
 from kallithea.lib.utils import make_ui
 from kallithea.lib.utils2 import safe_bytes
+from kallithea.lib.vcs.backends.hg.repository import MercurialRepository
 
 
 log = logging.getLogger(__name__)
@@ -91,6 +93,11 @@ cmd_mapping = {
     }
 
 
+# commands that only depend on the repository state and the request
+cacheable_cmds = set(['capabilities', 'heads', 'listkeys'])
+cacheable_batch_cmds = cacheable_cmds | set(['known'])
+
+
 class SimpleHg(BaseVCSController):
 
     scm_alias = 'hg'
@@ -110,6 +117,7 @@ class SimpleHg(BaseVCSController):
             query_string = environ['QUERY_STRING']
 
             action = None
+            cacheable = False
             for qry in query_string.split('&'):
                 parts = qry.split('=', 1)
                 if len(parts) == 2 and parts[0] == 'cmd':
@@ -120,8 +128,11 @@ class SimpleHg(BaseVCSController):
                             action = 'push' # paranoid and safe
                             break
                         action = 'pull'
+                        cacheable = True
                         for cmd_arg in hgarg[5:].split(';'):
                             cmd, _args = urllib.parse.unquote_plus(cmd_arg).split(' ', 1)
+                            if cmd not in cacheable_batch_cmds:
+                                cacheable = False
                             op = cmd_mapping.get(cmd, 'push')
                             if op != 'pull':
                                 assert op == 'push'
@@ -129,7 +140,11 @@ class SimpleHg(BaseVCSController):
                                 break
                     else:
                         action = cmd_mapping.get(cmd, 'push')
+                        cacheable = cmd in cacheable_cmds
                     break # only process one cmd
+            # arguments in the request body are not part of the cache key
+            if environ['REQUEST_METHOD'] != 'GET' or 'HTTP_X_HGARGS_POST' in environ:
+                cacheable = False
 
         return parsed_request
 
@@ -140,10 +155,50 @@ class SimpleHg(BaseVCSController):
         repo_name = parsed_request.repo_name
         repo_path = os.path.join(self.basepath, repo_name)
         baseui = make_ui(repo_path=repo_path)
-        hgweb_app = mercurial.hgweb.hgweb(safe_bytes(repo_path), name=safe_bytes(repo_name), baseui=baseui)
 
         def wrapper_app(environ, start_response):
+            hgweb_app = mercurial.hgweb.hgweb(safe_bytes(repo_path), name=safe_bytes(repo_name), baseui=baseui)
             environ['REPO_NAME'] = repo_name # used by mercurial.hgweb.hgweb
             return hgweb_app(environ, start_response)
 
+        if parsed_request.cacheable:
+            return self._make_cached_app(wrapper_app, repo_path, baseui)
         return wrapper_app
+
+    def _make_cached_app(self, app, repo_path, baseui):
+        """
+        Wrap ``app`` in an application that answers requests from the
+        response cache as long as the repository and its configuration are
+        unchanged.
+        """
+        def cached_app(environ, start_response):
+            cache_key = ('hg', repo_path, environ['QUERY_STRING'], get_header_hgarg(environ),
+                         environ.get('HTTP_X_HGPROTO_1'), environ.get('HTTP_ACCEPT'),
+                         tuple(baseui.walkconfig()))
+            token = (MercurialRepository.path_state_token(repo_path),
+                     file_token(os.path.join(repo_path, '.hg', 'hgrc')))
+            response = response_cache.get(cache_key, token)
+            if response is None:
+                response = []
+                body = []
+
+                def capture_start_response(status, headers, exc_info=None):
+                    response[:] = [status, headers]
+                    return body.append
+
+                result = app(environ, capture_start_response)
+                try:
+                    body.extend(result)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+                response.append(b''.join(body))
+                if response[0].startswith('200 '):
+                    response_cache.put(cache_key, token, tuple(response))
+            else:
+                log.debug('using cached response for %s', environ['QUERY_STRING'])
+            status, headers, body = response
+            start_response(status, headers)
+            return [body]
+
+        return cached_app
@@ -179,9 +179,19 @@ force_https = false
 <%text>## use Strict-Transport-Security headers</%text>
 use_htsts = false
 
-<%text>## number of commits stats will parse on each iteration</%text>
+<%text>## number of commits stats will parse on each visit to the statistics page</%text>
+<%text>## (when Celery is enabled, all commits are parsed in one task)</%text>
 commit_parse_limit = 25
 
+<%text>## seconds the repository size shown on the summary page may be old before</%text>
+<%text>## it is updated - with Celery in the background. Pushes over HTTP add the</%text>
+<%text>## size of the pushed data, which is only an estimate until the next update.</%text>
+#repo_size_max_age = 3600
+
+<%text>## number of threads scanning the repository root for repositories and</%text>
+<%text>## setting up the repositories found (kallithea-cli repo-scan and Remap and Rescan)</%text>
+#repo_scan_workers = 8
+
 <%text>## Path to Python executable to be used for git hooks.</%text>
 <%text>## This value will be written inside the git hook scripts as the text</%text>
 <%text>## after '#!' (shebang). When empty or not defined, the value of</%text>
@@ -194,6 +204,22 @@ commit_parse_limit = 25
 git_hook_interpreter = ${git_hook_interpreter}
 %endif
 
+<%text>## Unix socket a Kallithea process serving Git requests listens on for</%text>
+<%text>## handing over the work of git post-receive hooks - the hooks then exit</%text>
+<%text>## without connecting to the database. The work is queued in a .queue</%text>
+<%text>## directory next to the socket. When no Kallithea process is listening,</%text>
+<%text>## the hooks do the work themselves. Not available on Windows.</%text>
+#git_hook_socket = %(here)s/data/git-hooks.sock
+
+<%text>## directory where pushes are queued for logging them in the journal,</%text>
+<%text>## updating caches and statistics and calling the PUSH_HOOK extension after</%text>
+<%text>## the push has completed - by Celery when enabled, else by a thread in the</%text>
+<%text>## Kallithea web server processes, which check the queue every</%text>
+<%text>## push_queue_interval seconds.</%text>
+<%text>## Not available on Windows.</%text>
+#push_queue_dir = %(here)s/data/pushqueue
+#push_queue_interval = 2
+
 <%text>## path to git executable</%text>
 git_path = git
 
@@ -201,6 +227,31 @@ git_path = git
 <%text>## hide all refs in changelog switch this to --branches --tags</%text>
 #git_rev_filter = --branches --tags
 
+<%text>## number of repository instances each worker thread keeps open across</%text>
+<%text>## requests - set to 0 to open repositories on each request</%text>
+#repo_instance_cache_size = 20
+
+<%text>## number of parsed git tree objects each process keeps for path lookups</%text>
+<%text>## when browsing git repositories - set to 0 to disable</%text>
+#git_tree_cache_size = 2000
+
+<%text>## number of git ref advertisements and Mercurial capabilities, heads and</%text>
+<%text>## listkeys responses each process keeps for answering polling clients without</%text>
+<%text>## running git or opening the repository - set to 0 to disable</%text>
+#protocol_cache_size = 200
+
+<%text>## size in MB of the cache of parsed and rendered diffs for changesets,</%text>
+<%text>## compare and pull requests - set to 0 to disable</%text>
+#diff_cache_size = 256
+<%text>## the diff cache is stored in the diffcache directory in cache_dir by default</%text>
+#diff_cache_dir = %(here)s/data/diffcache
+
+<%text>## maximum cost of highlighting the changed words in a changed line, and in all</%text>
+<%text>## lines of a file, in tokens compared - very different lines are highlighted as</%text>
+<%text>## changed between their common start and end</%text>
+#inline_diff_line_budget = 50000
+#inline_diff_file_budget = 500000
+
 <%text>## RSS feed options</%text>
 rss_cut_off_limit = 256000
 rss_items_per_page = 10
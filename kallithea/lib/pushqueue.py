@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+kallithea.lib.pushqueue
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Durable queue of pushes that have not been processed yet.
+
+When ``push_queue_dir`` is set, pushes are only recorded in that directory
+while the client is waiting. Logging them in the journal, updating the
+changeset cache and statistics of the repository and calling the PUSH_HOOK
+extension is done later - in a Celery worker when Celery is enabled, and else
+in a background thread of the Kallithea web server processes. Consecutive
+pushes to the same repository are processed together.
+
+Each push is stored as a JSON file that is written to a temporary file and
+renamed into place. The file is only removed when the push has been
+processed, so pushes are not lost when a process dies - but they might be
+processed twice. Pushes that fail processing are moved to the ``failed``
+directory. A lock on the ``.lock`` file in the queue directory makes sure
+only one process at a time processes the queue.
+"""
+
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import traceback
+
+import kallithea
+from kallithea.lib.utils2 import safe_int
+
+
+log = logging.getLogger(__name__)
+
+
+def get_push_queue_dir():
+    """Return the configured ``push_queue_dir`` - or None if pushes are processed right away."""
+    return kallithea.CONFIG.get('push_queue_dir') or None
+
+
+def enqueue_push(queue_dir, ex, revs):
+    """Record the push of ``revs`` with hook environment ``ex`` in the queue."""
+    os.makedirs(queue_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=queue_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'extras': dict(ex), 'revs': revs}, f)
+        # names sort in the order the pushes were queued
+        name = '%016d%s.json' % (time.time() * 1000000, os.path.basename(tmp_path)[len('.tmp'):])
+        os.replace(tmp_path, os.path.join(queue_dir, name))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    log.debug('queued push of %s revisions to %s as %s', len(revs), ex['repository'], name)
+
+
+def has_queued_pushes(queue_dir):
+    try:
+        with os.scandir(queue_dir) as it:
+            return any(entry.name.endswith('.json') for entry in it)
+    except FileNotFoundError:
+        return False
+
+
+def process_push_queue(queue_dir, process_pushes):
+    """
+    Process all queued pushes by calling ``process_pushes(repo_name,
+    pushes)`` for each repository, with a list of ``(extras, revs)`` in
+    the order they were pushed. Return the number of processed pushes - or
+    None if another process is processing the queue.
+    """
+    import fcntl
+    os.makedirs(queue_dir, exist_ok=True)
+    with open(os.path.join(queue_dir, '.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+
+        batches = collections.OrderedDict()
+        for name in sorted(fn for fn in os.listdir(queue_dir) if fn.endswith('.json')):
+            path = os.path.join(queue_dir, name)
+            try:
+                with open(path) as f:
+                    push = json.load(f)
+                repo_name = push['extras']['repository']
+            except Exception:
+                log.error('invalid queued push %s:\n%s', path, traceback.format_exc())
+                _move_to_failed(queue_dir, [path])
+                continue
+            batches.setdefault(repo_name, []).append((path, push))
+
+        count = 0
+        for repo_name, batch in batches.items():
+            paths = [path for path, push in batch]
+            try:
+                process_pushes(repo_name, [(push['extras'], push['revs']) for path, push in batch])
+            except Exception:
+                log.error('failed processing %s pushes to %s:\n%s', len(batch), repo_name, traceback.format_exc())
+                _move_to_failed(queue_dir, paths)
+                continue
+            for path in paths:
+                os.unlink(path)
+            count += len(batch)
+        return count
+
+
+def _move_to_failed(queue_dir, paths):
+    failed_dir = os.path.join(queue_dir, 'failed')
+    os.makedirs(failed_dir, exist_ok=True)
+    for path in paths:
+        os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+
+
+class PushQueueWorker(object):
+    """
+    Check the queue for pushes every ``interval`` seconds and run ``run`` to
+    process them. ``run`` returns a result with a ``ready()`` method, like the
+    Celery results returned by tasks - the queue is not checked while a
+    result isn't ready.
+    """
+
+    def __init__(self, queue_dir, run, interval):
+        self.queue_dir = queue_dir
+        self.run = run
+        self.interval = interval
+
+    def start(self):
+        threading.Thread(target=self._loop, name='pushqueue', daemon=True).start()
+
+    def _loop(self):
+        result = None
+        while True:
+            time.sleep(self.interval)
+            if result is not None and not result.ready():
+                continue
+            result = None
+            if has_queued_pushes(self.queue_dir):
+                try:
+                    result = self.run()
+                except Exception:
+                    log.error('failed processing push queue %s:\n%s', self.queue_dir, traceback.format_exc())
+
+
+_push_queue_worker = None
+
+
+def start_push_queue_worker(config, run):
+    """Start the PushQueueWorker for this process - unless it already has been started."""
+    global _push_queue_worker
+    if _push_queue_worker is None:
+        interval = safe_int(config.get('push_queue_interval'), 2)
+        _push_queue_worker = PushQueueWorker(config['push_queue_dir'], run, interval)
+        _push_queue_worker.start()
+    return _push_queue_worker
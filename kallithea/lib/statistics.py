@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+kallithea.lib.statistics
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Aggregation of repository statistics, as stored in the Statistics table and
+shown on the statistics page.
+"""
+
+import logging
+from operator import itemgetter
+from time import mktime
+
+from kallithea.config.conf import LANGUAGES_EXTENSIONS_MAP
+from kallithea.lib import ext_json
+from kallithea.lib.utils2 import ascii_bytes
+from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError
+
+
+log = logging.getLogger(__name__)
+
+# like Git, only look for NUL bytes in the beginning of files to detect binary
+BINARY_CHECK_SIZE = 8000
+
+
+def day_timestamp(date):
+    """Return the timestamp of the start of the day of ``date``"""
+    return mktime(date.timetuple()[:3] + (0, 0, 0, 0, 0, 0))
+
+
+class CommitActivity(object):
+    """
+    Number of commits and changed files per author and day, and the total
+    number of commits per day.
+
+    The data can be loaded from and dumped to the JSON formats of
+    ``Statistics.commit_activity`` and ``Statistics.commit_activity_combined``,
+    but is kept in dicts keyed by author and day while aggregating so adding a
+    changeset is O(1).
+    """
+
+    def __init__(self, commit_activity=None, commit_activity_combined=None):
+        self.authors = {}  # label: {"label", "data": [day buckets], "schema"}
+        self._author_days = {}  # label: {time: day bucket}
+        self.days = {}  # time: commit count
+        if commit_activity:
+            for label, author in ext_json.loads(commit_activity).items():
+                # skip the placeholder used when there is no data
+                data = [bucket for bucket in author['data'] if isinstance(bucket, dict)]
+                if data:
+                    self.authors[label] = dict(author, data=data)
+                    self._author_days[label] = dict((bucket['time'], bucket) for bucket in data)
+        if commit_activity_combined:
+            self.days = dict(ext_json.loads(commit_activity_combined))
+
+    def add(self, label, date, added=0, changed=0, removed=0):
+        """
+        Count a commit by the author ``label`` at ``date``, with the given
+        number of added, changed and removed files.
+        """
+        k = day_timestamp(date)
+        author_days = self._author_days.get(label)
+        if author_days is None:
+            author_days = self._author_days[label] = {}
+            self.authors[label] = {
+                "label": label,
+                "data": [],
+                "schema": ["commits"],
+            }
+        bucket = author_days.get(k)
+        if bucket is None:
+            bucket = author_days[k] = {
+                "time": k,
+                "commits": 0,
+                "added": 0,
+                "changed": 0,
+                "removed": 0,
+            }
+            self.authors[label]['data'].append(bucket)
+        bucket["commits"] += 1
+        bucket["added"] += added
+        bucket["changed"] += changed
+        bucket["removed"] += removed
+        self.days[k] = self.days.get(k, 0) + 1
+
+    def dump(self, contact_label):
+        """
+        Return commit_activity and commit_activity_combined as JSON bytes.
+        Without any commits, a placeholder for ``contact_label`` is used as
+        commit_activity.
+        """
+        authors = self.authors
+        if not authors:
+            authors = {
+                contact_label: {
+                    "label": contact_label,
+                    "data": [0, 1],
+                    "schema": ["commits"],
+                },
+            }
+        overview_data = sorted(self.days.items(), key=itemgetter(0))
+        return ascii_bytes(ext_json.dumps(authors)), ascii_bytes(ext_json.dumps(overview_data))
+
+
+def _language_extension(path):
+    """Return the extension of ``path`` if it is a known language, else None"""
+    ext = path.rsplit('/', 1)[-1].split('.')[-1].lower()
+    if ext in LANGUAGES_EXTENSIONS_MAP:
+        return ext
+    return None
+
+
+def _is_text(changeset, path):
+    return b'\0' not in changeset.get_file_content(path)[:BINARY_CHECK_SIZE]
+
+
+def _count_file(languages, changeset, path, delta):
+    ext = _language_extension(path)
+    if ext is not None and _is_text(changeset, path):
+        count = languages.get(ext, 0) + delta
+        if count > 0:
+            languages[ext] = count
+        else:
+            languages.pop(ext, None)
+
+
+def get_language_stats(repo, languages=None, revision=None):
+    """
+    Return a tuple with the number of non-binary files per language
+    extension in the tip of ``repo``, and the raw_id of the tip.
+
+    If ``languages`` were counted at the changeset ``revision``, they are
+    updated with the files added, changed and removed since then. The
+    whole tree is only scanned when there are no previous counts or the
+    revision no longer exists.
+    """
+    tip = repo.get_changeset()
+    if languages is not None and revision is not None:
+        if revision == tip.raw_id:
+            return languages, revision
+        try:
+            old = repo.get_changeset(revision)
+        except ChangesetDoesNotExistError:
+            log.debug('Revision %s is gone - counting languages in all files', revision)
+        else:
+            languages = dict(languages)
+            added, changed, removed = repo.get_changed_files(old.raw_id, tip.raw_id)
+            for path in removed + changed:
+                _count_file(languages, old, path, -1)
+            for path in added + changed:
+                _count_file(languages, tip, path, 1)
+            return languages, tip.raw_id
+
+    return count_languages(tip), tip.raw_id
+
+
+def count_languages(changeset):
+    """
+    Return the number of non-binary files per language extension in all
+    of ``changeset``.
+    """
+    languages = {}
+    for _topnode, _dirnodes, filenodes in changeset.walk('/'):
+        for filenode in filenodes:
+            _count_file(languages, changeset, filenode.path, 1)
+    return languages
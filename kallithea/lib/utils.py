@@ -25,22 +25,25 @@ Original author and date, and relevant copyright and licensing information is be
 :license: GPLv3, see LICENSE.md for more details.
 """
 
+import collections
+import concurrent.futures
 import datetime
 import logging
 import os
+import queue
 import re
 import sys
 import traceback
 import urllib.error
-from distutils.version import StrictVersion
 
 import mercurial.config
 import mercurial.error
 import mercurial.ui
 
+import kallithea
 import kallithea.config.conf
 from kallithea.lib.exceptions import InvalidCloneUriException
-from kallithea.lib.utils2 import ascii_bytes, aslist, get_current_authuser, safe_bytes, safe_str
+from kallithea.lib.utils2 import ascii_bytes, aslist, get_current_authuser, repo_name_slug, safe_bytes, safe_int, safe_str
 from kallithea.lib.vcs.backends.git.repository import GitRepository
 from kallithea.lib.vcs.backends.hg.repository import MercurialRepository
 from kallithea.lib.vcs.conf import settings
@@ -48,13 +51,18 @@ from kallithea.lib.vcs.exceptions import RepositoryError, VCSError
 from kallithea.lib.vcs.utils.fakemod import create_module
 from kallithea.lib.vcs.utils.helpers import get_scm
 from kallithea.model import db, meta
-from kallithea.model.db import RepoGroup, Repository, Setting, Ui, User, UserGroup, UserLog
+from kallithea.model.db import Permission, RepoGroup, Repository, Setting, Ui, User, UserGroup, UserLog
 
 
 log = logging.getLogger(__name__)
 
 REMOVED_REPO_PAT = re.compile(r'rm__\d{8}_\d{6}_\d{6}_.*')
 
+# number of directories each get_filesystem_repos task scans
+SCAN_BATCH_SIZE = 32
+# number of repositories repo2db_mapper creates or removes at a time
+REPO2DB_BATCH_SIZE = 100
+
 
 #==============================================================================
 # PERM DECORATOR HELPERS FOR EXTRACTING NAMES FOR PERM CHECKS
@@ -165,63 +173,144 @@ def action_logger(user, action, repo, ipaddr='', commit=False):
         meta.Session().commit()
 
 
-def get_filesystem_repos(path):
+class FilesystemRepo(collections.namedtuple('FilesystemRepo', 'name alias path')):
     """
-    Scans given path for repos and return (name,(type,path)) tuple
-
-    :param path: path to scan for repositories
-    :param recursive: recursive search and return names with subdirs in front
+    Repository found by get_filesystem_repos: its name relative to the
+    scanned path, its type ('hg' or 'git') and its full path. The vcs
+    backend is only instantiated when calling scm_instance.
     """
+    __slots__ = ()
 
-    # remove ending slash for better results
-    path = path.rstrip(os.sep)
-    log.debug('now scanning in %s', path)
+    def scm_instance(self, baseui=None):
+        if self.alias == 'hg':
+            return MercurialRepository(self.path, baseui=baseui or make_ui())
+        return GitRepository(self.path)
 
-    def isdir(*n):
-        return os.path.isdir(os.path.join(*n))
 
-    for root, dirs, _files in os.walk(path):
-        recurse_dirs = []
-        for subdir in dirs:
-            # skip removed repos
-            if REMOVED_REPO_PAT.match(subdir):
-                continue
+def _repo_alias(entries):
+    """
+    Return the type of repository a directory with ``entries`` (a dict of
+    os.DirEntry by name) is - or '' for directories that should be ignored,
+    or None if it isn't a repository.
+    """
+    def isdir(name):
+        return name in entries and entries[name].is_dir()
 
-            # skip .<something> dirs TODO: rly? then we should prevent creating them ...
-            if subdir.startswith('.'):
-                continue
+    def isfile(name):
+        return name in entries and entries[name].is_file()
 
-            cur_path = os.path.join(root, subdir)
-            if isdir(cur_path, '.git'):
-                log.warning('ignoring non-bare Git repo: %s', cur_path)
-                continue
+    if isdir('.git'):
+        return ''
+    if isdir('.hg'):
+        return 'hg'
+    if isdir('rm__.hg') or isdir('rm__.git'): # left overs from old method for deleting
+        return None
+    if isdir('objects') and (isdir('refs') or isfile('packed-refs')) and isfile('HEAD'):
+        return 'git'
+    return None
 
-            if (isdir(cur_path, '.hg') or
-                isdir(cur_path, '.svn') or
-                isdir(cur_path, 'objects') and (isdir(cur_path, 'refs') or
-                                                os.path.isfile(os.path.join(cur_path, 'packed-refs')))):
 
-                if not os.access(cur_path, os.R_OK) or not os.access(cur_path, os.X_OK):
-                    log.warning('ignoring repo path without access: %s', cur_path)
-                    continue
+def _scan_dir(path, is_root, recurse, cached):
+    """
+    Scan the directory ``path`` and return ``(mtime, alias, subdirs)``,
+    where ``alias`` is the repository type - or None if it isn't a
+    repository, and ``subdirs`` are ``(name, recurse)`` for the directories
+    in it that should be scanned next. ``cached`` is the result of a
+    previous scan, which is returned if the directory hasn't changed since.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if cached is not None and cached[0] == mtime:
+        return cached
+
+    with os.scandir(path) as it:
+        entries = {entry.name: entry for entry in it}
+
+    if not is_root:
+        alias = _repo_alias(entries)
+        if alias == '':
+            log.warning('ignoring non-bare Git repo: %s', path)
+            return mtime, None, ()
+        if alias is not None:
+            if not os.access(path, os.R_OK) or not os.access(path, os.X_OK):
+                log.warning('ignoring repo path without access: %s', path)
+                return mtime, None, ()
+            if not os.access(path, os.W_OK):
+                log.warning('repo path without write access: %s', path)
+            return mtime, alias, ()
+
+    if not recurse:
+        return mtime, None, ()
+    subdirs = tuple(sorted(
+        # don't descend into symlinked directories - like os.walk
+        (name, not entry.is_symlink())
+        for name, entry in entries.items()
+        # skip removed repos
+        if not REMOVED_REPO_PAT.match(name)
+        # skip .<something> dirs TODO: rly? then we should prevent creating them ...
+        and not name.startswith('.')
+        and entry.is_dir()
+    ))
+    return mtime, None, subdirs
+
+
+def get_filesystem_repos(path, scan_cache=None, workers=None):
+    """
+    Scans given path for repos and yield FilesystemRepo records, in no
+    particular order. Directories are scanned in parallel by ``workers``
+    threads - by default ``repo_scan_workers`` from the configuration.
 
-                if not os.access(cur_path, os.W_OK):
-                    log.warning('repo path without write access: %s', cur_path)
+    :param path: path to scan for repositories
+    :param scan_cache: dict with the results of the previous scan of the same
+        path - only directories with a different mtime are scanned again. The
+        dict is updated when the scan completes.
+    """
 
-                try:
-                    scm_info = get_scm(cur_path)
-                    assert cur_path.startswith(path)
-                    repo_path = cur_path[len(path) + 1:]
-                    yield repo_path, scm_info
-                    continue # no recursion
-                except VCSError:
-                    # We should perhaps ignore such broken repos, but especially
-                    # the bare git detection is unreliable so we dive into it
-                    pass
+    # remove ending slash for better results
+    path = path.rstrip(os.sep)
+    log.debug('now scanning in %s', path)
 
-            recurse_dirs.append(subdir)
+    if workers is None:
+        workers = safe_int(kallithea.CONFIG.get('repo_scan_workers'), 8)
+    cached = scan_cache or {}
+    scanned = {}
 
-        dirs[:] = recurse_dirs
+    def scan_dirs(dirs):
+        results = []
+        for name, recurse in dirs:
+            dir_path = os.path.join(path, name) if name else path
+            try:
+                result = _scan_dir(dir_path, not name, recurse, cached.get(dir_path))
+            except OSError as e:
+                log.warning('ignoring path that cannot be scanned: %s', e)
+                continue
+            results.append((name, dir_path, result))
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        done = queue.Queue()
+
+        def submit(dirs):
+            executor.submit(scan_dirs, dirs).add_done_callback(done.put)
+
+        submit([('', True)])
+        pending = 1
+        while pending:
+            results = done.get().result()
+            pending -= 1
+            for name, dir_path, result in results:
+                scanned[dir_path] = result
+                _mtime, alias, subdirs = result
+                if alias is not None:
+                    yield FilesystemRepo(name, alias, dir_path)
+                # scan in batches - one task per directory costs more than listing it
+                for i in range(0, len(subdirs), SCAN_BATCH_SIZE):
+                    submit([(os.path.join(name, subdir) if name else subdir, recurse)
+                            for subdir, recurse in subdirs[i:i + SCAN_BATCH_SIZE]])
+                    pending += 1
+
+    if scan_cache is not None:
+        scan_cache.clear()
+        scan_cache.update(scanned)
 
 
 def is_valid_repo_uri(repo_type, url, ui):
@@ -380,6 +469,8 @@ def set_vcs_config(config):
 
     settings.GIT_EXECUTABLE_PATH = config.get('git_path', 'git')
     settings.GIT_REV_FILTER = config.get('git_rev_filter', '--all').strip()
+    settings.REPO_INSTANCE_CACHE_SIZE = safe_int(config.get('repo_instance_cache_size'), 20)
+    settings.GIT_TREE_CACHE_SIZE = safe_int(config.get('git_tree_cache_size'), 2000)
     settings.DEFAULT_ENCODINGS = aslist(config.get('default_encoding',
                                                         'utf-8'), sep=',')
 
@@ -438,6 +529,38 @@ def map_groups(path):
     return group
 
 
+def _prepare_filesystem_repo(repo, baseui, new, install_git_hooks, overwrite_git_hooks):
+    """
+    Prepare the FilesystemRepo ``repo`` for repo2db_mapper - this runs in a
+    worker thread and must not use the database. Install the Git hooks and,
+    if the repository is ``new`` in the database, return its description and
+    changeset cache - or None if it can't be opened.
+    """
+    from kallithea.model.scm import ScmModel
+    try:
+        scm_repo = repo.scm_instance(baseui)
+    except (VCSError, OSError) as e:
+        log.warning('ignoring repository %s that cannot be opened: %s', repo.path, e)
+        return None
+    if scm_repo.alias == 'git':
+        if new:
+            ScmModel().install_git_hooks(scm_repo)
+            # update repository server-info
+            log.debug('Running update server info')
+            scm_repo._update_server_info()
+        elif install_git_hooks:
+            ScmModel().install_git_hooks(scm_repo, force_create=overwrite_git_hooks)
+    if not new:
+        return None
+    desc = (scm_repo.description
+            if scm_repo.description != 'unknown'
+            else '%s repository' % repo.name)
+    cs_cache = None
+    if scm_repo: # not empty
+        cs_cache = scm_repo.get_changeset().__json__()
+    return desc, cs_cache
+
+
 def repo2db_mapper(initial_repo_dict, remove_obsolete=False,
                    install_git_hooks=False, user=None, overwrite_git_hooks=False):
     """
@@ -445,7 +568,12 @@ def repo2db_mapper(initial_repo_dict, remove_obsolete=False,
     are created, if remove_obsolete is True it also check for db entries
     that are not in initial_repo_dict and removes them.
 
-    :param initial_repo_dict: mapping with repositories found by scanning methods
+    The repositories are opened, and Git hooks installed, by
+    ``repo_scan_workers`` threads. The new repositories are then created in
+    one transaction, flushed to the database in batches.
+
+    :param initial_repo_dict: mapping with FilesystemRepo records found by
+        scanning methods
     :param remove_obsolete: check for obsolete entries in database
     :param install_git_hooks: if this is True, also check and install git hook
         for a repo if missing
@@ -453,73 +581,108 @@ def repo2db_mapper(initial_repo_dict, remove_obsolete=False,
         that may be encountered (even if user-deployed)
     """
     from kallithea.model.repo import RepoModel
-    from kallithea.model.scm import ScmModel
     sa = meta.Session()
     repo_model = RepoModel()
     if user is None:
         user = User.get_first_admin()
-    added = []
+    user = User.guess_instance(user)
 
     # creation defaults
     defs = Setting.get_default_repo_settings(strip_prefix=True)
     enable_statistics = defs.get('repo_enable_statistics')
     enable_downloads = defs.get('repo_enable_downloads')
     private = defs.get('repo_private')
+    def_user = User.get_default_user()
+    default_perm = Permission.get_by_key(repo_model._get_default_perm(def_user, private))
 
-    for name, repo in initial_repo_dict.items():
-        group = map_groups(name)
-        db_repo = repo_model.get_by_repo_name(name)
-        # found repo that is on filesystem not in Kallithea database
-        if not db_repo:
+    db_repo_names = set(repo_name for repo_name, in sa.query(Repository.repo_name))
+    added = []
+    for name in initial_repo_dict:
+        if name in db_repo_names:
+            continue
+        repo_name = name.rpartition(db.URL_SEP)[2]
+        if repo_name_slug(repo_name) != repo_name:
+            log.warning('ignoring repository %s with invalid name', name)
+            continue
+        added.append(name)
+    prepare_names = added
+    if install_git_hooks:
+        prepare_names = [name for name in initial_repo_dict
+                         if name not in db_repo_names or initial_repo_dict[name].alias == 'git']
+
+    baseui = make_ui()
+    workers = safe_int(kallithea.CONFIG.get('repo_scan_workers'), 8)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        prepared = dict(zip(prepare_names, executor.map(
+            lambda name: _prepare_filesystem_repo(initial_repo_dict[name], baseui, name not in db_repo_names,
+                                                  install_git_hooks, overwrite_git_hooks),
+            prepare_names)))
+
+    # found repos that are on filesystem but not in Kallithea database
+    added = [name for name in added if prepared[name] is not None]
+    groups = {}
+    for i in range(0, len(added), REPO2DB_BATCH_SIZE):
+        new_repos = []
+        for name in added[i:i + REPO2DB_BATCH_SIZE]:
             log.info('repository %s not found, creating now', name)
-            added.append(name)
-            desc = (repo.description
-                    if repo.description != 'unknown'
-                    else '%s repository' % name)
+            group_name = name.rpartition(db.URL_SEP)[0]
+            if group_name not in groups:
+                groups[group_name] = map_groups(name)
+            desc, cs_cache = prepared[name]
 
             new_repo = repo_model._create_repo(
                 repo_name=name,
-                repo_type=repo.alias,
+                repo_type=initial_repo_dict[name].alias,
                 description=desc,
-                repo_group=getattr(group, 'group_id', None),
+                repo_group=groups[group_name],
                 owner=user,
                 enable_downloads=enable_downloads,
                 enable_statistics=enable_statistics,
                 private=private,
-                state=Repository.STATE_CREATED
+                state=Repository.STATE_CREATED,
+                def_user=def_user,
+                default_perm=default_perm,
+                flush=False,
             )
-            sa.commit()
-            # we added that repo just now, and make sure it has githook
-            # installed, and updated server info
-            if new_repo.repo_type == 'git':
-                git_repo = new_repo.scm_instance
-                ScmModel().install_git_hooks(git_repo)
-                # update repository server-info
-                log.debug('Running update server info')
-                git_repo._update_server_info()
-            new_repo.update_changeset_cache()
-        elif install_git_hooks:
-            if db_repo.repo_type == 'git':
-                ScmModel().install_git_hooks(db_repo.scm_instance, force_create=overwrite_git_hooks)
-
-    removed = []
+            if cs_cache is not None:
+                new_repo.update_changeset_cache(cs_cache)
+            new_repos.append(new_repo)
+        sa.flush()
+        for new_repo in new_repos:
+            action_logger(user, 'started_following_repo', new_repo)
+    sa.commit()
+
+    removed = sorted(repo_name for repo_name in db_repo_names if repo_name not in initial_repo_dict)
     # remove from database those repositories that are not in the filesystem
-    for repo in sa.query(Repository).all():
-        if repo.repo_name not in initial_repo_dict:
-            if remove_obsolete:
-                log.debug("Removing non-existing repository found in db `%s`",
-                          repo.repo_name)
-                try:
-                    RepoModel().delete(repo, forks='detach', fs_remove=False)
-                    sa.commit()
-                except Exception:
-                    #don't hold further removals on error
-                    log.error(traceback.format_exc())
-                    sa.rollback()
-            removed.append(repo.repo_name)
+    if remove_obsolete:
+        for i in range(0, len(removed), REPO2DB_BATCH_SIZE):
+            batch = removed[i:i + REPO2DB_BATCH_SIZE]
+            try:
+                _remove_repos(batch)
+            except Exception:
+                log.error(traceback.format_exc())
+                sa.rollback()
+                # don't hold further removals on error
+                for repo_name in batch:
+                    try:
+                        _remove_repos([repo_name])
+                    except Exception:
+                        log.error(traceback.format_exc())
+                        sa.rollback()
     return added, removed
 
 
+def _remove_repos(repo_names):
+    from kallithea.model.repo import RepoModel
+    sa = meta.Session()
+    with sa.no_autoflush: # flush all deletes at once
+        for repo in Repository.query().filter(Repository.repo_name.in_(repo_names)).all():
+            log.debug("Removing non-existing repository found in db `%s`",
+                      repo.repo_name)
+            RepoModel().delete(repo, forks='detach', fs_remove=False)
+    sa.commit()
+
+
 def load_rcextensions(root_path):
     path = os.path.join(root_path, 'rcextensions', '__init__.py')
     if os.path.isfile(path):
@@ -552,13 +715,15 @@ def load_rcextensions(root_path):
 # MISC
 #==============================================================================
 
-git_req_ver = StrictVersion('1.7.4')
+git_req_ver = '1.7.4'
 
 def check_git_version():
     """
     Checks what version of git is installed on the system, and raise a system exit
     if it's too old for Kallithea to work properly.
     """
+    from distutils.version import StrictVersion # slow - avoid importing it in Git hooks
+
     if 'git' not in kallithea.BACKENDS:
         return None
 
@@ -586,7 +751,7 @@ def check_git_version():
         ver = StrictVersion(m.group(0))
         log.debug('Git executable: "%s", version %s (parsed from: "%s")',
                   settings.GIT_EXECUTABLE_PATH, ver, output)
-        if ver < git_req_ver:
+        if ver < StrictVersion(git_req_ver):
             log.error('Kallithea detected %s version %s, which is too old '
                       'for the system to function properly. '
                       'Please upgrade to version %s or later. '
@@ -486,6 +486,8 @@ def set_hook_environment(username, ip_addr, repo_name, repo_alias, action=None):
         'repository': repo_name,
         'scm': repo_alias, # used to pick hack in log_push_action_raw_ids
         'config': CONFIG['__file__'], # used by git hook to read config
+        'hook_socket': CONFIG.get('git_hook_socket'), # used by git hook to hand over to a running Kallithea
+        'git_path': CONFIG.get('git_path'), # used by git hook before handing over
     }
     os.environ['KALLITHEA_EXTRAS'] = json.dumps(extras)
 
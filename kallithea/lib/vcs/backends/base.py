@@ -9,6 +9,7 @@
     :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
 """
 
+import collections
 import datetime
 import itertools
 
@@ -20,6 +21,14 @@ from kallithea.lib.vcs.utils.helpers import get_dict_for_attrs
 from kallithea.lib.vcs.utils.lazy import LazyProperty
 
 
+ChangesetMetadata = collections.namedtuple('ChangesetMetadata', [
+    'revision', 'raw_id', 'author', 'date', 'message', 'parents',
+    'added', 'changed', 'removed'])
+
+FileHistoryEntry = collections.namedtuple('FileHistoryEntry', [
+    'revision', 'raw_id', 'author', 'date', 'message'])
+
+
 class BaseRepository(object):
     """
     Base Repository for final backends
@@ -132,6 +141,14 @@ class BaseRepository(object):
     def is_empty(self):
         return self._empty
 
+    def get_state_token(self):
+        """
+        Returns a value that is cheap to compute from the file system and
+        changes whenever changesets or refs are added or removed. Used for
+        checking if a cached instance of this repository still is valid.
+        """
+        raise NotImplementedError
+
     #==========================================================================
     # CHANGESETS
     #==========================================================================
@@ -169,6 +186,58 @@ class BaseRepository(object):
         """
         raise NotImplementedError
 
+    def get_changelog(self, end=None, branch_name=None):
+        """
+        Returns ``ChangelogCollection`` of the changesets up to ``end`` (or
+        the tip), newest first. Only changesets reachable from
+        ``branch_name`` are included if it is specified.
+
+        Slicing the collection only retrieves the changesets in the slice,
+        so paging through the changelog is O(page) instead of O(history).
+
+        :param end: None or str
+        :param branch_name: None or str
+        :raise BranchDoesNotExistError: If given ``branch_name`` does not
+            exist.
+        :raise ChangesetDoesNotExistError: If changeset for given ``end``
+            could not be found.
+        """
+        raise NotImplementedError
+
+    @LazyProperty
+    def _changelog_counts(self):
+        """
+        Cache of changelog lengths - this repository instance is only used
+        as long as its refs are unchanged.
+        """
+        return {}
+
+    def get_changesets_metadata(self, start=None, end=None):
+        """
+        Returns iterator of ``ChangesetMetadata`` tuples for the changesets
+        with revision numbers from ``start`` to ``end`` (exclusive, like
+        slicing ``revisions``). ``parents`` is a list of raw ids, ``added``,
+        ``changed`` and ``removed`` are the same lists of paths as for the
+        corresponding changesets - for merges, that is the files that differ
+        from any parent for Git and from the first parent for Mercurial.
+
+        This is meant for bulk consumers - backends retrieve the data in
+        batches without creating changeset or node objects.
+        """
+        for revision, cs in zip(range(*slice(start, end).indices(self.count())), self[start:end]):
+            yield ChangesetMetadata(revision, cs.raw_id, cs.author, cs.date, cs.message,
+                                    [p.raw_id for p in cs.parents],
+                                    [n.path for n in cs.added],
+                                    [n.path for n in cs.changed],
+                                    [n.path for n in cs.removed])
+
+    def get_changed_files(self, rev1, rev2):
+        """
+        Returns tuple with lists of paths of files added, changed and removed
+        between the changesets ``rev1`` and ``rev2``.
+        """
+        raise NotImplementedError
+
     def __getitem__(self, key):
         if isinstance(key, slice):
             return (self.get_changeset(rev) for rev in self.revisions[key])
@@ -501,13 +570,23 @@ class BaseChangeset(object):
         """
         Returns last commit of the file at the given ``path``.
         """
-        raise NotImplementedError
+        return self.get_file_history(path, limit=1)[0]
 
-    def get_file_history(self, path):
+    def get_file_history(self, path, limit=None):
         """
         Returns history of file as reversed list of ``Changeset`` objects for
         which file at given ``path`` has been modified.
         """
+        return [self.repository.get_changeset(entry.raw_id)
+                for entry in self.iter_file_history(path, limit=limit)]
+
+    def iter_file_history(self, path, offset=0, limit=None):
+        """
+        Returns iterator of ``FileHistoryEntry`` tuples for the changesets
+        in which the file at given ``path`` has been modified, newest first.
+        The first ``offset`` entries are skipped and at most ``limit``
+        entries are returned. The history is computed while iterating.
+        """
         raise NotImplementedError
 
     def get_nodes(self, path):
@@ -1030,6 +1109,57 @@ class EmptyChangeset(BaseChangeset):
         return 0
 
 
+class ChangelogCollection(object):
+    """
+    Lazy sequence of changesets, newest first, as returned by
+    ``get_changelog``. It is backed by two functions: ``get_window(offset,
+    limit)`` returning the raw ids of at most ``limit`` changesets after
+    skipping the ``offset`` newest, and ``get_count()`` returning the total
+    number of changesets. The count is only computed when needed.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, repo, get_window, get_count):
+        self.repo = repo
+        self._get_window = get_window
+        self._get_count = get_count
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._get_count()
+        return self._count
+
+    def __iter__(self):
+        offset = 0
+        while True:
+            revs = self._get_window(offset, self.BATCH_SIZE)
+            for rev in revs:
+                yield self.repo.get_changeset(rev)
+            if len(revs) < self.BATCH_SIZE:
+                return
+            offset += len(revs)
+
+    def __getitem__(self, what):
+        """Return either a single element by index, or a sliced collection."""
+        if isinstance(what, slice):
+            start = what.start or 0
+            if what.step not in (None, 1) or start < 0 or what.stop is None or what.stop < 0:
+                # not a plain window - get everything
+                return CollectionGenerator(self.repo, self._get_window(0, len(self)))[what]
+            return CollectionGenerator(self.repo, self._get_window(start, max(what.stop - start, 0)))
+        if what < 0:
+            what += len(self)
+        revs = self._get_window(what, 1) if what >= 0 else []
+        if not revs:
+            raise IndexError('changelog index out of range')
+        return self.repo.get_changeset(revs[0])
+
+    def __repr__(self):
+        return '<ChangelogCollection[len:%s]>' % (len(self))
+
+
 class CollectionGenerator(object):
 
     def __init__(self, repo, revs):
@@ -1,19 +1,26 @@
 import re
 from io import BytesIO
 from itertools import chain
+from stat import S_ISDIR
 from subprocess import PIPE, Popen
 
 from dulwich import objects
 from dulwich.config import ConfigFile
 
-from kallithea.lib.vcs.backends.base import BaseChangeset, EmptyChangeset
+from kallithea.lib.vcs.backends.base import BaseChangeset, EmptyChangeset, FileHistoryEntry
 from kallithea.lib.vcs.conf import settings
 from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError, ChangesetError, ImproperArchiveTypeError, NodeDoesNotExistError, RepositoryError, VCSError
 from kallithea.lib.vcs.nodes import (AddedFileNodesGenerator, ChangedFileNodesGenerator, DirNode, FileNode, NodeKind, RemovedFileNodesGenerator, RootNode,
                                      SubModuleNode)
-from kallithea.lib.vcs.utils import ascii_bytes, ascii_str, date_fromtimestamp, safe_int, safe_str
+from kallithea.lib.vcs.utils import ascii_bytes, ascii_str, date_fromtimestamp, safe_bytes, safe_int, safe_str
 from kallithea.lib.vcs.utils.lazy import LazyProperty
 
+from .treecache import tree_cache
+
+
+# start of a group in git blame --incremental output: sha, source line, result line and number of lines
+_blame_group_re = re.compile(r'^([0-9a-f]{40}) \d+ (\d+) (\d+)$')
+
 
 class GitChangeset(BaseChangeset):
     """
@@ -98,64 +105,45 @@ class GitChangeset(BaseChangeset):
         heads = self.repository._heads(reverse=True)
         return [safe_str(b) for b in heads if heads[b] == self._commit.id] # FIXME: Inefficient ... and returning None!
 
+    def _get_tree(self, tree_id):
+        return tree_cache.get(self.repository._repo, tree_id)
+
     def _get_id_for_path(self, path):
-        # FIXME: Please, spare a couple of minutes and make those codes cleaner;
+        path = path.strip('/')
         if path not in self._paths:
-            path = path.strip('/')
-            # set root tree
-            tree = self.repository._repo[self._tree_id]
             if path == '':
-                self._paths[''] = tree.id
-                return tree.id
-            splitted = path.split('/')
-            dirs, name = splitted[:-1], splitted[-1]
-            curdir = ''
-
-            # initially extract things from root dir
-            for item, stat, id in tree.items():
-                name = safe_str(item)
-                if curdir:
-                    name = '/'.join((curdir, name))
-                self._paths[name] = id
-                self._stat_modes[name] = stat
-
-            for dir in dirs:
-                if curdir:
-                    curdir = '/'.join((curdir, dir))
-                else:
-                    curdir = dir
-                dir_id = None
-                for item, stat, id in tree.items():
-                    name = safe_str(item)
-                    if dir == name:
-                        dir_id = id
-                if dir_id:
-                    # Update tree
-                    tree = self.repository._repo[dir_id]
-                    if not isinstance(tree, objects.Tree):
-                        raise ChangesetError('%s is not a directory' % curdir)
-                else:
-                    raise ChangesetError('%s have not been found' % curdir)
-
-                # cache all items from the given traversed tree
-                for item, stat, id in tree.items():
-                    name = safe_str(item)
-                    if curdir:
-                        name = '/'.join((curdir, name))
-                    self._paths[name] = id
-                    self._stat_modes[name] = stat
-            if path not in self._paths:
+                self._paths[''] = self._tree_id
+                return self._tree_id
+            dir_path, _sep, name = path.rpartition('/')
+            try:
+                dir_id = self._get_id_for_path(dir_path)
+            except NodeDoesNotExistError:
+                raise ChangesetError('%s have not been found' % dir_path)
+            tree = self._get_tree(dir_id)
+            if not isinstance(tree, objects.Tree):
+                raise ChangesetError('%s is not a directory' % dir_path)
+            try:
+                stat, id = tree[safe_bytes(name)]
+            except KeyError:
                 raise NodeDoesNotExistError("There is no file nor directory "
                     "at the given path '%s' at revision %s"
                     % (path, self.short_id))
+            self._paths[path] = id
+            self._stat_modes[path] = stat
         return self._paths[path]
 
     def _get_kind(self, path):
-        obj = self.repository._repo[self._get_id_for_path(path)]
-        if isinstance(obj, objects.Blob):
-            return NodeKind.FILE
-        elif isinstance(obj, objects.Tree):
+        self._get_id_for_path(path)
+        stat = self._stat_modes.get(path.strip('/'))
+        if stat is None or S_ISDIR(stat):
             return NodeKind.DIR
+        elif not objects.S_ISGITLINK(stat):
+            return NodeKind.FILE
+
+    def _get_submodule_url(self, path):
+        tree = self._get_tree(self._tree_id)
+        cf = ConfigFile.from_file(BytesIO(self.repository._repo.get_object(tree[b'.gitmodules'][1]).data))
+        return ascii_str(cf.get(('submodule', path), 'url'))
 
     def _get_filectx(self, path):
         path = path.rstrip('/')
@@ -259,64 +247,51 @@ class GitChangeset(BaseChangeset):
         blob = self.repository._repo[id]
         return blob.raw_length()
 
-    def get_file_changeset(self, path):
-        """
-        Returns last commit of the file at the given ``path``.
-        """
-        return self.get_file_history(path, limit=1)[0]
-
-    def get_file_history(self, path, limit=None):
+    def iter_file_history(self, path, offset=0, limit=None):
         """
-        Returns history of file as reversed list of ``Changeset`` objects for
-        which file at given ``path`` has been modified.
+        Returns iterator of ``FileHistoryEntry`` tuples for the changesets
+        in which the file at given ``path`` has been modified, newest first.
 
-        TODO: This function now uses os underlying 'git' and 'grep' commands
-        which is generally not good. Should be replaced with algorithm
-        iterating commits.
+        The changesets are found by ``git log``, which prunes the history on
+        the path and stops when ``limit`` entries after ``offset`` have been
+        found.
         """
-        self._get_filectx(path)
-
+        path = self._get_filectx(path)
+        cmd = ['log', '--format=%H', '--skip=%d' % offset]
         if limit is not None:
-            cmd = ['log', '-n', str(safe_int(limit, 0)),
-                   '--pretty=format:%H', '-s', self.raw_id, '--', path]
-
-        else:
-            cmd = ['log',
-                   '--pretty=format:%H', '-s', self.raw_id, '--', path]
+            cmd.append('--max-count=%d' % limit)
+        cmd += [self.raw_id, '--', path]
         so = self.repository.run_git_command(cmd)
-        ids = re.findall(r'[0-9a-fA-F]{40}', so)
-        return [self.repository.get_changeset(sha) for sha in ids]
-
-    def get_file_history_2(self, path):
-        """
-        Returns history of file as reversed list of ``Changeset`` objects for
-        which file at given ``path`` has been modified.
-
-        """
-        self._get_filectx(path)
-        from dulwich.walk import Walker
-        include = [self.raw_id]
-        walker = Walker(self.repository._repo.object_store, include,
-                        paths=[path], max_entries=1)
-        return [self.repository.get_changeset(ascii_str(x.commit.id.decode))
-                for x in walker]
+        repo = self.repository._repo
+        for raw_id in re.findall(r'[0-9a-fA-F]{40}', so):
+            commit = repo[ascii_bytes(raw_id)]
+            yield FileHistoryEntry(self.repository.revisions.index(raw_id), raw_id,
+                                   safe_str(getattr(commit, self._author_property)),
+                                   date_fromtimestamp(getattr(commit, self._date_property)),
+                                   safe_str(commit.message))
 
     def get_file_annotate(self, path):
         """
         Returns a generator of four element tuples with
             lineno, sha, changeset lazy loader and line
         """
-        # TODO: This function now uses os underlying 'git' command which is
-        # generally not good. Should be replaced with algorithm iterating
-        # commits.
-        cmd = ['blame', '-l', '--root', '-r', self.raw_id, '--', path]
-        # -l     ==> outputs long shas (and we need all 40 characters)
-        # --root ==> doesn't put '^' character for boundaries
-        # -r sha ==> blames for the given revision
+        # --incremental only outputs the line ranges blamed on each commit,
+        # the lines themselves are taken from the file
+        cmd = ['blame', '--incremental', self.raw_id, '--', path]
         so = self.repository.run_git_command(cmd)
-
-        for i, blame_line in enumerate(so.split('\n')[:-1]):
-            sha, line = re.split(r' ', blame_line, 1)
+        shas = {}
+        for blame_line in so.split('\n'):
+            m = _blame_group_re.match(blame_line)
+            if m is not None:
+                sha, final_lineno, num_lines = m.group(1), int(m.group(2)), int(m.group(3))
+                for lineno in range(final_lineno, final_lineno + num_lines):
+                    shas[lineno] = sha
+
+        lines = safe_str(self.get_file_content(path)).split('\n')
+        if lines[-1] == '':
+            del lines[-1]
+        for i, line in enumerate(lines):
+            sha = shas[i + 1]
             yield (i + 1, sha, lambda sha=sha: self.repository.get_changeset(sha), line)
 
     def fill_archive(self, stream=None, kind='tgz', prefix=None,
@@ -389,7 +364,7 @@ class GitChangeset(BaseChangeset):
                 " '%s'" % (self.revision, path))
         path = path.rstrip('/')
         id = self._get_id_for_path(path)
-        tree = self.repository._repo[id]
+        tree = self._get_tree(id)
         dirnodes = []
         filenodes = []
         als = self.repository.alias
@@ -397,24 +372,16 @@ class GitChangeset(BaseChangeset):
             obj_path = safe_str(name)
             if path != '':
                 obj_path = '/'.join((path, obj_path))
-            if objects.S_ISGITLINK(stat):
-                root_tree = self.repository._repo[self._tree_id]
-                cf = ConfigFile.from_file(BytesIO(self.repository._repo.get_object(root_tree[b'.gitmodules'][1]).data))
-                url = ascii_str(cf.get(('submodule', obj_path), 'url'))
-                dirnodes.append(SubModuleNode(obj_path, url=url, changeset=ascii_str(id),
-                                              alias=als))
-                continue
-
-            obj = self.repository._repo.get_object(id)
-            if obj_path not in self._stat_modes:
+            if obj_path not in self._paths:
+                self._paths[obj_path] = id
                 self._stat_modes[obj_path] = stat
-            if isinstance(obj, objects.Tree):
+            if objects.S_ISGITLINK(stat):
+                dirnodes.append(SubModuleNode(obj_path, url=self._get_submodule_url(obj_path),
+                                              changeset=ascii_str(id), alias=als))
+            elif S_ISDIR(stat):
                 dirnodes.append(DirNode(obj_path, changeset=self))
-            elif isinstance(obj, objects.Blob):
-                filenodes.append(FileNode(obj_path, changeset=self, mode=stat))
             else:
-                raise ChangesetError("Requested object should be Tree "
-                                     "or Blob, is %r" % type(obj))
+                filenodes.append(FileNode(obj_path, changeset=self, mode=stat))
         nodes = dirnodes + filenodes
         for node in nodes:
             if node.path not in self.nodes:
@@ -437,27 +404,17 @@ class GitChangeset(BaseChangeset):
 
             stat = self._stat_modes.get(path)
             if stat and objects.S_ISGITLINK(stat):
-                tree = self.repository._repo[self._tree_id]
-                cf = ConfigFile.from_file(BytesIO(self.repository._repo.get_object(tree[b'.gitmodules'][1]).data))
-                url = ascii_str(cf.get(('submodule', path), 'url'))
-                node = SubModuleNode(path, url=url, changeset=ascii_str(id_),
+                node = SubModuleNode(path, url=self._get_submodule_url(path), changeset=ascii_str(id_),
                                      alias=self.repository.alias)
-            else:
-                obj = self.repository._repo.get_object(id_)
-
-                if isinstance(obj, objects.Tree):
-                    if path == '':
-                        node = RootNode(changeset=self)
-                    else:
-                        node = DirNode(path, changeset=self)
-                    node._tree = obj
-                elif isinstance(obj, objects.Blob):
-                    node = FileNode(path, changeset=self)
-                    node._blob = obj
+            elif stat is None or S_ISDIR(stat):
+                if path == '':
+                    node = RootNode(changeset=self)
                 else:
-                    raise NodeDoesNotExistError("There is no file nor directory "
-                        "at the given path: '%s' at revision %s"
-                        % (path, self.short_id))
+                    node = DirNode(path, changeset=self)
+                node._tree = self._get_tree(id_)
+            else:
+                node = FileNode(path, changeset=self)
+                node._blob = self.repository._repo[id_]
             # cache node
             self.nodes[path] = node
         return self.nodes[path]
@@ -22,20 +22,21 @@ from collections import OrderedDict
 import mercurial.url  # import httpbasicauthhandler, httpdigestauthhandler
 import mercurial.util  # import url as hg_url
 from dulwich.config import ConfigFile
-from dulwich.objects import Tag
+from dulwich.objects import S_ISGITLINK, Tag
 from dulwich.repo import NotGitRepository, Repo
 
 from kallithea.lib.vcs import subprocessio
-from kallithea.lib.vcs.backends.base import BaseRepository, CollectionGenerator
+from kallithea.lib.vcs.backends.base import BaseRepository, ChangelogCollection, ChangesetMetadata, CollectionGenerator
 from kallithea.lib.vcs.conf import settings
 from kallithea.lib.vcs.exceptions import (BranchDoesNotExistError, ChangesetDoesNotExistError, EmptyRepositoryError, RepositoryError, TagAlreadyExistError,
                                           TagDoesNotExistError)
-from kallithea.lib.vcs.utils import ascii_str, date_fromtimestamp, makedate, safe_bytes, safe_str
+from kallithea.lib.vcs.utils import ascii_bytes, ascii_str, date_fromtimestamp, makedate, safe_bytes, safe_str
 from kallithea.lib.vcs.utils.lazy import LazyProperty
 from kallithea.lib.vcs.utils.paths import abspath, get_user_home
 
 from .changeset import GitChangeset
 from .inmemory import GitInMemoryChangeset
+from .revindex import get_revision_index
 from .workdir import GitWorkdir
 
 
@@ -50,6 +51,7 @@ class GitRepository(BaseRepository):
     """
     DEFAULT_BRANCH_NAME = 'master'
     scm = 'git'
+    METADATA_BATCH_SIZE = 1000
 
     def __init__(self, repo_path, create=False, src_url=None,
                  update_after_clone=False, bare=False):
@@ -89,10 +91,47 @@ class GitRepository(BaseRepository):
             return True
         return False
 
+    def get_state_token(self):
+        """
+        Returns stat info of HEAD, packed-refs and all loose refs. Refs are
+        always updated by renaming a new file in place, which changes the
+        mtime - the inode alone might be reused by the next update of the ref.
+        """
+        return self.path_state_token(safe_str(self._repo.controldir()))
+
+    @staticmethod
+    def path_state_token(controldir):
+        """
+        Returns the state token of the repository with the given control
+        directory, without opening it.
+        """
+        token = []
+        for name in ['HEAD', 'packed-refs']:
+            try:
+                st = os.stat(os.path.join(controldir, name))
+            except FileNotFoundError:
+                token.append(None)
+            else:
+                token.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        dirs = [os.path.join(controldir, 'refs')]
+        while dirs:
+            try:
+                it = os.scandir(dirs.pop())
+            except FileNotFoundError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        token.append((entry.path, st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(token)
+
     @LazyProperty
     def revisions(self):
         """
-        Returns list of revisions' ids, in ascending order.  Being lazy
+        Returns sequence of revisions' ids, in ascending order.  Being lazy
         attribute allows external tools to inject shas from cache.
         """
         return self._get_all_revisions()
@@ -234,22 +273,12 @@ class GitRepository(BaseRepository):
             raise RepositoryError(err)
 
     def _get_all_revisions(self):
-        # we must check if this repo is not empty, since later command
-        # fails if it is. And it's cheaper to ask than throw the subprocess
-        # errors
-        try:
-            self._repo.head()
-        except KeyError:
-            return []
-
-        rev_filter = settings.GIT_REV_FILTER
-        cmd = ['rev-list', rev_filter, '--reverse', '--date-order']
-        try:
-            so = self.run_git_command(cmd)
-        except RepositoryError:
-            # Can be raised for empty repositories
-            return []
-        return so.splitlines()
+        """
+        Returns a ``GitRevisionIndex`` with all revisions, brought up to date
+        with the current refs by extending the index persisted in the
+        repository.
+        """
+        return get_revision_index(self)
 
     def _get_all_revisions2(self):
         # alternate implementation using dulwich
@@ -552,6 +581,115 @@ class GitRepository(BaseRepository):
 
         return CollectionGenerator(self, revs)
 
+    def get_changelog(self, end=None, branch_name=None):
+        """
+        Returns ``ChangelogCollection`` of the changesets up to ``end`` (or
+        the tip), newest first, optionally only the ones reachable from
+        ``branch_name``. Without branch, the changelog is in revision number
+        order and slices are taken directly from ``revisions``. Otherwise,
+        each slice is retrieved with ``git log --skip --max-count``.
+        """
+        if branch_name and branch_name not in self.branches:
+            raise BranchDoesNotExistError("Branch '%s' not found"
+                                          % branch_name)
+        if self._empty:
+            raise EmptyRepositoryError("There are no changesets yet")
+        revisions = self.revisions
+
+        if not branch_name:
+            try:
+                end_pos = len(revisions) - 1 if end is None else revisions.index(self._get_revision(end))
+            except ValueError:
+                raise ChangesetDoesNotExistError("Revision %r does not exist for %s" % (end, self.name))
+
+            def get_window(offset, limit):
+                stop = max(end_pos + 1 - offset, 0)
+                return revisions[max(stop - limit, 0):stop][::-1]
+            return ChangelogCollection(self, get_window, lambda: end_pos + 1)
+
+        ref = self.branches[branch_name] if end is None else self._get_revision(end)
+
+        def get_window(offset, limit):
+            if limit <= 0:
+                return []
+            return self.run_git_command(['log', '--date-order', '--skip=%d' % offset, '--max-count=%d' % limit,
+                                         '--pretty=format:%H', ref, '--']).splitlines()
+
+        def get_count():
+            if ref not in self._changelog_counts:
+                self._changelog_counts[ref] = int(self.run_git_command(['rev-list', '--count', ref, '--']))
+            return self._changelog_counts[ref]
+        return ChangelogCollection(self, get_window, get_count)
+
+    def get_changesets_metadata(self, start=None, end=None):
+        """
+        Returns iterator of ``ChangesetMetadata`` tuples for the changesets
+        with revision numbers from ``start`` to ``end`` (exclusive). The data
+        is retrieved with one ``git log`` command per batch of changesets.
+        Like for ``GitChangeset``, merges list the files that differ from any
+        of their parents - Mercurial compares merges to their first parent.
+        """
+        positions = range(*slice(start, end).indices(len(self.revisions)))
+        for batch_start in range(0, len(positions), self.METADATA_BATCH_SIZE):
+            batch = positions[batch_start:batch_start + self.METADATA_BATCH_SIZE]
+            raw_ids = self.revisions[batch.start:batch.stop]
+            # -m: show merges as a diff against each parent, like GitChangeset
+            cmd = ['log', '--no-walk=unsorted', '--no-color', '--no-renames', '-m',
+                   '--name-status', '-z', '--format=%x01%H%x00%P%x00%an <%ae>%x00%ct%x00%B'] + raw_ids
+            stdout, _stderr = self._run_git_command(cmd, cwd=self.path)
+            records = iter(stdout.split(b'\x01')[1:])
+            record = next(records, None)
+            for revision in batch:
+                if record is None:
+                    raise RepositoryError('git log returned no changeset for revision %s' % revision)
+                fields = record.split(b'\0')
+                raw_id, parents, author, timestamp, message = fields[:5]
+                if ascii_str(raw_id) != self.revisions[revision]:
+                    raise RepositoryError('git log returned changeset %s for revision %s' % (ascii_str(raw_id), revision))
+                added, changed, removed = set(), set(), set()
+                while True:
+                    status_fields = fields[5:]
+                    for status, path in zip(status_fields[::2], status_fields[1::2]):
+                        status = status.strip()
+                        path = safe_str(path)
+                        if status == b'A':
+                            added.add(path)
+                        elif status == b'D':
+                            removed.add(path)
+                        else:
+                            changed.add(path)
+                    # merges have a record for each parent
+                    record = next(records, None)
+                    if record is None or not record.startswith(raw_id + b'\0'):
+                        break
+                    fields = record.split(b'\0')
+                yield ChangesetMetadata(revision, ascii_str(raw_id), safe_str(author),
+                                        date_fromtimestamp(int(timestamp)), safe_str(message),
+                                        [ascii_str(p) for p in parents.split()],
+                                        sorted(added), sorted(changed), sorted(removed))
+            if record is not None:
+                raise RepositoryError('git log returned more changesets than the %s revisions' % len(batch))
+
+    def get_changed_files(self, rev1, rev2):
+        """
+        Returns tuple with lists of paths of files added, changed and removed
+        between the changesets ``rev1`` and ``rev2``. Only trees that differ
+        are traversed.
+        """
+        tree1 = self._repo[ascii_bytes(self._get_revision(rev1))].tree
+        tree2 = self._repo[ascii_bytes(self._get_revision(rev2))].tree
+        added, changed, removed = [], [], []
+        for (oldpath, newpath), (oldmode, newmode), _shas in self._repo.object_store.tree_changes(tree1, tree2):
+            if S_ISGITLINK(oldmode or 0) or S_ISGITLINK(newmode or 0):
+                continue  # submodules are not files
+            if oldpath and newpath:
+                changed.append(safe_str(newpath))
+            elif newpath:
+                added.append(safe_str(newpath))
+            else:
+                removed.append(safe_str(oldpath))
+        return added, changed, removed
+
     def get_diff(self, rev1, rev2, path=None, ignore_whitespace=False,
                  context=3):
         """
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.revindex
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Persistent mapping between Git commit hashes and Kallithea revision
+    numbers.
+
+    Git has no notion of revision numbers, so ``GitRepository.revisions`` used
+    to be computed by running ``git rev-list`` and splitting the output every
+    time a repository object was created. The index is instead stored in a
+    single file in the Git control directory and extended incrementally when
+    refs change. Revision numbers of existing changesets are thus stable, like
+    in Mercurial - new changesets are appended at the end. The index is only
+    rebuilt from scratch if history has been rewritten.
+
+    The file is memory mapped and never materialized as a Python list.
+    Lookups by number are O(1) and lookups by hash are a binary search in a
+    sorted table.
+
+    File layout (all integers are big endian uint32)::
+
+        magic | count | ntips | state key (20) | tips (ntips * 20) |
+        revisions (count * 20) | sorted hash table (count * (20 + 4))
+"""
+
+import binascii
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from kallithea.lib.vcs.conf import settings
+from kallithea.lib.vcs.exceptions import RepositoryError
+from kallithea.lib.vcs.utils import ascii_str, safe_bytes, safe_str
+
+
+log = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'kallithea-revindex'
+
+_MAGIC = b'KRI1'
+_HEADER = struct.Struct('>4sII20s')
+_REV = struct.Struct('>I')
+_SHA_SIZE = 20
+_ENTRY_SIZE = _SHA_SIZE + _REV.size
+
+
+class GitRevisionIndex(object):
+    """
+    Read only sequence of revision hashes (as 40 char str) in revision number
+    order, backed by a buffer in the index file format.
+
+    Supports ``len``, indexing and slicing, iteration, ``in`` and ``index``
+    like the list it replaces. ``append`` is supported for changesets
+    created through this very repository instance; they are kept in memory
+    and will be picked up by the on-disk index next time it is loaded.
+    """
+
+    def __init__(self, buf):
+        self._buf = buf
+        magic, self._count, ntips, self.key = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC:
+            raise ValueError('Not a revision index')
+        self._tips_offset = _HEADER.size
+        self._revs_offset = self._tips_offset + ntips * _SHA_SIZE
+        self._table_offset = self._revs_offset + self._count * _SHA_SIZE
+        if len(buf) < self._table_offset + self._count * _ENTRY_SIZE:
+            raise ValueError('Truncated revision index')
+        self._ntips = ntips
+        self._appended = []
+
+    @classmethod
+    def from_raw(cls, key, tips, raw_revs):
+        """
+        Create index content from ``key``, the list of binary ``tips`` and
+        the concatenated binary revision hashes in ``raw_revs``.
+        """
+        count = len(raw_revs) // _SHA_SIZE
+        table = sorted(raw_revs[i * _SHA_SIZE:(i + 1) * _SHA_SIZE] + _REV.pack(i)
+                       for i in range(count))
+        buf = b''.join([_HEADER.pack(_MAGIC, count, len(tips), key)] + list(tips) + [raw_revs] + table)
+        return cls(buf)
+
+    @property
+    def tips(self):
+        """Binary hashes the index was computed from"""
+        return [self._buf[self._tips_offset + i * _SHA_SIZE:self._tips_offset + (i + 1) * _SHA_SIZE]
+                for i in range(self._ntips)]
+
+    @property
+    def raw_revisions(self):
+        """Concatenated binary hashes of the persisted revisions"""
+        return self._buf[self._revs_offset:self._table_offset]
+
+    def __len__(self):
+        return self._count + len(self._appended)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('revision index out of range')
+        return self._get(key)
+
+    def _get(self, i):
+        if i >= self._count:
+            return self._appended[i - self._count]
+        offset = self._revs_offset + i * _SHA_SIZE
+        return ascii_str(binascii.hexlify(self._buf[offset:offset + _SHA_SIZE]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self._get(i)
+
+    def __eq__(self, other):
+        if not isinstance(other, (GitRevisionIndex, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __contains__(self, sha):
+        try:
+            self.index(sha)
+        except ValueError:
+            return False
+        return True
+
+    def index(self, sha):
+        """
+        Return the revision number of the changeset with the full 40 char
+        hash ``sha`` - or raise ValueError.
+        """
+        if not isinstance(sha, str) or len(sha) != 40:
+            raise ValueError('%r is not in revisions' % (sha,))
+        try:
+            raw = binascii.unhexlify(sha)
+        except (binascii.Error, ValueError):
+            raise ValueError('%r is not in revisions' % (sha,))
+        buf = self._buf
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self._table_offset + mid * _ENTRY_SIZE
+            entry = buf[offset:offset + _SHA_SIZE]
+            if entry < raw:
+                lo = mid + 1
+            elif entry > raw:
+                hi = mid
+            else:
+                return _REV.unpack_from(buf, offset + _SHA_SIZE)[0]
+        try:
+            return self._count + self._appended.index(sha)
+        except ValueError:
+            raise ValueError('%r is not in revisions' % (sha,))
+
+    def append(self, sha):
+        self._appended.append(sha)
+
+
+def _get_state_key(repo):
+    """
+    Return a binary hash identifying the current state of all refs in the
+    dulwich ``repo`` and the revision filter they are interpreted with.
+    """
+    h = hashlib.sha1(safe_bytes(settings.GIT_REV_FILTER))
+    for ref, sha in sorted(repo.get_refs().items()):
+        h.update(b'\0%s\0%s' % (ref, sha))
+    return h.digest()
+
+
+def _read_index(path):
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):  # ValueError: empty file can't be mapped
+        return None
+    try:
+        return GitRevisionIndex(buf)
+    except (ValueError, struct.error):
+        log.warning('Ignoring invalid revision index %s', path)
+        return None
+
+
+def _write_index(path, index):
+    """
+    Atomically replace the index file at ``path``. Failure to write is not
+    fatal - the index will just be computed again next time.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=INDEX_FILENAME, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(index._buf)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except (IOError, OSError) as e:
+        log.warning('Failed writing revision index %s: %s', path, e)
+
+
+def _rev_list(repository, args):
+    """
+    Run ``git rev-list`` in ``repository`` and return the output as
+    concatenated binary hashes.
+    """
+    so = repository.run_git_command(['rev-list', '--reverse', '--date-order'] + args)
+    return binascii.unhexlify(''.join(so.split()))
+
+
+def get_revision_index(repository):
+    """
+    Return a ``GitRevisionIndex`` for the ``GitRepository`` ``repository``,
+    bringing the persisted index up to date with the current refs if
+    necessary.
+    """
+    repo = repository._repo
+    try:
+        repo.head()
+    except KeyError:
+        return GitRevisionIndex.from_raw(b'\0' * 20, [], b'')
+
+    key = _get_state_key(repo)
+    path = os.path.join(safe_str(repo.controldir()), INDEX_FILENAME)
+    old = _read_index(path)
+    if old is not None and old.key == key:
+        return old
+
+    rev_filter = settings.GIT_REV_FILTER.split()
+    try:
+        tips = binascii.unhexlify(''.join(repository.run_git_command(['rev-parse'] + rev_filter).split()))
+    except (RepositoryError, binascii.Error, ValueError):
+        # Can be raised for empty repositories
+        return GitRevisionIndex.from_raw(key, [], b'')
+    tips = [tips[i:i + _SHA_SIZE] for i in range(0, len(tips), _SHA_SIZE)]
+
+    raw_revs = None
+    if old is not None and len(old):
+        old_tips = [ascii_str(binascii.hexlify(t)) for t in old.tips]
+        try:
+            # commits that no longer are reachable means history was rewritten
+            lost = repository.run_git_command(['rev-list', '--count'] + old_tips +
+                                              ['--not'] + [ascii_str(binascii.hexlify(t)) for t in tips])
+            if int(lost) == 0:
+                raw_revs = old.raw_revisions + _rev_list(repository, rev_filter + ['--not'] + old_tips)
+            else:
+                log.debug('History of %s was rewritten - rebuilding revision index', repository.path)
+        except (RepositoryError, binascii.Error, ValueError) as e:
+            log.debug('Cannot extend revision index of %s: %s', repository.path, e)
+
+    if raw_revs is None:
+        try:
+            raw_revs = _rev_list(repository, rev_filter)
+        except (RepositoryError, binascii.Error, ValueError):
+            # Can be raised for empty repositories
+            return GitRevisionIndex.from_raw(key, [], b'')
+
+    index = GitRevisionIndex.from_raw(key, tips, raw_revs)
+    _write_index(path, index)
+    return index
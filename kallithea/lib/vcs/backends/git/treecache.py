@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.treecache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Per process cache of parsed Git tree objects.
+
+    Looking up a path in a changeset reads and parses one tree object per
+    path component. Browsing a repository reads the same trees over and over,
+    both within a request and across requests, and every changeset object
+    used to read them again. Git objects are immutable and identified by
+    their hash, so parsed trees can be shared by all changesets - also across
+    repositories and threads, as long as they are never modified.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from dulwich import objects
+
+from kallithea.lib.vcs.conf import settings
+
+
+log = logging.getLogger(__name__)
+
+
+class TreeCache(object):
+    """
+    LRU of dulwich ``Tree`` objects keyed by tree hash. The size is
+    ``settings.GIT_TREE_CACHE_SIZE`` trees; 0 disables caching.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, repo, sha):
+        """
+        Return the object ``sha`` from the dulwich ``repo`` - from the cache
+        if it is a tree that has been read before. The returned trees are
+        shared and must not be modified.
+        """
+        with self._lock:
+            tree = self._entries.get(sha)
+            if tree is not None:
+                self._entries.move_to_end(sha)
+                return tree
+
+        obj = repo[sha]
+        size = settings.GIT_TREE_CACHE_SIZE
+        if size > 0 and isinstance(obj, objects.Tree):
+            with self._lock:
+                self._entries[sha] = obj
+                while len(self._entries) > size:
+                    self._entries.popitem(last=False)
+        return obj
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tree_cache = TreeCache()
@@ -1,3 +1,4 @@
+import itertools
 import os
 import posixpath
 
@@ -5,7 +6,7 @@ import mercurial.archival
 import mercurial.node
 import mercurial.obsutil
 
-from kallithea.lib.vcs.backends.base import BaseChangeset
+from kallithea.lib.vcs.backends.base import BaseChangeset, FileHistoryEntry
 from kallithea.lib.vcs.conf import settings
 from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError, ChangesetError, ImproperArchiveTypeError, NodeDoesNotExistError, VCSError
 from kallithea.lib.vcs.nodes import (AddedFileNodesGenerator, ChangedFileNodesGenerator, DirNode, FileNode, NodeKind, RemovedFileNodesGenerator, RootNode,
@@ -238,27 +239,19 @@ class MercurialChangeset(BaseChangeset):
         fctx = self._get_filectx(path)
         return fctx.size()
 
-    def get_file_changeset(self, path):
+    def iter_file_history(self, path, offset=0, limit=None):
         """
-        Returns last commit of the file at the given ``path``.
-        """
-        return self.get_file_history(path, limit=1)[0]
-
-    def get_file_history(self, path, limit=None):
-        """
-        Returns history of file as reversed list of ``Changeset`` objects for
-        which file at given ``path`` has been modified.
+        Returns iterator of ``FileHistoryEntry`` tuples for the changesets
+        in which the file at given ``path`` has been modified, newest first,
+        by walking the filelog backwards.
         """
         fctx = self._get_filectx(path)
-        hist = []
-        cnt = 0
-        for cs in reversed([x for x in fctx.filelog()]):
-            cnt += 1
-            hist.append(mercurial.node.hex(fctx.filectx(cs).node()))
-            if limit is not None and cnt == limit:
-                break
-
-        return [self.repository.get_changeset(node) for node in hist]
+        filelog = fctx.filelog()
+        end = None if limit is None else offset + limit
+        for filerev in itertools.islice(reversed(range(len(filelog))), offset, end):
+            ctx = fctx.filectx(filerev).changectx()
+            yield FileHistoryEntry(ctx.rev(), ascii_str(ctx.hex()), safe_str(ctx.user()),
+                                   date_fromtimestamp(ctx.date()[0]), safe_str(ctx.description()))
 
     def get_file_annotate(self, path):
         """
@@ -29,6 +29,7 @@ import mercurial.match
 import mercurial.mdiff
 import mercurial.node
 import mercurial.patch
+import mercurial.revsetlang
 import mercurial.scmutil
 import mercurial.sshpeer
 import mercurial.tags
@@ -36,10 +37,10 @@ import mercurial.ui
 import mercurial.url
 import mercurial.util
 
-from kallithea.lib.vcs.backends.base import BaseRepository, CollectionGenerator
+from kallithea.lib.vcs.backends.base import BaseRepository, ChangelogCollection, ChangesetMetadata, CollectionGenerator
 from kallithea.lib.vcs.exceptions import (BranchDoesNotExistError, ChangesetDoesNotExistError, EmptyRepositoryError, RepositoryError, TagAlreadyExistError,
                                           TagDoesNotExistError, VCSError)
-from kallithea.lib.vcs.utils import ascii_str, author_email, author_name, date_fromtimestamp, makedate, safe_bytes, safe_str
+from kallithea.lib.vcs.utils import ascii_bytes, ascii_str, author_email, author_name, date_fromtimestamp, makedate, safe_bytes, safe_str
 from kallithea.lib.vcs.utils.lazy import LazyProperty
 from kallithea.lib.vcs.utils.paths import abspath
 
@@ -91,6 +92,38 @@ class MercurialRepository(BaseRepository):
         # return len(self._repo.changelog) == 0
         return len(self.revisions) == 0
 
+    def get_state_token(self):
+        """
+        Returns stat info of the changelog and the other files that determine
+        which changesets are visible and what bookmarks they have.
+        """
+        return self.path_state_token(safe_str(self._repo.root))
+
+    @staticmethod
+    def path_state_token(repo_path):
+        """
+        Returns the state token of the repository at ``repo_path``, without
+        opening it.
+        """
+        hg_path = os.path.join(repo_path, '.hg')
+        store_path = os.path.join(hg_path, 'store')
+        if not os.path.isdir(store_path):
+            store_path = hg_path
+        token = []
+        for path in [os.path.join(store_path, '00changelog.i'),
+                     os.path.join(store_path, '00changelog.d'),
+                     os.path.join(store_path, 'phaseroots'),
+                     os.path.join(store_path, 'obsstore'),
+                     os.path.join(hg_path, 'bookmarks'),
+                     os.path.join(hg_path, 'localtags')]:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                token.append(None)
+            else:
+                token.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(token)
+
     @LazyProperty
     def revisions(self):
         """
@@ -553,6 +586,91 @@ class MercurialRepository(BaseRepository):
 
         return CollectionGenerator(self, revs)
 
+    def get_changelog(self, end=None, branch_name=None):
+        """
+        Returns ``ChangelogCollection`` of the changesets up to ``end`` (or
+        the tip), newest first, optionally only on the named branch
+        ``branch_name``. Changesets are retrieved by position in
+        ``revisions`` or with a ``limit`` revset for each slice.
+        """
+        if self._empty:
+            raise EmptyRepositoryError("There are no changesets yet")
+        if branch_name and branch_name not in self.allbranches:
+            msg = "Branch %r not found in %s" % (branch_name, self.name)
+            raise BranchDoesNotExistError(msg)
+        end_raw_id = self._get_revision(end)
+        revisions = self.revisions
+
+        if not branch_name:
+            end_pos = len(revisions) - 1 if end is None else revisions.index(end_raw_id)
+
+            def get_window(offset, limit):
+                stop = max(end_pos + 1 - offset, 0)
+                return revisions[max(stop - limit, 0):stop][::-1]
+            return ChangelogCollection(self, get_window, lambda: end_pos + 1)
+
+        revspec = mercurial.revsetlang.formatspec(b'reverse(branch(%s) and 0:%d)',
+                                                  safe_bytes(branch_name), self._repo[ascii_bytes(end_raw_id)].rev())
+
+        def get_window(offset, limit):
+            revs = mercurial.scmutil.revrange(self._repo, [b'limit(%s, %d, %d)' % (revspec, limit, offset)])
+            return [ascii_str(self._repo[rev].hex()) for rev in revs]
+
+        def get_count():
+            key = (end_raw_id, branch_name)
+            if key not in self._changelog_counts:
+                self._changelog_counts[key] = len(mercurial.scmutil.revrange(self._repo, [revspec]))
+            return self._changelog_counts[key]
+        return ChangelogCollection(self, get_window, get_count)
+
+    def get_changesets_metadata(self, start=None, end=None):
+        """
+        Returns iterator of ``ChangesetMetadata`` tuples for the changesets
+        with revision numbers from ``start`` to ``end`` (exclusive). File
+        changes are found from the list of files touched by each changeset
+        and lookups in its manifest and the manifest of its first parent.
+        Merges are compared to their first parent, like in ``status``.
+        """
+        prev_node = prev_manifest = None
+        for revision in range(*slice(start, end).indices(len(self.revisions))):
+            ctx = self._repo[ascii_bytes(self.revisions[revision])]
+            p1 = ctx.p1()
+            manifest = ctx.manifest()
+            if ctx.p2().rev() >= 0:
+                # files() of merges are not the changes relative to p1
+                status = self._repo.status(p1.node(), ctx.node())
+                added = [safe_str(f) for f in status.added]
+                changed = [safe_str(f) for f in status.modified]
+                removed = [safe_str(f) for f in status.removed]
+            else:
+                # usually the previous changeset is the parent - reuse its manifest
+                p1_manifest = prev_manifest if p1.node() == prev_node else p1.manifest()
+                added, changed, removed = [], [], []
+                for f in ctx.files():
+                    if f in manifest:
+                        if f in p1_manifest:
+                            changed.append(safe_str(f))
+                        else:
+                            added.append(safe_str(f))
+                    elif f in p1_manifest:
+                        removed.append(safe_str(f))
+            yield ChangesetMetadata(revision, ascii_str(ctx.hex()), safe_str(ctx.user()),
+                                    date_fromtimestamp(ctx.date()[0]), safe_str(ctx.description()),
+                                    [ascii_str(p.hex()) for p in ctx.parents() if p.rev() >= 0],
+                                    added, changed, removed)
+            prev_node, prev_manifest = ctx.node(), manifest
+
+    def get_changed_files(self, rev1, rev2):
+        """
+        Returns tuple with lists of paths of files added, changed and removed
+        between the changesets ``rev1`` and ``rev2``.
+        """
+        status = self._repo.status(ascii_bytes(self._get_revision(rev1)),
+                                   ascii_bytes(self._get_revision(rev2)))
+        return ([safe_str(f) for f in status.added],
+                [safe_str(f) for f in status.modified],
+                [safe_str(f) for f in status.removed])
+
     def pull(self, url):
         """
         Tries to pull changes from external location.
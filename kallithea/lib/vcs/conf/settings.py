@@ -9,6 +9,12 @@ GIT_EXECUTABLE_PATH = 'git'
 # can be also --branches --tags
 GIT_REV_FILTER = '--all'
 
+# number of repository instances each thread keeps open across requests
+REPO_INSTANCE_CACHE_SIZE = 20
+
+# number of parsed Git tree objects each process keeps for path lookups
+GIT_TREE_CACHE_SIZE = 2000
+
 BACKENDS = {
     'hg': 'kallithea.lib.vcs.backends.hg.MercurialRepository',
     'git': 'kallithea.lib.vcs.backends.git.GitRepository',
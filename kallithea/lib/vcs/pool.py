@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.pool
+    ~~~~~~~~
+
+    Per process cache of repository backend instances.
+
+    Opening a repository and parsing its refs, branches and tags is a
+    significant part of the cost of serving a page. The pool keeps recently
+    used instances around across requests and reuses them as long as the
+    ``get_state_token`` of the backend is unchanged - that is cheap to compute
+    and changes whenever the on disk repository changes.
+
+    Backend instances are not thread safe, so each thread has its own LRU of
+    instances. Explicit invalidation of a path applies to all threads.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from kallithea.lib.vcs.conf import settings
+
+
+log = logging.getLogger(__name__)
+
+
+class RepositoryPool(object):
+    """
+    LRU of repository instances keyed by repository path. The size is
+    ``settings.REPO_INSTANCE_CACHE_SIZE`` instances per thread; 0 disables
+    caching.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._generations = {}
+
+    def _entries(self):
+        entries = getattr(self._local, 'entries', None)
+        if entries is None:
+            entries = self._local.entries = OrderedDict()
+        return entries
+
+    def _generation(self, path):
+        return self._epoch, self._generations.get(path, 0)
+
+    def get(self, path, factory):
+        """
+        Return a cached, still valid repository instance for ``path`` - or
+        create one by calling ``factory`` and cache it.
+        """
+        size = settings.REPO_INSTANCE_CACHE_SIZE
+        if size <= 0:
+            return factory()
+
+        entries = self._entries()
+        generation = self._generation(path)
+        entry = entries.pop(path, None)
+        if entry is not None:
+            repo, token, entry_generation = entry
+            if entry_generation == generation:
+                try:
+                    if repo.get_state_token() == token:
+                        entries[path] = entry
+                        return repo
+                except (IOError, OSError):
+                    pass
+            log.debug('Discarding stale cached instance of %s', path)
+
+        repo = factory()
+        # The token is computed after creating the instance but before it has
+        # read any refs or history - a concurrent change will thus at worst
+        # make the instance newer than the token and cause a reload next time.
+        try:
+            entries[path] = (repo, repo.get_state_token(), generation)
+        except (IOError, OSError):
+            return repo
+        while len(entries) > size:
+            entries.popitem(last=False)
+        return repo
+
+    def invalidate(self, path=None):
+        """
+        Make all cached instances of ``path`` - or of all repositories - invalid
+        in all threads.
+        """
+        with self._lock:
+            if path is None:
+                self._epoch += 1
+                self._generations.clear()
+            else:
+                self._generations[path] = self._generations.get(path, 0) + 1
+
+
+repository_pool = RepositoryPool()
@@ -23,244 +23,12 @@ along with git_http_backend.py Project.
 If not, see <http://www.gnu.org/licenses/>.
 """
 import collections
+import io
 import os
+import selectors
 import subprocess
 import threading
-
-
-class StreamFeeder(threading.Thread):
-    """
-    Normal writing into pipe-like is blocking once the buffer is filled.
-    This thread allows a thread to seep data from a file-like into a pipe
-    without blocking the main thread.
-    We close inpipe once the end of the source stream is reached.
-    """
-
-    def __init__(self, source):
-        super(StreamFeeder, self).__init__()
-        self.daemon = True
-        filelike = False
-        self.bytes = bytes()
-        if type(source) in (type(''), bytes, bytearray):  # string-like
-            self.bytes = bytes(source)
-        else:  # can be either file pointer or file-like
-            if isinstance(source, int):  # file pointer it is
-                # converting file descriptor (int) stdin into file-like
-                source = os.fdopen(source, 'rb', 16384)
-            # let's see if source is file-like by now
-            filelike = hasattr(source, 'read')
-        if not filelike and not self.bytes:
-            raise TypeError("StreamFeeder's source object must be a readable "
-                            "file-like, a file descriptor, or a string-like.")
-        self.source = source
-        self.readiface, self.writeiface = os.pipe()
-
-    def run(self):
-        t = self.writeiface
-        if self.bytes:
-            os.write(t, self.bytes)
-        else:
-            s = self.source
-            b = s.read(4096)
-            while b:
-                os.write(t, b)
-                b = s.read(4096)
-        os.close(t)
-
-    @property
-    def output(self):
-        return self.readiface
-
-
-class InputStreamChunker(threading.Thread):
-    def __init__(self, source, target, buffer_size, chunk_size):
-
-        super(InputStreamChunker, self).__init__()
-
-        self.daemon = True  # die die die.
-
-        self.source = source
-        self.target = target
-        self.chunk_count_max = int(buffer_size / chunk_size) + 1
-        self.chunk_size = chunk_size
-
-        self.data_added = threading.Event()
-        self.data_added.clear()
-
-        self.keep_reading = threading.Event()
-        self.keep_reading.set()
-
-        self.EOF = threading.Event()
-        self.EOF.clear()
-
-        self.go = threading.Event()
-        self.go.set()
-
-    def stop(self):
-        self.go.clear()
-        self.EOF.set()
-        try:
-            # this is not proper, but is done to force the reader thread let
-            # go of the input because, if successful, .close() will send EOF
-            # down the pipe.
-            self.source.close()
-        except:
-            pass
-
-    def run(self):
-        s = self.source
-        t = self.target
-        cs = self.chunk_size
-        ccm = self.chunk_count_max
-        kr = self.keep_reading
-        da = self.data_added
-        go = self.go
-
-        try:
-            b = s.read(cs)
-        except ValueError:
-            b = ''
-
-        while b and go.is_set():
-            if len(t) > ccm:
-                kr.clear()
-                kr.wait(2)
-                if not kr.wait(10):
-                    raise IOError(
-                        "Timed out while waiting for input from subprocess.")
-            t.append(b)
-            da.set()
-            try:
-                b = s.read(cs)
-            except ValueError: # probably "I/O operation on closed file"
-                b = ''
-
-        self.EOF.set()
-        da.set()  # for cases when done but there was no input.
-
-
-class BufferedGenerator(object):
-    """
-    Class behaves as a non-blocking, buffered pipe reader.
-    Reads chunks of data (through a thread)
-    from a blocking pipe, and attaches these to an array (Deque) of chunks.
-    Reading is halted in the thread when max chunks is internally buffered.
-    The .next() may operate in blocking or non-blocking fashion by yielding
-    '' if no data is ready
-    to be sent or by not returning until there is some data to send
-    When we get EOF from underlying source pipe we raise the marker to raise
-    StopIteration after the last chunk of data is yielded.
-    """
-
-    def __init__(self, source, buffer_size=65536, chunk_size=4096,
-                 starting_values=None, bottomless=False):
-        starting_values = starting_values or []
-        if bottomless:
-            maxlen = int(buffer_size / chunk_size)
-        else:
-            maxlen = None
-
-        self.data = collections.deque(starting_values, maxlen)
-        self.worker = InputStreamChunker(source, self.data, buffer_size,
-                                         chunk_size)
-        if starting_values:
-            self.worker.data_added.set()
-        self.worker.start()
-
-    ####################
-    # Generator's methods
-    ####################
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        while not len(self.data) and not self.worker.EOF.is_set():
-            self.worker.data_added.clear()
-            self.worker.data_added.wait(0.2)
-        if len(self.data):
-            self.worker.keep_reading.set()
-            return bytes(self.data.popleft())
-        elif self.worker.EOF.is_set():
-            raise StopIteration
-
-    def throw(self, type, value=None, traceback=None):
-        if not self.worker.EOF.is_set():
-            raise type(value)
-
-    def start(self):
-        self.worker.start()
-
-    def stop(self):
-        self.worker.stop()
-
-    def close(self):
-        try:
-            self.worker.stop()
-            self.throw(GeneratorExit)
-        except (GeneratorExit, StopIteration):
-            pass
-
-    ####################
-    # Threaded reader's infrastructure.
-    ####################
-    @property
-    def input(self):
-        return self.worker.w
-
-    @property
-    def data_added_event(self):
-        return self.worker.data_added
-
-    @property
-    def data_added(self):
-        return self.worker.data_added.is_set()
-
-    @property
-    def reading_paused(self):
-        return not self.worker.keep_reading.is_set()
-
-    @property
-    def done_reading(self):
-        """
-        Done_reading does not mean that the iterator's buffer is empty.
-        Iterator might have done reading from underlying source, but the read
-        chunks might still be available for serving through .next() method.
-
-        :returns: An Bool value.
-        """
-        return self.worker.EOF.is_set()
-
-    @property
-    def length(self):
-        """
-        returns int.
-
-        This is the length of the queue of chunks, not the length of
-        the combined contents in those chunks.
-
-        __len__() cannot be meaningfully implemented because this
-        reader is just flying through a bottomless pit content and
-        can only know the length of what it already saw.
-
-        If __len__() on WSGI server per PEP 3333 returns a value,
-        the response's length will be set to that. In order not to
-        confuse WSGI PEP3333 servers, we will not implement __len__
-        at all.
-        """
-        return len(self.data)
-
-    def prepend(self, x):
-        self.data.appendleft(x)
-
-    def append(self, x):
-        self.data.append(x)
-
-    def extend(self, o):
-        self.data.extend(o)
-
-    def __getitem__(self, i):
-        return self.data[i]
+import time
 
 
 class SubprocessIOChunker(object):
@@ -269,15 +37,16 @@ class SubprocessIOChunker(object):
 
     In a way, this is a "communicate()" replacement with a twist.
 
-    - We are multithreaded. Writing in and reading out, err are all sep threads.
-    - We support concurrent (in and out) stream processing.
-    - The output is not a stream. It's a queue of read string (bytes, not str)
-      chunks. The object behaves as an iterable. You can "for chunk in obj:" us.
-    - We are non-blocking in more respects than communicate()
-      (reading from subprocess out pauses when internal buffer is full, but
-       does not block the parent calling code. On the flip side, reading from
-       slow-yielding subprocess may block the iteration until data shows up. This
-       does not block the parallel inpipe reading occurring parallel thread.)
+    - The output pipes are pumped by one selector loop in the thread
+      iterating the output. Input is fed to the process by a helper thread,
+      so waiting for input never stops the output from being read.
+    - We support concurrent (in and out) stream processing: input is fed to
+      the process while waiting for output, and output is read while feeding
+      input.
+    - The output is not a stream. The object behaves as an iterable of bytes
+      chunks. You can "for chunk in obj:" us.
+    - Input is read into a reusable buffer when the file-like supports
+      ``readinto``, and written to the process from a memoryview.
 
     The purpose of the object is to allow us to wrap subprocess interactions into
     an iterable that can be passed to a WSGI server as the application's return
@@ -286,7 +55,8 @@ class SubprocessIOChunker(object):
     HTTP response. Instead, the class initializer reads just a bit of the stream
     to figure out if error occurred or likely to occur and if not, just hands the
     further iteration over subprocess output to the server for completion of HTTP
-    response.
+    response. Pipes are only pumped when the next chunk is requested, so a slow
+    client will make the subprocess wait instead of output being buffered.
 
     The real or perceived subprocess error is trapped and raised as one of
     EnvironmentError family of exceptions
@@ -297,7 +67,7 @@ class SubprocessIOChunker(object):
     #            cmd,
     #            input,
     #            buffer_size = 65536,
-    #            chunk_size = 4096
+    #            chunk_size = 65536
     #            )
     #    except (EnvironmentError) as e:
     #        print str(e)
@@ -308,102 +78,182 @@ class SubprocessIOChunker(object):
 
     """
 
+    # Only the last bytes of error output are kept
+    error_size = 16000
+
     def __init__(self, cmd, inputstream=None, buffer_size=65536,
-                 chunk_size=4096, starting_values=None, **kwargs):
+                 chunk_size=65536, starting_values=None, **kwargs):
         """
         Initializes SubprocessIOChunker
 
-        :param cmd: A Subprocess.Popen style "cmd". Can be string or array of strings
+        :param cmd: A Subprocess.Popen style "cmd". Must be an array of strings
         :param inputstream: (Default: None) A file-like, string, or file pointer.
-        :param buffer_size: (Default: 65536) A size of total buffer per stream in bytes.
-        :param chunk_size: (Default: 4096) A max size of a chunk. Actual chunk may be smaller.
+        :param buffer_size: (Default: 65536) Bytes of output to read before returning from the initializer.
+        :param chunk_size: (Default: 65536) A max size of a chunk. Actual chunk may be smaller.
         :param starting_values: (Default: []) An array of strings to put in front of output que.
         """
-        starting_values = starting_values or []
-        if inputstream:
-            input_streamer = StreamFeeder(inputstream)
-            input_streamer.start()
-            inputstream = input_streamer.output
+        if isinstance(inputstream, (bytes, bytearray)):
+            inputstream = io.BytesIO(inputstream)
+        elif isinstance(inputstream, int):
+            inputstream = os.fdopen(inputstream, 'rb')
 
         # Note: fragile cmd mangling has been removed for use in Kallithea
         assert isinstance(cmd, list), cmd
 
-        _p = subprocess.Popen(cmd, bufsize=-1,
-                              stdin=inputstream,
+        self.process = subprocess.Popen(cmd, bufsize=0,
+                              stdin=subprocess.DEVNULL if inputstream is None else subprocess.PIPE,
                               stdout=subprocess.PIPE,
                               stderr=subprocess.PIPE,
                               **kwargs)
-
-        bg_out = BufferedGenerator(_p.stdout, buffer_size, chunk_size,
-                                   starting_values)
-        bg_err = BufferedGenerator(_p.stderr, 16000, 1, bottomless=True)
-
-        while not bg_out.done_reading and not bg_out.reading_paused:
+        self.chunk_size = chunk_size
+        self._out = collections.deque(starting_values or [])
+        self._out_size = 0
+        self._err = collections.deque()
+        self._err_size = 0
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.process.stdout, selectors.EVENT_READ, self._read_stdout)
+        self._selector.register(self.process.stderr, selectors.EVENT_READ, self._read_stderr)
+        if inputstream is not None:
+            threading.Thread(target=self._feed_stdin, args=(inputstream, self.process.stdin),
+                             name='subprocessio-stdin', daemon=True).start()
+
+        while self._out_size < buffer_size and self.process.stdout in self._pipes():
             # doing this until we reach either end of file, or end of buffer.
-            bg_out.data_added_event.wait(1)
-            bg_out.data_added_event.clear()
+            self._pump()
 
         # at this point it's still ambiguous if we are done reading or just full buffer.
         # Either way, if error (returned by ended process, or implied based on
         # presence of stuff in stderr output) we error out.
         # Else, we are happy.
-        returncode = _p.poll()
+        if self.process.stdout in self._pipes():
+            returncode = self.process.poll()
+        else:
+            # all output has been read - the process has terminated or will soon
+            while self._pipes():
+                self._pump()
+            returncode = self.process.wait()
         if (returncode is not None # process has terminated
             and returncode != 0
         ): # and it failed
-            bg_out.stop()
-            out = b''.join(bg_out)
-            bg_err.stop()
-            err = b''.join(bg_err)
+            while self._pipes():
+                self._pump()
+            out = b''.join(self._out)
+            err = b''.join(self._err)
+            self.close()
             if (err.strip() == b'fatal: The remote end hung up unexpectedly' and
                 out.startswith(b'0034shallow ')
             ):
                 # hack inspired by https://github.com/schacon/grack/pull/7
-                bg_out = iter([out])
-                _p = None
+                self._out = collections.deque([out])
+                self.process = None
             elif err:
                 raise EnvironmentError("Subprocess exited due to an error: %s" % err)
             else:
                 raise EnvironmentError(
                     "Subprocess exited with non 0 ret code: %s" % returncode)
-        self.process = _p
-        self.output = bg_out
-        self.error = bg_err
-        self.inputstream = inputstream
+
+    def _pipes(self):
+        """Return the pipes that still are open."""
+        if self._selector is None:
+            return []
+        return [key.fileobj for key in self._selector.get_map().values()]
+
+    def _pump(self):
+        """Wait until a pipe is ready and transfer one chunk of data."""
+        for key, events in self._selector.select():
+            key.data()
+
+    def _close_pipe(self, pipe):
+        self._selector.unregister(pipe)
+        pipe.close()
+
+    def _read_stdout(self):
+        data = os.read(self.process.stdout.fileno(), self.chunk_size)
+        if data:
+            self._out.append(data)
+            self._out_size += len(data)
+        else:
+            self._close_pipe(self.process.stdout)
+
+    def _read_stderr(self):
+        data = os.read(self.process.stderr.fileno(), self.chunk_size)
+        if data:
+            self._err.append(data)
+            self._err_size += len(data)
+            while self._err_size - len(self._err[0]) >= self.error_size:
+                self._err_size -= len(self._err.popleft())
+            if self._err_size > self.error_size:
+                self._err[0] = self._err[0][self._err_size - self.error_size:]
+                self._err_size = self.error_size
+        else:
+            self._close_pipe(self.process.stderr)
+
+    def _feed_stdin(self, inputstream, stdin):
+        """Write everything from ``inputstream`` to ``stdin`` and close it."""
+        buf = memoryview(bytearray(self.chunk_size))
+        readinto = getattr(inputstream, 'readinto', None)
+        try:
+            while True:
+                if readinto is not None:
+                    size = readinto(buf)
+                    data = None if size is None else buf[:size]
+                else:
+                    data = inputstream.read(self.chunk_size)
+                if data is None: # non-blocking input without data yet
+                    time.sleep(0.01)
+                    continue
+                if not data:
+                    break
+                while data:
+                    data = data[stdin.write(data):]
+        except (OSError, ValueError): # the process doesn't want more input or has been closed
+            pass
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    @property
+    def output(self):
+        """Iterator over the chunks of output, without checking for errors."""
+        while True:
+            while not self._out and self.process is not None and self.process.stdout in self._pipes():
+                self._pump()
+            if not self._out:
+                return
+            self._out_size -= len(self._out[0])
+            yield self._out.popleft()
+
+    @property
+    def error(self):
+        """Iterator over the chunks of error output, after reading all output."""
+        while self._pipes():
+            self._pump()
+        return iter(self._err)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.process:
-            returncode = self.process.poll()
-            if (returncode is not None # process has terminated
-                and returncode != 0
-            ): # and it failed
-                self.output.stop()
-                self.error.stop()
-                err = ''.join(self.error)
-                raise EnvironmentError("Subprocess exited due to an error:\n" + err)
-        return next(self.output)
-
-    def throw(self, type, value=None, traceback=None):
-        if self.output.length or not self.output.done_reading:
-            raise type(value)
+        for chunk in self.output:
+            return chunk
+        if self.process is not None:
+            # end of output - let the process finish and report errors
+            while self._pipes():
+                self._pump()
+            returncode = self.process.wait()
+            if returncode != 0:
+                err = b''.join(self._err)
+                raise EnvironmentError("Subprocess exited due to an error:\n%s" % err)
+        raise StopIteration
 
     def close(self):
-        try:
+        if self._selector is not None:
+            for pipe in self._pipes():
+                self._close_pipe(pipe)
+            self._selector.close()
+            self._selector = None
+        if self.process is not None and self.process.poll() is None:
             self.process.terminate()
-        except:
-            pass
-        try:
-            self.output.close()
-        except:
-            pass
-        try:
-            self.error.close()
-        except:
-            pass
-        try:
-            os.close(self.inputstream)
-        except:
-            pass
+            self.process.wait()
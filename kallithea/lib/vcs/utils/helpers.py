@@ -95,6 +95,34 @@ def get_scms_for_path(path):
     return result
 
 
+def get_repo_size(path, scm_dir):
+    """
+    Returns the size in bytes of the files in the repository at ``path``, as
+    a tuple of the size of its ``scm_dir`` (like '.hg') and of the working
+    directory. Everything is in ``scm_dir`` for bare repositories.
+    """
+    scm_path = os.path.join(path, scm_dir)
+    bare = not os.path.isdir(scm_path)
+    sizes = [0, 0] # working directory, scm
+    stack = [(path, bare)]
+    while stack:
+        dirpath, in_scm = stack.pop()
+        try:
+            it = os.scandir(dirpath)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, in_scm or entry.path == scm_path))
+                    elif entry.is_file(follow_symlinks=False):
+                        sizes[in_scm] += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass # removed while scanning
+    return sizes[1], sizes[0]
+
+
 def get_highlighted_code(name, code, type='terminal'):
     """
     If pygments are available on the system
@@ -30,16 +30,18 @@ import collections
 import datetime
 import functools
 import hashlib
+import itertools
 import logging
 import os
 import time
 import traceback
+import uuid
 
 import ipaddr
 import sqlalchemy
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Unicode, UnicodeText, UniqueConstraint
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Unicode, UnicodeText, UniqueConstraint
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import class_mapper, joinedload, relationship, validates
+from sqlalchemy.orm import attributes, class_mapper, joinedload, relationship, validates
 from tg.i18n import lazy_ugettext as _
 from webob.exc import HTTPNotFound
 
@@ -50,7 +52,8 @@ from kallithea.lib.utils2 import (Optional, ascii_bytes, aslist, get_changeset_s
                                   urlreadable)
 from kallithea.lib.vcs import get_backend
 from kallithea.lib.vcs.backends.base import EmptyChangeset
-from kallithea.lib.vcs.utils.helpers import get_scm
+from kallithea.lib.vcs.pool import repository_pool
+from kallithea.lib.vcs.utils.helpers import get_repo_size, get_scm
 from kallithea.model.meta import Base, Session
 
 
@@ -189,6 +192,7 @@ class Setting(Base, BaseDbModel):
         'list': functools.partial(aslist, sep=',')
     }
     DEFAULT_UPDATE_URL = ''
+    PERMISSIONS_GENERATION = 'permissions_generation'
 
     app_settings_id = Column(Integer(), primary_key=True)
     app_settings_name = Column(String(255), nullable=False, unique=True)
@@ -310,6 +314,18 @@ class Setting(Base, BaseDbModel):
 
         return fd
 
+    @classmethod
+    def get_permissions_generation(cls):
+        """
+        Returns a token identifying the current state of all permissions, or
+        None if it never has been set. The token is replaced with a new random
+        value whenever anything that permissions are computed from is changed.
+        """
+        res = cls.get_by_name(cls.PERMISSIONS_GENERATION)
+        if res is None:
+            return None
+        return res.app_settings_value
+
     @classmethod
     def get_server_info(cls):
         import pkg_resources
@@ -942,6 +958,8 @@ class Repository(Base, BaseDbModel):
     updated_on = Column(DateTime(timezone=False), nullable=False, default=datetime.datetime.now)
     _landing_revision = Column("landing_revision", String(255), nullable=False)
     _changeset_cache = Column("changeset_cache", LargeBinary(), nullable=True) # JSON data # FIXME: not nullable?
+    repo_size = Column(BigInteger(), nullable=True) # bytes on disk when last scanned
+    repo_size_updated_on = Column(DateTime(timezone=False), nullable=True) # None when never scanned
 
     fork_id = Column(Integer(), ForeignKey('repositories.repo_id'), nullable=True)
     group_id = Column(Integer(), ForeignKey('groups.group_id'), nullable=True)
@@ -1153,6 +1171,8 @@ class Repository(Base, BaseDbModel):
             enable_statistics=repo.enable_statistics,
             enable_downloads=repo.enable_downloads,
             last_changeset=repo.changeset_cache,
+            repo_size=repo.repo_size,
+            repo_size_updated_on=repo.repo_size_updated_on,
         )
         if with_revision_names:
             scm_repo = repo.scm_instance_no_cache()
@@ -1314,10 +1334,48 @@ class Repository(Base, BaseDbModel):
                                       stat.author]
         return grouped
 
-    def _repo_size(self):
-        from kallithea.lib import helpers as h
-        log.debug('calculating repository size...')
-        return h.format_byte_size(self.scm_instance.size)
+    def update_repo_size(self):
+        """
+        Scan the repository on disk and store its size.
+        """
+        log.debug('calculating size of repository %s', self.repo_name)
+        size_scm, size_root = get_repo_size(self.repo_full_path, '.' + self.repo_type)
+        self.set_repo_size(size_scm + size_root)
+        return self.repo_size
+
+    def set_repo_size(self, size):
+        self.repo_size = size
+        self.repo_size_updated_on = datetime.datetime.now()
+
+    def add_repo_size(self, size, pushed_on):
+        """
+        Add the ``size`` of data pushed at ``pushed_on`` to the stored size -
+        unless the repository has been scanned since then. The size on disk
+        is only approximately the pushed size, so the time of the last scan is
+        kept and the size is still rescanned when it gets too old.
+        """
+        Session().query(Repository) \
+            .filter(Repository.repo_id == self.repo_id) \
+            .filter(Repository.repo_size != None) \
+            .filter(Repository.repo_size_updated_on < pushed_on) \
+            .update({Repository.repo_size: Repository.repo_size + size},
+                    synchronize_session=False) # concurrent pushes are added atomically
+        Session().expire(self, ['repo_size'])
+
+    def repo_size_update_pending(self):
+        """
+        Mark the stored size as up to date while it is updated in the
+        background, so only one update is started.
+        """
+        self.repo_size_updated_on = datetime.datetime.now()
+
+    def repo_size_outdated(self, max_age):
+        """
+        Return True if the stored size is outdated or older than ``max_age``
+        seconds.
+        """
+        return (self.repo_size_updated_on is None or
+                datetime.datetime.now() - self.repo_size_updated_on > datetime.timedelta(seconds=max_age))
 
     #==========================================================================
     # SCM CACHE INSTANCE
@@ -1325,22 +1383,28 @@ class Repository(Base, BaseDbModel):
 
     def set_invalidate(self):
         """
-        Flush SA session caches of instances of on disk repo.
+        Flush SA session caches of instances of on disk repo, and the
+        instances cached across requests.
         """
         try:
             del self._scm_instance
         except AttributeError:
             pass
+        repository_pool.invalidate(self.repo_full_path)
 
     _scm_instance = None  # caching inside lifetime of SA session
 
     @property
     def scm_instance(self):
         if self._scm_instance is None:
-            return self.scm_instance_no_cache()  # will populate self._scm_instance
+            self._scm_instance = repository_pool.get(self.repo_full_path, self._create_scm_instance)
         return self._scm_instance
 
     def scm_instance_no_cache(self):
+        self._scm_instance = self._create_scm_instance()
+        return self._scm_instance
+
+    def _create_scm_instance(self):
         repo_full_path = self.repo_full_path
         alias = get_scm(repo_full_path)[0]
         log.debug('Creating instance of %s repository from %s',
@@ -1348,11 +1412,8 @@ class Repository(Base, BaseDbModel):
         backend = get_backend(alias)
 
         if alias == 'hg':
-            self._scm_instance = backend(repo_full_path, create=False, baseui=self._ui)
-        else:
-            self._scm_instance = backend(repo_full_path, create=False)
-
-        return self._scm_instance
+            return backend(repo_full_path, create=False, baseui=self._ui)
+        return backend(repo_full_path, create=False)
 
     def __json__(self):
         return dict(
@@ -1895,6 +1956,7 @@ class Statistics(Base, BaseDbModel):
     commit_activity = Column(LargeBinary(1000000), nullable=False) # JSON data
     commit_activity_combined = Column(LargeBinary(), nullable=False) # JSON data
     languages = Column(LargeBinary(1000000), nullable=False) # JSON data
+    languages_revision = Column(String(40), nullable=True) # raw_id languages were counted at
 
     repository = relationship('Repository', single_parent=True)
 
@@ -2321,3 +2383,63 @@ class UserSshKeys(Base, BaseDbModel):
         self._public_key = full_key
         enc_key = safe_bytes(full_key.split(" ")[1])
         self.fingerprint = base64.b64encode(hashlib.sha256(base64.b64decode(enc_key)).digest()).replace(b'\n', b'').rstrip(b'=').decode()
+
+
+#==============================================================================
+# PERMISSIONS GENERATION
+#==============================================================================
+
+# Changes to these objects can change the permissions of users. For each class,
+# the attributes that matter when an existing object is modified - None means
+# all. Creating or deleting any of them always matters.
+_PERMISSION_ATTRIBUTES = {
+    User: ('username', 'active', 'admin'),
+    UserGroup: ('users_group_name', 'users_group_active'),
+    UserGroupMember: None,
+    Repository: ('repo_name', 'private', 'owner', 'owner_id'),
+    RepoGroup: ('group_name',),
+    Permission: None,
+    UserRepoToPerm: None,
+    UserUserGroupToPerm: None,
+    UserToPerm: None,
+    UserGroupRepoToPerm: None,
+    UserGroupUserGroupToPerm: None,
+    UserGroupToPerm: None,
+    UserRepoGroupToPerm: None,
+    UserGroupRepoGroupToPerm: None,
+}
+
+
+def _changes_permissions(obj):
+    attrs = _PERMISSION_ATTRIBUTES.get(type(obj), ())
+    if attrs is None:
+        return True
+    return any(attributes.get_history(obj, attr).has_changes() for attr in attrs)
+
+
+def _bump_permissions_generation(session):
+    """
+    Give the permissions a new generation in the transaction of session. It
+    is a random token, not a counter, so concurrent transactions can't
+    end up with the same generation.
+    """
+    setting = session.query(Setting) \
+        .filter(Setting.app_settings_name == Setting.PERMISSIONS_GENERATION).scalar()
+    if setting is None:
+        setting = Setting(Setting.PERMISSIONS_GENERATION)
+        session.add(setting)
+    setting.app_settings_value = uuid.uuid4().hex
+
+
+@sqlalchemy.event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    if any(type(obj) in _PERMISSION_ATTRIBUTES for obj in itertools.chain(session.new, session.deleted)) or \
+       any(_changes_permissions(obj) for obj in session.dirty):
+        _bump_permissions_generation(session)
+
+
+@sqlalchemy.event.listens_for(Session, 'after_bulk_delete')
+@sqlalchemy.event.listens_for(Session, 'after_bulk_update')
+def _after_bulk_change(bulk_context):
+    if bulk_context.mapper.class_ in _PERMISSION_ATTRIBUTES:
+        _bump_permissions_generation(bulk_context.session)
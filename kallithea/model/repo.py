@@ -34,36 +34,56 @@ from datetime import datetime
 
 import kallithea.lib.utils2
 from kallithea.lib import helpers as h
-from kallithea.lib.auth import HasRepoPermissionLevel, HasUserGroupPermissionLevel
+from kallithea.lib.auth import HasUserGroupPermissionLevel
 from kallithea.lib.exceptions import AttachedForksError
 from kallithea.lib.hooks import log_delete_repository
 from kallithea.lib.utils import is_valid_repo_uri, make_ui
 from kallithea.lib.utils2 import LazyProperty, get_current_authuser, obfuscate_url_pw, remove_prefix
 from kallithea.lib.vcs.backends import get_backend
-from kallithea.model.db import (URL_SEP, Permission, RepoGroup, Repository, RepositoryField, Session, Statistics, Ui, User, UserGroup, UserGroupRepoGroupToPerm,
-                                UserGroupRepoToPerm, UserRepoGroupToPerm, UserRepoToPerm)
+from kallithea.model.db import (URL_SEP, Permission, RepoGroup, Repository, RepositoryField, Session, Statistics, Ui, User, UserFollowing, UserGroup,
+                                UserGroupRepoGroupToPerm, UserGroupRepoToPerm, UserRepoGroupToPerm, UserRepoToPerm)
 
 
 log = logging.getLogger(__name__)
 
 
+# stay well below the SQLite limit of 999 variables in a statement
+_IN_CHUNK_SIZE = 500
+
+
+def _query_by_ids(query, column, ids):
+    """Return dict of the (id, value) rows of query for ids, filtering on
+    column in chunks of ids"""
+    ids = sorted(ids)
+    result = {}
+    for i in range(0, len(ids), _IN_CHUNK_SIZE):
+        result.update(query.filter(column.in_(ids[i:i + _IN_CHUNK_SIZE])))
+    return result
+
+
 class RepoModel(object):
 
     URL_SEPARATOR = URL_SEP
 
-    def _create_default_perms(self, repository, private):
-        # create default permission
+    def _get_default_perm(self, def_user, private):
+        """Return the name of the permission the default user gets on a new repository."""
         default = 'repository.read'
-        def_user = User.get_default_user()
         for p in def_user.user_perms:
             if p.permission.permission_name.startswith('repository.'):
                 default = p.permission.permission_name
                 break
 
-        default_perm = 'repository.none' if private else default
+        return 'repository.none' if private else default
+
+    def _create_default_perms(self, repository, private, def_user=None, default_perm=None):
+        # create default permission - the default user and Permission can be given by the caller
+        if def_user is None:
+            def_user = User.get_default_user()
+        if default_perm is None:
+            default_perm = Permission.get_by_key(self._get_default_perm(def_user, private))
 
         repo_to_perm = UserRepoToPerm()
-        repo_to_perm.permission = Permission.get_by_key(default_perm)
+        repo_to_perm.permission = default_perm
 
         repo_to_perm.repository = repository
         repo_to_perm.user_id = def_user.user_id
@@ -101,68 +121,22 @@ class RepoModel(object):
         """
         from kallithea.lib.auth import AuthUser
         auth_user = AuthUser(dbuser=User.guess_instance(user))
-        repos = [repo_name
-            for repo_name, perm in auth_user.permissions['repositories'].items()
-            if perm in ['repository.read', 'repository.write', 'repository.admin']
-            ]
+        repos = auth_user.filter_repository_names(auth_user.permissions['repositories'], 'read')
         return Repository.query().filter(Repository.repo_name.in_(repos))
 
-    @classmethod
-    def _render_datatable(cls, tmpl, *args, **kwargs):
-        from tg import tmpl_context as c, request, app_globals
-        from tg.i18n import ugettext as _
-
-        _tmpl_lookup = app_globals.mako_lookup
-        template = _tmpl_lookup.get_template('data_table/_dt_elements.html')
-
-        tmpl = template.get_def(tmpl)
-        kwargs.update(dict(_=_, h=h, c=c, request=request))
-        return tmpl.render_unicode(*args, **kwargs)
-
     def get_repos_as_dict(self, repos_list, repo_groups_list=None,
-                          admin=False,
                           short_name=False):
         """Return repository list for use by DataTable.
         repos_list: list of repositories - but will be filtered for read permission.
         repo_groups_list: added at top of list without permission check.
-        admin: return data for action column.
+        short_name: show repository names without their group.
+
+        Only data is returned - the markup is made client side by the
+        renderers in data_table/_dt_elements.html. Data that would otherwise
+        be loaded per repository is fetched for all of them at once.
         """
-        _render = self._render_datatable
         from tg import tmpl_context as c, request
-        from kallithea.model.scm import ScmModel
-
-        def repo_lnk(name, rtype, rstate, private, fork_of):
-            return _render('repo_name', name, rtype, rstate, private, fork_of,
-                           short_name=short_name)
-
-        def following(repo_id, is_following):
-            return _render('following', repo_id, is_following)
-
-        def last_change(last_change):
-            return _render("last_change", last_change)
-
-        def rss_lnk(repo_name):
-            return _render("rss", repo_name)
-
-        def atom_lnk(repo_name):
-            return _render("atom", repo_name)
-
-        def last_rev(repo_name, cs_cache):
-            return _render('revision', repo_name, cs_cache.get('revision'),
-                           cs_cache.get('raw_id'), cs_cache.get('author'),
-                           cs_cache.get('message'))
-
-        def desc(desc):
-            return h.urlify_text(desc, truncate=80, stylize=c.visual.stylify_metalabels)
-
-        def state(repo_state):
-            return _render("repo_state", repo_state)
-
-        def repo_actions(repo_name):
-            return _render('repo_actions', repo_name)
-
-        def owner_actions(owner_id, username):
-            return _render('user_name', owner_id, username)
+        from kallithea.model.scm import RepoList
 
         repos_data = []
 
@@ -170,38 +144,42 @@ class RepoModel(object):
             repos_data.append(dict(
                 raw_name='\0' + gr.name, # sort before repositories
                 just_name=gr.name,
-                name=_render('group_name_html', group_name=gr.group_name, name=gr.name),
+                name=gr.name,
+                group_name=gr.group_name,
                 desc=gr.group_description))
 
-        for repo in repos_list:
-            if not HasRepoPermissionLevel('read')(repo.repo_name, 'get_repos_as_dict check'):
-                continue
+        following_repo_ids = set(repo_id for repo_id, in Session().query(UserFollowing.follows_repository_id)
+                                 .filter(UserFollowing.user_id == request.authuser.user_id)
+                                 .filter(UserFollowing.follows_repository_id != None))
+        repos = list(RepoList(repos_list, perm_level='read'))
+        owner_names = _query_by_ids(Session().query(User.user_id, User.username), User.user_id,
+                                    set(repo.owner_id for repo in repos))
+        fork_names = _query_by_ids(Session().query(Repository.repo_id, Repository.repo_name), Repository.repo_id,
+                                   set(repo.fork_id for repo in repos if repo.fork_id is not None))
+
+        for repo in repos:
             cs_cache = repo.changeset_cache
             row = {
                 "raw_name": repo.repo_name,
                 "just_name": repo.just_name,
-                "name": repo_lnk(repo.repo_name, repo.repo_type,
-                                 repo.repo_state, repo.private, repo.fork),
-                "following": following(
-                    repo.repo_id,
-                    ScmModel().is_following_repo(repo.repo_name, request.authuser.user_id),
-                ),
+                "name": repo.just_name if short_name else repo.repo_name,
+                "repo_id": repo.repo_id,
+                "repo_type": repo.repo_type,
+                "repo_state": repo.repo_state,
+                "private": repo.private,
+                "fork_of": fork_names.get(repo.fork_id),
+                "following": repo.repo_id in following_repo_ids,
                 "last_change_iso": repo.last_db_change.isoformat(),
-                "last_change": last_change(repo.last_db_change),
-                "last_changeset": last_rev(repo.repo_name, cs_cache),
+                "last_change": h.age(repo.last_db_change),
+                "last_change_date": h.fmt_date(repo.last_db_change),
                 "last_rev_raw": cs_cache.get('revision'),
-                "desc": desc(repo.description),
-                "owner": h.person(repo.owner),
-                "state": state(repo.repo_state),
-                "rss": rss_lnk(repo.repo_name),
-                "atom": atom_lnk(repo.repo_name),
+                "last_raw_id": cs_cache.get('raw_id'),
+                "last_author": cs_cache.get('author'),
+                "last_message": cs_cache.get('message'),
+                "desc": h.urlify_text(repo.description, truncate=80, stylize=c.visual.stylify_metalabels),
+                "owner": owner_names.get(repo.owner_id),
+                "owner_id": repo.owner_id,
             }
-            if admin:
-                row.update({
-                    "action": repo_actions(repo.repo_name),
-                    "owner": owner_actions(repo.owner_id,
-                                           h.person(repo.owner))
-                })
             repos_data.append(row)
 
         return {
@@ -323,11 +301,16 @@ class RepoModel(object):
                      landing_rev='rev:tip', fork_of=None,
                      copy_fork_permissions=False, enable_statistics=False,
                      enable_downloads=False,
-                     copy_group_permissions=False, state=Repository.STATE_PENDING):
+                     copy_group_permissions=False, state=Repository.STATE_PENDING,
+                     def_user=None, default_perm=None, flush=True):
         """
         Create repository inside database with PENDING state. This should only be
         executed by create() repo, with exception of importing existing repos.
 
+        When importing many repositories, the default user and the Permission
+        it gets can be given as ``def_user`` and ``default_perm``. With
+        ``flush=False``, the repository isn't flushed to the database, and the
+        caller must flush and log 'started_following_repo' for the owner.
         """
         from kallithea.model.scm import ScmModel
 
@@ -402,7 +385,15 @@ class RepoModel(object):
                     UserGroupRepoToPerm.create(perm.users_group, new_repo, perm_obj)
 
             else:
-                self._create_default_perms(new_repo, private)
+                self._create_default_perms(new_repo, private, def_user, default_perm)
+
+            if not flush:
+                # the owner is following the repository - without querying
+                following = UserFollowing()
+                following.user = owner
+                following.follows_repository = new_repo
+                Session().add(following)
+                return new_repo
 
             # now automatically start following this repository as owner
             ScmModel().toggle_following_repo(new_repo.repo_id, owner.user_id)
@@ -25,24 +25,26 @@ Original author and date, and relevant copyright and licensing information is be
 :license: GPLv3, see LICENSE.md for more details.
 """
 
+import json
 import logging
 import os
 import posixpath
 import re
 import sys
+import tempfile
 import traceback
 
 import pkg_resources
+from tg import request
 from tg.i18n import ugettext as _
 
 import kallithea
 from kallithea import BACKENDS
-from kallithea.lib.auth import HasPermissionAny, HasRepoGroupPermissionLevel, HasRepoPermissionLevel, HasUserGroupPermissionLevel
+from kallithea.lib.auth import HasPermissionAny
 from kallithea.lib.exceptions import IMCCommitError, NonRelativePathError
 from kallithea.lib.hooks import process_pushed_raw_ids
-from kallithea.lib.utils import action_logger, get_filesystem_repos, make_ui
+from kallithea.lib.utils import action_logger, get_filesystem_repos
 from kallithea.lib.utils2 import safe_bytes, set_hook_environment
-from kallithea.lib.vcs import get_backend
 from kallithea.lib.vcs.backends.base import EmptyChangeset
 from kallithea.lib.vcs.exceptions import RepositoryError
 from kallithea.lib.vcs.nodes import FileNode
@@ -52,6 +54,58 @@ from kallithea.model.db import PullRequest, RepoGroup, Repository, Session, Ui,
 
 log = logging.getLogger(__name__)
 
+# results of the last incremental repo_scan, by path - when there is no cache_dir
+_repo_scan_caches = {}
+
+REPO_SCAN_CACHE_FILENAME = 'repo_scan.json'
+
+
+def _scan_cache_path():
+    cache_dir = kallithea.CONFIG.get('cache_dir')
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, REPO_SCAN_CACHE_FILENAME)
+
+
+def _read_scan_cache(repos_path):
+    """
+    Return the results of the last incremental scan of ``repos_path`` - by
+    any process when they are stored in cache_dir.
+    """
+    cache_path = _scan_cache_path()
+    if cache_path is None:
+        return _repo_scan_caches.setdefault(repos_path, {})
+    try:
+        with open(cache_path) as f:
+            data = json.load(f)
+        if data.get('path') != repos_path:
+            return {}
+        return dict((dir_path, (mtime, alias, tuple((name, recurse) for name, recurse in subdirs)))
+                    for dir_path, (mtime, alias, subdirs) in data['dirs'].items())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.warning('ignoring invalid repository scan cache %s: %s', cache_path, e)
+        return {}
+
+
+def _write_scan_cache(repos_path, scan_cache):
+    cache_path = _scan_cache_path()
+    if cache_path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'path': repos_path, 'dirs': scan_cache}, f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        log.warning('failed writing repository scan cache %s: %s', cache_path, e)
+
 
 class UserTemp(object):
     def __init__(self, user_id):
@@ -70,21 +124,21 @@ class RepoTemp(object):
 
 
 class _PermCheckIterator(object):
-    def __init__(self, obj_list, obj_attr, perm_set, perm_checker, extra_kwargs=None):
+    def __init__(self, obj_list, obj_attr, perm_level, perm_filter_name):
         """
         Creates iterator from given list of objects, additionally
-        checking permission for them from perm_set var
+        checking that the current user has perm_level permission on them
 
         :param obj_list: list of db objects
-        :param obj_attr: attribute of object to pass into perm_checker
-        :param perm_set: list of permissions to check
-        :param perm_checker: callable to check permissions against
+        :param obj_attr: attribute of object with the name to check
+        :param perm_level: permission level to check
+        :param perm_filter_name: name of the AuthUser method filtering names
+          by permission level
         """
         self.obj_list = obj_list
         self.obj_attr = obj_attr
-        self.perm_set = perm_set
-        self.perm_checker = perm_checker
-        self.extra_kwargs = extra_kwargs or {}
+        self.perm_level = perm_level
+        self.perm_filter_name = perm_filter_name
 
     def __len__(self):
         return len(self.obj_list)
@@ -93,41 +147,40 @@ class _PermCheckIterator(object):
         return '<%s (%s)>' % (self.__class__.__name__, self.__len__())
 
     def __iter__(self):
-        for db_obj in self.obj_list:
-            # check permission at this level
-            name = getattr(db_obj, self.obj_attr, None)
-            if not self.perm_checker(*self.perm_set)(
-                    name, self.__class__.__name__, **self.extra_kwargs):
-                continue
-
-            yield db_obj
+        # check permissions for all objects at once
+        obj_list = list(self.obj_list)
+        perm_filter = getattr(request.authuser, self.perm_filter_name)
+        permitted = set(perm_filter([getattr(db_obj, self.obj_attr, None) for db_obj in obj_list],
+                                    self.perm_level))
+        log.debug('%s: %s of %s permitted for %s', self.__class__.__name__,
+                  len(permitted), len(obj_list), request.authuser.username)
+        for db_obj in obj_list:
+            if getattr(db_obj, self.obj_attr, None) in permitted:
+                yield db_obj
 
 
 class RepoList(_PermCheckIterator):
 
-    def __init__(self, db_repo_list, perm_level, extra_kwargs=None):
+    def __init__(self, db_repo_list, perm_level):
         super(RepoList, self).__init__(obj_list=db_repo_list,
-                    obj_attr='repo_name', perm_set=[perm_level],
-                    perm_checker=HasRepoPermissionLevel,
-                    extra_kwargs=extra_kwargs)
+                    obj_attr='repo_name', perm_level=perm_level,
+                    perm_filter_name='filter_repository_names')
 
 
 class RepoGroupList(_PermCheckIterator):
 
-    def __init__(self, db_repo_group_list, perm_level, extra_kwargs=None):
+    def __init__(self, db_repo_group_list, perm_level):
         super(RepoGroupList, self).__init__(obj_list=db_repo_group_list,
-                    obj_attr='group_name', perm_set=[perm_level],
-                    perm_checker=HasRepoGroupPermissionLevel,
-                    extra_kwargs=extra_kwargs)
+                    obj_attr='group_name', perm_level=perm_level,
+                    perm_filter_name='filter_repository_group_names')
 
 
 class UserGroupList(_PermCheckIterator):
 
-    def __init__(self, db_user_group_list, perm_level, extra_kwargs=None):
+    def __init__(self, db_user_group_list, perm_level):
         super(UserGroupList, self).__init__(obj_list=db_user_group_list,
-                    obj_attr='users_group_name', perm_set=[perm_level],
-                    perm_checker=HasUserGroupPermissionLevel,
-                    extra_kwargs=extra_kwargs)
+                    obj_attr='users_group_name', perm_level=perm_level,
+                    perm_filter_name='filter_user_group_names')
 
 
 class ScmModel(object):
@@ -159,13 +212,17 @@ class ScmModel(object):
 
         return q.ui_value
 
-    def repo_scan(self, repos_path=None):
+    def repo_scan(self, repos_path=None, incremental=False):
         """
         Listing of repositories in given path. This path should not be a
-        repository itself. Return a dictionary of repository objects mapping to
-        vcs instances.
+        repository itself. Return a dictionary mapping repository names to
+        FilesystemRepo records - call their scm_instance to get the vcs
+        instances.
 
         :param repos_path: path to directory containing repositories
+        :param incremental: only scan the directories that changed since the
+            last incremental scan of the same path - the result is stored in
+            cache_dir and shared by all processes
         """
 
         if repos_path is None:
@@ -173,29 +230,22 @@ class ScmModel(object):
 
         log.info('scanning for repositories in %s', repos_path)
 
-        baseui = make_ui()
+        scan_cache = None
+        if incremental:
+            scan_cache = _read_scan_cache(repos_path)
         repos = {}
 
-        for name, path in get_filesystem_repos(repos_path):
+        for repo in sorted(get_filesystem_repos(repos_path, scan_cache=scan_cache)):
             # name need to be decomposed and put back together using the /
             # since this is internal storage separator for kallithea
-            name = Repository.normalize_repo_name(name)
-
-            try:
-                if name in repos:
-                    raise RepositoryError('Duplicate repository name %s '
-                                          'found in %s' % (name, path))
-                else:
-
-                    klass = get_backend(path[0])
-
-                    if path[0] == 'hg' and path[0] in BACKENDS:
-                        repos[name] = klass(path[1], baseui=baseui)
-
-                    if path[0] == 'git' and path[0] in BACKENDS:
-                        repos[name] = klass(path[1])
-            except OSError:
-                continue
+            name = Repository.normalize_repo_name(repo.name)
+            if name in repos:
+                raise RepositoryError('Duplicate repository name %s '
+                                      'found in %s' % (name, repo.path))
+            if repo.alias in BACKENDS:
+                repos[name] = repo._replace(name=name)
+        if incremental:
+            _write_scan_cache(repos_path, scan_cache)
         log.debug('found %s paths with repositories', len(repos))
         return repos
 
@@ -27,16 +27,16 @@ class TestHomeController(base.TestController):
             """<span class="label label-repo" title="Mercurial repository">hg"""
         )
 
-        # html in javascript variable:
-        response.mustcontain(r'href=\"/%s\"' % base.HG_REPO)
+        # data in javascript variable - rendered client side:
+        response.mustcontain('var repoListRender = ')
+        response.mustcontain('"raw_name": "%s"' % base.HG_REPO)
+        response.mustcontain('"repo_type": "hg", "repo_state": "repo_state_created", "private": false')
 
-        response.mustcontain(r'\x3ci class=\"icon-globe\"')
+        response.mustcontain(r'"last_message": "fixes issue with having custom format for git-log\n"')
+        response.mustcontain('"last_raw_id": "5f2c6ee195929b0be80749243c18121c9864a3b3"')
 
-        response.mustcontain(r'\"fixes issue with having custom format for git-log\n\"')
-        response.mustcontain(r'\"/%s/changeset/5f2c6ee195929b0be80749243c18121c9864a3b3\"' % base.GIT_REPO)
-
-        response.mustcontain(r'\"disable security checks on hg clone for travis\"')
-        response.mustcontain(r'\"/%s/changeset/96507bd11ecc815ebc6270fdf6db110928c09c1e\"' % base.HG_REPO)
+        response.mustcontain('"last_message": "disable security checks on hg clone for travis"')
+        response.mustcontain('"last_raw_id": "96507bd11ecc815ebc6270fdf6db110928c09c1e"')
 
     def test_repo_summary_with_anonymous_access_disabled(self):
         with fixture.anon_access(False):
@@ -38,7 +38,7 @@ class TestLoginController(base.TestController):
         self.assert_authenticated_user(response, base.TEST_USER_ADMIN_LOGIN)
 
         response = response.follow()
-        response.mustcontain('/%s' % base.HG_REPO)
+        response.mustcontain('"raw_name": "%s"' % base.HG_REPO)
 
     def test_login_regular_ok(self):
         response = self.app.post(base.url(controller='login', action='index'),
@@ -50,7 +50,7 @@ class TestLoginController(base.TestController):
         self.assert_authenticated_user(response, base.TEST_USER_REGULAR_LOGIN)
 
         response = response.follow()
-        response.mustcontain('/%s' % base.HG_REPO)
+        response.mustcontain('"raw_name": "%s"' % base.HG_REPO)
 
     def test_login_regular_email_ok(self):
         response = self.app.post(base.url(controller='login', action='index'),
@@ -62,7 +62,7 @@ class TestLoginController(base.TestController):
         self.assert_authenticated_user(response, base.TEST_USER_REGULAR_LOGIN)
 
         response = response.follow()
-        response.mustcontain('/%s' % base.HG_REPO)
+        response.mustcontain('"raw_name": "%s"' % base.HG_REPO)
 
     def test_login_ok_came_from(self):
         test_came_from = '/_admin/users'
@@ -1,7 +1,14 @@
+import os
+
 import mock
+import pytest
+from whoosh.index import open_dir
+from whoosh.qparser import QueryParser
 
 from kallithea import CONFIG
 from kallithea.config.conf import INDEX_FILENAMES
+from kallithea.lib.indexers import CHGSET_IDX_NAME, IDX_NAME, SCHEMA
+from kallithea.lib.indexers.daemon import RepositoryIndexer, WhooshIndexingDaemon
 from kallithea.model.meta import Session
 from kallithea.model.repo import RepoModel
 from kallithea.model.repo_group import RepoGroupModel
@@ -186,3 +193,73 @@ class TestSearchControllerIndexing(base.TestController):
                                 {'q': query, 'type': searchtype})
 
         response.mustcontain('>%d results' % hit)
+
+
+def read_index(index_location):
+    result = {}
+    for indexname in [IDX_NAME, CHGSET_IDX_NAME]:
+        with open_dir(index_location, indexname=indexname).searcher() as searcher:
+            result[indexname] = sorted((f.get('repository'), f.get('path'), f.get('raw_id'), f.get('modtime'))
+                                       for f in searcher.all_stored_fields())
+    with open_dir(index_location, indexname=IDX_NAME).searcher() as searcher:
+        hits = searcher.search(QueryParser('content', schema=SCHEMA).parse('def'), limit=None)
+        result['hits'] = sorted(hit['path'] for hit in hits)
+    return result
+
+
+class TestParallelIndexing(object):
+
+    def _build_index(self, index_location, workers):
+        WhooshIndexingDaemon(index_location=index_location,
+                             repo_location=base.TESTS_TMP_PATH,
+                             repo_list=[base.HG_REPO, base.GIT_REPO],
+                             workers=workers) \
+            .run(full_index=True)
+        return read_index(index_location)
+
+    def test_parallel_build_matches_serial_build(self, tmpdir):
+        serial = self._build_index(str(tmpdir.join('serial')), workers=1)
+        parallel = self._build_index(str(tmpdir.join('parallel')), workers=2)
+        assert parallel == serial
+        assert len(serial[IDX_NAME]) > 100
+        assert len(serial[CHGSET_IDX_NAME]) > 1000
+        assert serial['hits']
+        # worker indexes have been merged and removed
+        assert not [f for f in os.listdir(str(tmpdir.join('parallel'))) if f.startswith('worker-')]
+
+
+    def test_parallel_build_removes_worker_indexes_on_failure(self, tmpdir):
+        index_location = str(tmpdir.join('parallel'))
+        with mock.patch.object(RepositoryIndexer, 'index_repository', side_effect=Exception('failing')):
+            with pytest.raises(Exception, match='failing'):
+                self._build_index(index_location, workers=2)
+        assert not [f for f in os.listdir(index_location) if f.startswith('worker-')]
+
+class TestIncrementalIndexing(object):
+
+    def _indexer(self, index_location):
+        return WhooshIndexingDaemon(index_location=index_location,
+                                    repo_location=base.TESTS_TMP_PATH,
+                                    repo_list=[base.HG_REPO, base.GIT_REPO])
+
+    def test_update_from_old_revision_matches_full_build(self, tmpdir):
+        full_location = str(tmpdir.join('full'))
+        self._indexer(full_location).run(full_index=True)
+
+        # build the index at an old revision and update it to the landing revision
+        index_location = str(tmpdir.join('incremental'))
+        with mock.patch.object(WhooshIndexingDaemon, '_get_index_raw_id',
+                               lambda self, repo: repo.get_changeset(100).raw_id):
+            self._indexer(index_location).run(full_index=True)
+        old_index = read_index(index_location)
+        daemon = self._indexer(index_location)
+        with mock.patch.object(daemon, 'index_files') as index_files:
+            daemon.run()
+        assert not index_files.called
+        assert old_index != read_index(full_location)
+        assert read_index(index_location) == read_index(full_location)
+
+        # with unknown revisions, all files are indexed again
+        daemon._write_index_revisions({base.HG_REPO: 'deadbeef' * 5})
+        daemon.run()
+        assert read_index(index_location) == read_index(full_location)
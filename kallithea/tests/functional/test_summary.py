@@ -12,8 +12,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+
+import mock
 import pytest
 
+from kallithea.lib import helpers as h
 from kallithea.model.db import Repository
 from kallithea.model.meta import Session
 from kallithea.model.repo import RepoModel
@@ -138,6 +142,37 @@ class TestSummaryController(base.TestController):
             """<i class="icon-globe">"""
         )
 
+    @base.parametrize('repo_name', [base.HG_REPO, base.GIT_REPO])
+    def test_repo_size(self, repo_name):
+        self.log_user()
+        r = Repository.get_by_repo_name(repo_name)
+        r.repo_size_updated_on = None
+        Session().commit()
+        url = base.url('repo_size', repo_name=repo_name)
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+
+        response = self.app.get(url, headers=headers)
+        r = Repository.get_by_repo_name(repo_name)
+        assert r.repo_size > 100000
+        assert response.json == h.format_byte_size(r.repo_size)
+
+        # the stored size is used until it is outdated
+        with mock.patch('kallithea.model.db.get_repo_size', side_effect=AssertionError):
+            assert self.app.get(url, headers=headers).json == response.json
+
+    def test_repo_size_updated_once_in_background(self):
+        self.log_user()
+        r = Repository.get_by_repo_name(base.HG_REPO)
+        r.repo_size_updated_on = datetime.datetime(2000, 1, 1)
+        Session().commit()
+        url = base.url('repo_size', repo_name=base.HG_REPO)
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        with mock.patch('kallithea.CELERY_APP', True), \
+             mock.patch('kallithea.controllers.summary.update_repo_size') as update_repo_size:
+            self.app.get(url, headers=headers)
+            self.app.get(url, headers=headers)
+        update_repo_size.assert_called_once_with(base.HG_REPO)
+
     def _enable_stats(self, repo):
         r = Repository.get_by_repo_name(repo)
         r.enable_statistics = True
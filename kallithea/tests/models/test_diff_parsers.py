@@ -1,4 +1,4 @@
-from kallithea.lib.diffs import BIN_FILENODE, CHMOD_FILENODE, COPIED_FILENODE, DEL_FILENODE, MOD_FILENODE, NEW_FILENODE, RENAMED_FILENODE, DiffProcessor
+from kallithea.lib.diffs import BIN_FILENODE, CHMOD_FILENODE, COPIED_FILENODE, DEL_FILENODE, MOD_FILENODE, NEW_FILENODE, RENAMED_FILENODE, DiffProcessor, InlineDiffBudget, _inline_diff
 from kallithea.tests import base
 from kallithea.tests.fixture import Fixture
 
@@ -284,6 +284,17 @@ class TestDiffLib(base.TestController):
         expected_data = DIFF_FIXTURES[diff_fixture]
         assert expected_data == data
 
+    def test_diff_limit(self):
+        raw_diff = fixture.load_resource('hg_diff_mod_file_and_rename.diff', strip=False)
+        diff_processor = DiffProcessor(raw_diff)
+        assert not diff_processor.limited_diff
+        assert len(diff_processor) == len(DIFF_FIXTURES['hg_diff_mod_file_and_rename.diff'])
+        limited_processor = DiffProcessor(raw_diff, diff_limit=len(raw_diff) - 1)
+        # known before any file has been parsed
+        assert limited_processor.limited_diff
+        assert [x['filename'] for x in limited_processor] == [x['filename'] for x in diff_processor][:len(limited_processor)]
+        assert len(limited_processor) == len(diff_processor) - 1
+
     def test_diff_markup(self):
         raw_diff = fixture.load_resource('markuptest.diff', strip=False)
         diff_processor = DiffProcessor(raw_diff)
@@ -291,8 +302,8 @@ class TestDiffLib(base.TestController):
         assert not chunks[0]
         #from pprint import pprint; pprint(chunks[1])
         l = ['\n']
-        for d in chunks[1]:
-            l.append('%(action)-7s %(new_lineno)3s %(old_lineno)3s %(line)r\n' % d)
+        for d in _inline_diff(chunks[1]):
+            l.append('%(action)-7s %(new_lineno)3s %(old_lineno)3s %(line)r\n' % d._asdict())
         s = ''.join(l)
         assert s == r'''
 context ... ... '@@ -51,6 +51,13 @@\n'
@@ -312,3 +323,22 @@ unmod    62  55 '\n'
 del          56 '<u>\t</u>#define MIN_STEPS (<del>48</del>)\n'
 add      63     '<u>\t</u>#define MIN_STEPS (<ins>42</ins>)\n'
 '''
+
+    def test_inline_diff_budget(self):
+        raw_diff = fixture.load_resource('git_diff_minified_js.diff', strip=False)
+        lines = DiffProcessor(raw_diff, vcs='git').parsed[0]['chunks'][1]
+        old, new = [l.line for l in lines]
+
+        highlighted = _inline_diff(lines, InlineDiffBudget(10 ** 6, 10 ** 6))
+        assert highlighted[0].line.count('<del>') == highlighted[1].line.count('<ins>') > 1
+        assert highlighted[0].line.replace('<del>', '').replace('</del>', '') == old
+
+        # too expensive - everything between common prefix and suffix is changed
+        highlighted = _inline_diff(lines, InlineDiffBudget(1000, 10 ** 6))
+        assert highlighted[0].line.count('<del>') == highlighted[1].line.count('<ins>') == 1
+        assert highlighted[1].line.replace('<ins>', '').replace('</ins>', '') == new
+
+        # the file budget has been spent - no highlighting
+        budget = InlineDiffBudget(10 ** 6, 10 ** 6)
+        budget.file_budget = 0
+        assert _inline_diff(lines, budget) == lines
@@ -644,3 +644,75 @@ class TestPermissions(base.TestController):
 
         PermissionModel().create_default_permissions(user=self.u1)
         self._test_def_perm_equal(user=self.u1)
+
+    def test_permissions_generation(self):
+        generation = db.Setting.get_permissions_generation()
+        assert generation is not None
+
+        # changes that can't change any permissions keep the generation
+        self.u1.last_login = self.u1.last_login
+        self.u1.name = 'u1 renamed'
+        Session().commit()
+        assert db.Setting.get_permissions_generation() == generation
+
+        u1_auth = AuthUser(user_id=self.u1.user_id)
+        assert u1_auth.permissions['repositories'][base.HG_REPO] == 'repository.read'
+
+        # cached trees must not survive permission changes
+        repo = db.Repository.get_by_repo_name(base.HG_REPO)
+        repo.private = True
+        Session().commit()
+        try:
+            assert db.Setting.get_permissions_generation() != generation
+            u1_auth = AuthUser(user_id=self.u1.user_id)
+            assert u1_auth.permissions['repositories'][base.HG_REPO] == 'repository.none'
+
+            self.ug1 = fixture.create_user_group('G1')
+            UserGroupModel().add_user_to_group(self.ug1, self.u1)
+            RepoModel().grant_user_group_permission(repo=base.HG_REPO,
+                                                    group_name=self.ug1,
+                                                    perm='repository.write')
+            Session().commit()
+            u1_auth = AuthUser(user_id=self.u1.user_id)
+            assert u1_auth.permissions['repositories'][base.HG_REPO] == 'repository.write'
+
+            # admin and active users get other permissions
+            generation = db.Setting.get_permissions_generation()
+            self.u1.admin = True
+            Session().commit()
+            assert db.Setting.get_permissions_generation() != generation
+            u1_auth = AuthUser(user_id=self.u1.user_id)
+            assert u1_auth.permissions['repositories'][base.HG_REPO] == 'repository.admin'
+            self.u1.admin = False
+            Session().commit()
+
+            # bulk deletes too
+            generation = db.Setting.get_permissions_generation()
+            UserModel().revoke_perm(self.u1, 'hg.fork.repository')
+            Session().commit()
+            assert db.Setting.get_permissions_generation() != generation
+        finally:
+            repo.private = False
+            Session().commit()
+
+    def test_filter_names_by_permission_level(self):
+        self.g1 = fixture.create_repo_group('test1', skip_if_exists=True)
+        RepoGroupModel().grant_user_permission(repo_group=self.g1, user=self.u1,
+                                               perm='group.admin')
+        RepoModel().grant_user_permission(repo=base.HG_REPO, user=self.u1,
+                                          perm='repository.write')
+        Session().commit()
+
+        u1_auth = AuthUser(user_id=self.u1.user_id)
+        repo_names = [base.GIT_REPO, 'nonexisting', base.HG_REPO]
+        for level in ['read', 'write', 'admin']:
+            assert u1_auth.filter_repository_names(repo_names, level) == [
+                repo_name for repo_name in repo_names
+                if u1_auth.has_repository_permission_level(repo_name, level)]
+        assert base.HG_REPO in u1_auth.filter_repository_names(repo_names, 'write')
+        assert 'nonexisting' not in u1_auth.filter_repository_names(repo_names, 'read')
+        assert u1_auth.filter_repository_group_names(['test1', 'nonexisting'], 'admin') == ['test1']
+        assert u1_auth.filter_user_group_names(['nonexisting'], 'read') == []
+
+        a1_auth = AuthUser(user_id=self.a1.user_id)
+        assert a1_auth.filter_repository_names(repo_names, 'admin') == [base.GIT_REPO, base.HG_REPO]
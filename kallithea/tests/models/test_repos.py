@@ -1,9 +1,16 @@
+import os
+import shutil
+import subprocess
+
 import pytest
 
 from kallithea.lib.exceptions import AttachedForksError
-from kallithea.model.db import Repository
+from kallithea.lib.utils import repo2db_mapper
+from kallithea.model.db import RepoGroup, Repository, User, UserFollowing
 from kallithea.model.meta import Session
-from kallithea.model.repo import RepoModel
+from kallithea.model.repo import RepoModel, _query_by_ids
+from kallithea.model.repo_group import RepoGroupModel
+from kallithea.model.scm import ScmModel
 from kallithea.tests import base
 from kallithea.tests.fixture import Fixture
 
@@ -79,3 +86,42 @@ class TestRepos(base.TestController):
             RepoModel().delete(repo='test-repo-fork-fork-1')
             RepoModel().delete(repo='test-repo-fork-1')
             Session().commit()
+
+    def test_repo2db_mapper(self):
+        group_path = os.path.join(base.TESTS_TMP_PATH, 'mapper-group')
+        subprocess.check_call(['hg', 'init', os.path.join(group_path, 'hg')])
+        subprocess.check_call(['git', 'init', '-q', '--bare', os.path.join(group_path, 'sub', 'git')])
+        subprocess.check_call(['hg', 'init', os.path.join(group_path, 'invalid name')])
+        try:
+            # other tests might leave repositories on disk
+            repos = dict((name, repo) for name, repo in ScmModel().repo_scan().items()
+                         if name.startswith('mapper-group/') or Repository.get_by_repo_name(name) is not None)
+            added, removed = repo2db_mapper(repos)
+            assert added == ['mapper-group/hg', 'mapper-group/sub/git'] # the invalid name is skipped
+            assert RepoGroup.get_by_group_name('mapper-group/sub') is not None
+            assert Repository.get_by_repo_name('mapper-group/hg').description == 'mapper-group/hg repository'
+            repo = Repository.get_by_repo_name('mapper-group/sub/git')
+            assert repo.repo_type == 'git'
+            assert repo.owner == User.get_first_admin()
+            assert [f.user for f in UserFollowing.query().filter(UserFollowing.follows_repository == repo)] == [repo.owner]
+            assert os.path.isfile(os.path.join(group_path, 'sub', 'git', 'hooks', 'post-receive'))
+        finally:
+            shutil.rmtree(group_path)
+
+        repos = dict((repo.repo_name, None) for repo in Repository.query()
+                     if not repo.repo_name.startswith('mapper-group/'))
+        added, removed = repo2db_mapper(repos, remove_obsolete=True)
+        assert added == []
+        assert removed == ['mapper-group/hg', 'mapper-group/sub/git']
+        assert Repository.get_by_repo_name('mapper-group/hg') is None
+
+        RepoGroupModel().delete('mapper-group/sub')
+        RepoGroupModel().delete('mapper-group')
+        Session().commit()
+
+    def test_query_by_ids_many_ids(self):
+        # more ids than SQLite allows variables in one statement
+        admin = User.get_first_admin()
+        ids = set(range(-2000, 0)) | {admin.user_id}
+        names = _query_by_ids(Session().query(User.user_id, User.username), User.user_id, ids)
+        assert names == {admin.user_id: admin.username}
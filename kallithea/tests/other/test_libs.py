@@ -27,10 +27,14 @@ Original author and date, and relevant copyright and licensing information is be
 
 import datetime
 import hashlib
+import os
+import socket
+import time
 
 import mock
 from tg.util.webtest import test_context
 
+from kallithea.lib import ext_json
 from kallithea.lib.utils2 import AttributeDict, safe_bytes
 from kallithea.model.db import Repository
 from kallithea.tests import base
@@ -612,3 +616,218 @@ class TestLibs(base.TestController):
             request.environ['routes.url'] = url
             with mock.patch('kallithea.CONFIG', config_mock):
                 assert canonical_hostname() == expected
+
+    def test_commit_activity(self):
+        from kallithea.lib.statistics import CommitActivity, day_timestamp
+        day1 = datetime.datetime(2010, 1, 1, 20)
+        day2 = datetime.datetime(2010, 1, 2, 10)
+        activity = CommitActivity()
+        activity.add('joe', day1, 1, 2, 3)
+        activity.add('joe', day1 + datetime.timedelta(hours=1), 1, 0, 0)
+        activity.add('ann', day2, 0, 1, 0)
+        commit_activity, commit_activity_combined = activity.dump('contact')
+
+        # load dumped data and continue aggregating
+        activity = CommitActivity(commit_activity, commit_activity_combined)
+        activity.add('joe', day2)
+        commit_activity, commit_activity_combined = activity.dump('contact')
+        assert ext_json.loads(commit_activity) == {
+            'joe': {'label': 'joe', 'schema': ['commits'], 'data': [
+                {'time': day_timestamp(day1), 'commits': 2, 'added': 2, 'changed': 2, 'removed': 3},
+                {'time': day_timestamp(day2), 'commits': 1, 'added': 0, 'changed': 0, 'removed': 0},
+            ]},
+            'ann': {'label': 'ann', 'schema': ['commits'], 'data': [
+                {'time': day_timestamp(day2), 'commits': 1, 'added': 0, 'changed': 1, 'removed': 0},
+            ]},
+        }
+        assert ext_json.loads(commit_activity_combined) == [[day_timestamp(day1), 2], [day_timestamp(day2), 2]]
+
+        # placeholder without data is not loaded as an author
+        commit_activity, commit_activity_combined = CommitActivity().dump('contact')
+        assert ext_json.loads(commit_activity) == {'contact': {'label': 'contact', 'data': [0, 1], 'schema': ['commits']}}
+        assert CommitActivity(commit_activity, commit_activity_combined).authors == {}
+
+    @base.parametrize('repo_name', [base.HG_REPO, base.GIT_REPO])
+    def test_get_language_stats_incremental(self, repo_name):
+        from kallithea.lib.statistics import count_languages, get_language_stats
+        repo = Repository.get_by_repo_name(repo_name).scm_instance
+        languages, revision = get_language_stats(repo)
+        assert revision == repo.get_changeset().raw_id
+        assert languages['py'] == 68
+        assert get_language_stats(repo, languages, revision) == (languages, revision)
+        for old in [repo.get_changeset(0), repo.get_changeset(repo.count() // 2)]:
+            assert get_language_stats(repo, count_languages(old), old.raw_id) == (languages, revision)
+        # counting starts over if the revision is unknown
+        assert get_language_stats(repo, {'py': 1}, 'deadbeef' * 5) == (languages, revision)
+
+    @base.parametrize('repo_name', [base.HG_REPO, base.GIT_REPO])
+    def test_get_annotation_cached(self, repo_name):
+        from kallithea.lib.annotate import get_annotation
+        repo = Repository.get_by_repo_name(repo_name).scm_instance
+        cs = repo.get_changeset(repo.count() // 2)
+        node = cs.get_node('setup.py')
+        annotation = get_annotation(node)
+        assert annotation == [sha for _lineno, sha, _loader, _line in cs.get_file_annotate('setup.py')]
+        assert len(annotation) == len(node.content.splitlines())
+        with mock.patch.object(type(cs), 'get_file_annotate', side_effect=AssertionError):
+            assert get_annotation(repo.get_changeset(cs.raw_id).get_node('setup.py')) == annotation
+
+    def test_diff_cache_evicts_least_recently_used(self, tmpdir):
+        from kallithea.lib.diffcache import DiffCache
+        diff_cache = DiffCache(str(tmpdir), 2500)
+        a, b, c = 'a' * 40, 'b' * 40, 'c' * 40
+        for mtime, key in enumerate([a, b]):
+            diff_cache.put(key, [key, b'x' * 1000])
+            os.utime(diff_cache._entry_path(key), (mtime, mtime))
+        assert diff_cache.get(a) == [a, b'x' * 1000] # a is now most recently used
+        diff_cache.put(c, [c, b'x' * 1000])
+        assert diff_cache.get(a) is not None
+        assert diff_cache.get(b) is None
+        assert diff_cache.get(c) is not None
+
+    @base.parametrize('scm_dir,expected', [
+        ('.hg', (3000, 200)),
+        ('.git', (3200, 0)), # no .git - a bare repository
+    ])
+    def test_get_repo_size(self, tmpdir, scm_dir, expected):
+        from kallithea.lib.vcs.utils.helpers import get_repo_size
+        tmpdir.join('.hg', 'store', 'data').ensure(dir=True)
+        tmpdir.join('.hg', '00changelog.i').write('x' * 1000)
+        tmpdir.join('.hg', 'store', 'data', 'a.i').write('x' * 2000)
+        tmpdir.join('dir', 'a').write('x' * 200, ensure=True)
+        tmpdir.join('link').mksymlinkto(tmpdir.join('dir'))
+        tmpdir.join('file-link').mksymlinkto(tmpdir.join('dir', 'a'))
+        assert get_repo_size(str(tmpdir), scm_dir) == expected
+
+    def test_get_filesystem_repos(self, tmpdir):
+        from kallithea.lib.utils import get_filesystem_repos
+        tmpdir.join('hg', '.hg').ensure(dir=True)
+        tmpdir.join('group', 'sub', 'git', 'objects').ensure(dir=True)
+        tmpdir.join('group', 'sub', 'git', 'refs').ensure(dir=True)
+        tmpdir.join('group', 'sub', 'git', 'HEAD').write('ref: refs/heads/master\n')
+        tmpdir.join('nonbare', '.git').ensure(dir=True)
+        tmpdir.join('.hidden', '.hg').ensure(dir=True)
+        tmpdir.join('rm__20200101_000000_000000__hg', '.hg').ensure(dir=True)
+        tmpdir.join('group-link').mksymlinkto(tmpdir.join('group')) # not recursed into
+        tmpdir.join('hg-link').mksymlinkto(tmpdir.join('hg'))
+        path = str(tmpdir)
+
+        def scan(scan_cache):
+            return sorted((repo.name, repo.alias) for repo in get_filesystem_repos(path, scan_cache=scan_cache, workers=4))
+
+        scan_cache = {}
+        assert scan(scan_cache) == [('group/sub/git', 'git'), ('hg', 'hg'), ('hg-link', 'hg')]
+
+        # only changed directories are listed again
+        tmpdir.join('group', 'new', '.hg').ensure(dir=True)
+        with mock.patch('os.scandir', side_effect=os.scandir) as scandir:
+            assert scan(scan_cache) == [('group/new', 'hg'), ('group/sub/git', 'git'), ('hg', 'hg'), ('hg-link', 'hg')]
+        assert sorted(call[0][0][len(path):] for call in scandir.call_args_list) == ['/group', '/group-link', '/group/new']
+
+    def test_repo_scan_cache_is_stored_in_cache_dir(self, tmpdir):
+        import kallithea
+        from kallithea.model.scm import ScmModel
+        repos_dir = tmpdir.join('repos')
+        repos_dir.join('hg', '.hg').ensure(dir=True)
+        repos_dir.join('group', 'hg', '.hg').ensure(dir=True)
+        path = str(repos_dir)
+        with mock.patch.dict(kallithea.CONFIG, {'cache_dir': str(tmpdir.join('cache'))}):
+            assert sorted(ScmModel().repo_scan(path, incremental=True)) == ['group/hg', 'hg']
+            assert tmpdir.join('cache', 'repo_scan.json').check()
+            # like another process - nothing has changed and nothing is listed
+            with mock.patch('kallithea.model.scm._repo_scan_caches', {}), \
+                 mock.patch('os.scandir', side_effect=os.scandir) as scandir:
+                assert sorted(ScmModel().repo_scan(path, incremental=True)) == ['group/hg', 'hg']
+            assert scandir.call_args_list == []
+
+    def test_subprocessio_reads_output_while_waiting_for_input(self):
+        from kallithea.lib.vcs.subprocessio import SubprocessIOChunker
+        r, w = os.pipe()
+        # no input is available until the first output has been read
+        out = SubprocessIOChunker(['sh', '-c', 'echo early; cat'], inputstream=r, buffer_size=1)
+        assert next(out) == b'early\n'
+        os.write(w, b'late\n')
+        os.close(w)
+        assert b''.join(out) == b'late\n'
+
+    def test_push_queue_batches_by_repository(self, tmpdir):
+        from kallithea.lib.pushqueue import enqueue_push, process_push_queue
+        queue_dir = str(tmpdir)
+        for repo_name, revs in [('a', ['1']), ('b', ['2']), ('a', ['3']), ('c', ['4'])]:
+            enqueue_push(queue_dir, {'repository': repo_name}, revs)
+
+        processed = []
+        def process_pushes(repo_name, pushes):
+            if repo_name == 'b':
+                raise Exception('failing')
+            processed.append((repo_name, [revs for ex, revs in pushes]))
+        assert process_push_queue(queue_dir, process_pushes) == 3
+        assert processed == [('a', [['1'], ['3']]), ('c', [['4']])]
+        assert sorted(os.listdir(queue_dir)) == ['.lock', 'failed']
+        assert len(os.listdir(os.path.join(queue_dir, 'failed'))) == 1
+
+    def test_push_queue_worker_started_when_serving(self, tmpdir):
+        from kallithea.lib.middleware.simplehg import SimpleHg
+        app = SimpleHg(lambda environ, start_response: [b'ok'],
+                       {'base_path': str(tmpdir), 'push_queue_dir': str(tmpdir.join('queue'))})
+        with mock.patch('kallithea.lib.base.start_push_queue_worker') as start_push_queue_worker:
+            assert app({'PATH_INFO': '/', 'QUERY_STRING': '', 'HTTP_ACCEPT': 'text/html'}, None) == [b'ok']
+        assert start_push_queue_worker.call_count == 1
+
+    def test_hook_server_stores_messages_until_handled(self, tmpdir):
+        from kallithea.lib.hookserver import HookServer, send_message
+        socket_path = str(tmpdir.join('git-hooks.sock'))
+        tmpdir.join('git-hooks.sock.queue', '0000000000000000left.json').write('{"n": 0}', ensure=True)
+        handled = []
+        def handler(message):
+            assert any(fn.endswith('.json') for fn in os.listdir(socket_path + '.queue')) # the message is stored
+            if message['n'] == 2:
+                raise Exception('failing')
+            handled.append(message['n'])
+        server = HookServer(socket_path, handler)
+        server.start()
+        for i in range(100):
+            if server._sock is not None:
+                break
+            time.sleep(0.05)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled:
+            stalled.connect(socket_path) # doesn't keep the other hooks waiting
+            assert send_message(socket_path, {'n': 1})
+            assert send_message(socket_path, {'n': 2})
+        server.queue.join()
+        assert handled == [0, 1]
+        assert os.listdir(socket_path + '.queue') == ['failed']
+
+    def test_process_pushes_invalidates_response_cache(self):
+        from kallithea.lib.hooks import process_pushes
+        from kallithea.lib.middleware.responsecache import response_cache
+        hg_path = Repository.get_by_repo_name(base.HG_REPO).repo_full_path
+        git_path = Repository.get_by_repo_name(base.GIT_REPO).repo_full_path
+        response_cache.clear()
+        response_cache.put(('hg', hg_path, 'cmd=heads'), 'token', 'hg')
+        response_cache.put(('git', os.path.join(git_path, '.git'), 'git-upload-pack'), 'token', 'git')
+        process_pushes(base.GIT_REPO, [])
+        assert response_cache.get(('hg', hg_path, 'cmd=heads'), 'token') == 'hg'
+        assert response_cache.get(('git', os.path.join(git_path, '.git'), 'git-upload-pack'), 'token') is None
+
+    @base.parametrize('repo_name', [base.HG_REPO, base.GIT_REPO])
+    def test_get_diff_files_cached(self, repo_name):
+        from kallithea.lib.diffs import get_diff_files
+        repo = Repository.get_by_repo_name(repo_name).scm_instance
+        cs = repo.get_changeset(repo.count() // 2)
+        rev1 = cs.parents[0].raw_id
+        limited_diff, files = get_diff_files(repo, rev1, cs.raw_id, vcs=repo.alias, enable_comments=True)
+        assert not limited_diff
+        assert [f['filename'] for f in files] == [f['filename'] for f in get_diff_files(repo, rev1, cs.raw_id, vcs=repo.alias)[1]]
+        assert all(f['html'].html is None for f in files) # not rendered yet
+        with mock.patch.object(type(repo), 'get_diff', wraps=repo.get_diff) as get_diff:
+            get_diff_files(repo, rev1, cs.raw_id, vcs=repo.alias, enable_comments=True)
+        assert get_diff.called # only cached when rendered
+        for f in files:
+            str(f['html'])
+            assert f['html'].parsed_file is None # released when rendered
+        with mock.patch.object(type(repo), 'get_diff', side_effect=AssertionError):
+            cached_limited_diff, cached_files = get_diff_files(repo, rev1, cs.raw_id, vcs=repo.alias, enable_comments=True)
+        assert cached_limited_diff == limited_diff
+        assert [str(f['html']) for f in cached_files] == [str(f['html']) for f in files]
+        assert [f['stats'] for f in cached_files] == [f['stats'] for f in files]
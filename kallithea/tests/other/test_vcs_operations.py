@@ -25,6 +25,7 @@ Original author and date, and relevant copyright and licensing information is be
 
 """
 
+import base64
 import json
 import os
 import re
@@ -34,10 +35,11 @@ import urllib.request
 from subprocess import PIPE, Popen
 from tempfile import _RandomNameSequence
 
+import mock
 import pytest
 
 from kallithea import CONFIG
-from kallithea.lib.utils2 import ascii_bytes, safe_str
+from kallithea.lib.utils2 import ascii_bytes, ascii_str, safe_str
 from kallithea.model.db import Repository, Ui, User, UserIpMap, UserLog
 from kallithea.model.meta import Session
 from kallithea.model.ssh_key import SshKeyModel
@@ -379,6 +381,8 @@ class TestVCSOperations(base.TestController):
         clone_url = vt.repo_url_param(webserver, vt.repo_name)
         stdout, stderr = Command(base.TESTS_TMP_PATH).execute(vt.repo_type, 'clone', clone_url, dest_dir)
 
+        Repository.get_by_repo_name(testfork[vt.repo_type]).set_repo_size(1000) # shown by the Mercurial hook
+        Session().commit()
         clone_url = vt.repo_url_param(webserver, testfork[vt.repo_type])
         stdout, stderr = _add_files_and_push(webserver, vt, dest_dir, clone_url=clone_url)
 
@@ -393,6 +397,72 @@ class TestVCSOperations(base.TestController):
         assert [(t[0], (t[1].count(',') + 1) if len(t) == 2 else 0) for t in action_parts] == \
             [('pull', 0), ('push', 3)]
 
+    def test_push_git_hook_socket(self, webserver, testfork, tmpdir):
+        from kallithea.lib.hooks import handle_queued_git_post_receive
+        from kallithea.lib.hookserver import HookServer
+        messages = []
+        def handler(message):
+            messages.append(message)
+            handle_queued_git_post_receive(message)
+        socket_path = str(tmpdir.join('git-hooks.sock'))
+        server = HookServer(socket_path, handler)
+        server.start()
+        for i in range(100):
+            if server._sock is not None:
+                break
+            time.sleep(0.05)
+
+        UserLog.query().delete()
+        Session().commit()
+
+        vt = GitHttpVcsTest
+        dest_dir = _get_tmp_dir()
+        clone_url = vt.repo_url_param(webserver, vt.repo_name)
+        stdout, stderr = Command(base.TESTS_TMP_PATH).execute(vt.repo_type, 'clone', clone_url, dest_dir)
+
+        clone_url = vt.repo_url_param(webserver, testfork[vt.repo_type])
+        with mock.patch.dict(CONFIG, {'git_hook_socket': socket_path}):
+            stdout, stderr = _add_files_and_push(webserver, vt, dest_dir, clone_url=clone_url)
+        _check_proper_git_push(stdout, stderr)
+
+        # the hook handed over the ref updates instead of processing them
+        server.queue.join()
+        assert [m['extras']['repository'] for m in messages] == [testfork['git']]
+        Session.remove()
+        action_parts = [ul.action.split(':', 1) for ul in UserLog.query().order_by(UserLog.user_log_id)]
+        assert [(t[0], (t[1].count(',') + 1) if len(t) == 2 else 0) for t in action_parts] == \
+            [('pull', 0), ('push', 3)]
+
+    def test_push_queue(self, webserver, testfork, tmpdir):
+        from kallithea.lib.celerylib.tasks import process_push_queue
+        UserLog.query().delete()
+        Session().commit()
+
+        vt = HgHttpVcsTest
+        dest_dir = _get_tmp_dir()
+        clone_url = vt.repo_url_param(webserver, vt.repo_name)
+        stdout, stderr = Command(base.TESTS_TMP_PATH).execute(vt.repo_type, 'clone', clone_url, dest_dir)
+
+        # the pushes are only queued
+        queue_dir = str(tmpdir.join('pushqueue'))
+        clone_url = vt.repo_url_param(webserver, testfork[vt.repo_type])
+        with mock.patch.dict(CONFIG, {'push_queue_dir': queue_dir}), \
+             mock.patch('kallithea.lib.base.start_push_queue_worker'): # processed below instead
+            _add_files_and_push(webserver, vt, dest_dir, clone_url=clone_url)
+            _add_files_and_push(webserver, vt, dest_dir, clone_url=clone_url, files_no=2)
+            assert len(os.listdir(queue_dir)) == 2
+            assert [ul.action for ul in UserLog.query()] == ['pull']
+
+            # ... and processed together
+            with mock.patch.object(Repository, 'update_changeset_cache', autospec=True) as update_changeset_cache:
+                process_push_queue()
+            assert update_changeset_cache.call_count == 1
+            assert os.listdir(queue_dir) == ['.lock']
+
+        action_parts = [ul.action.split(':', 1) for ul in UserLog.query().order_by(UserLog.user_log_id)]
+        assert [(t[0], (t[1].count(',') + 1) if len(t) == 2 else 0) for t in action_parts] == \
+            [('pull', 0), ('push', 3), ('push', 2)]
+
     @parametrize_vcs_test
     def test_pull(self, webserver, testfork, vt):
         UserLog.query().delete()
@@ -456,6 +526,25 @@ class TestVCSOperations(base.TestController):
         post_cached_tip = [repo.get_api_data()['last_changeset']['short_id'] for repo in Repository.query().filter(Repository.repo_name == testfork[vt.repo_type])]
         assert pre_cached_tip != post_cached_tip
 
+    @parametrize_vcs_test_http
+    def test_push_adds_pushed_size(self, webserver, testfork, vt):
+        dest_dir = _get_tmp_dir()
+        clone_url = vt.repo_url_param(webserver, testfork[vt.repo_type])
+        stdout, stderr = Command(base.TESTS_TMP_PATH).execute(vt.repo_type, 'clone', clone_url, dest_dir)
+        repo = Repository.get_by_repo_name(testfork[vt.repo_type])
+        repo.set_repo_size(1000)
+        updated_on = repo.repo_size_updated_on
+        Session().commit()
+
+        stdout, stderr = _add_files_and_push(webserver, vt, dest_dir, files_no=1, clone_url=clone_url)
+        if vt.repo_type == 'git':
+            _check_proper_git_push(stdout, stderr)
+
+        Session.remove()
+        repo = Repository.get_by_repo_name(testfork[vt.repo_type])
+        assert repo.repo_size > 1000
+        assert repo.repo_size_updated_on == updated_on # not scanned
+
     @parametrize_vcs_test_http
     def test_push_wrong_credentials(self, webserver, vt):
         dest_dir = _get_tmp_dir()
@@ -637,3 +726,35 @@ class TestVCSOperations(base.TestController):
                                     f_path='/testsubmodule'),
                                 status=302)
         assert response.location == clone_url
+
+    def test_protocol_responses_cached(self, testfork):
+        from kallithea.lib.middleware.responsecache import response_cache
+        response_cache.clear()
+        auth = base64.b64encode(ascii_bytes('%s:%s' % (base.TEST_USER_ADMIN_LOGIN, base.TEST_USER_ADMIN_PASS)))
+        headers = {'Authorization': 'Basic %s' % ascii_str(auth)}
+
+        # git ref advertisement - without running git again until refs change
+        git_url = '/%s/info/refs?service=git-upload-pack' % testfork['git']
+        refs = self.app.get(git_url, headers=headers).body
+        assert b'refs/heads/master' in refs
+        with mock.patch('kallithea.lib.vcs.subprocessio.SubprocessIOChunker', side_effect=AssertionError):
+            assert self.app.get(git_url, headers=headers).body == refs
+        git_path = Repository.get_by_repo_name(testfork['git']).repo_full_path
+        Command(git_path).execute('git update-ref refs/heads/cachetest master')
+        try:
+            assert b'refs/heads/cachetest' in self.app.get(git_url, headers=headers).body
+        finally:
+            Command(git_path).execute('git update-ref -d refs/heads/cachetest')
+
+        # hg bookmarks - without opening the repository until bookmarks change
+        hg_url = '/%s?cmd=listkeys' % testfork['hg']
+        hg_headers = dict(headers, Accept='application/mercurial-0.1', **{'X-HgArg-1': 'namespace=bookmarks'})
+        bookmarks = self.app.get(hg_url, headers=hg_headers).body
+        with mock.patch('mercurial.hgweb.hgweb', side_effect=AssertionError):
+            assert self.app.get(hg_url, headers=hg_headers).body == bookmarks
+        hg_path = Repository.get_by_repo_name(testfork['hg']).repo_full_path
+        Command(hg_path).execute('hg bookmark -r tip cachetest')
+        try:
+            assert b'cachetest\t' in self.app.get(hg_url, headers=hg_headers).body
+        finally:
+            Command(hg_path).execute('hg bookmark -d cachetest')
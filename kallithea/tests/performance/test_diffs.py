@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import difflib
+
+import mock
+import pytest
+
+from kallithea.lib import diffs
+from kallithea.tests.fixture import Fixture
+
+
+fixture = Fixture()
+
+
+def _highlight_inline_diff_difflib(old, new, max_cost=None):
+    """ The inline highlighter used before, for comparison. """
+    oldwords = diffs._token_re.split(old)
+    newwords = diffs._token_re.split(new)
+    sequence = difflib.SequenceMatcher(None, oldwords, newwords)
+
+    oldfragments, newfragments = [], []
+    for tag, i1, i2, j1, j2 in sequence.get_opcodes():
+        oldfrag = ''.join(oldwords[i1:i2])
+        newfrag = ''.join(newwords[j1:j2])
+        if tag != 'equal':
+            if oldfrag:
+                oldfrag = '<del>%s</del>' % oldfrag
+            if newfrag:
+                newfrag = '<ins>%s</ins>' % newfrag
+        oldfragments.append(oldfrag)
+        newfragments.append(newfrag)
+
+    return "".join(oldfragments), "".join(newfragments), 0
+
+
+@pytest.mark.skipif("'TEST_PERFORMANCE' not in os.environ", reason="skipping performance tests, set TEST_PERFORMANCE in environment if desired")
+class TestDiffsPerformance(object):
+
+    @pytest.mark.parametrize('diff_fixture', [
+        'git_diff_minified_js.diff',
+        'git_diff_modify_python.diff',
+        'markuptest.diff',
+    ])
+    @pytest.mark.parametrize('highlighter', ['myers', 'difflib'])
+    def test_as_html(self, benchmark, diff_fixture, highlighter):
+        """ Render diffs of real files with the inline highlighter and the difflib highlighter it replaced. """
+        raw_diff = fixture.load_resource(diff_fixture, strip=False)
+        parsed = diffs.DiffProcessor(raw_diff, vcs='git' if diff_fixture.startswith('git_') else 'hg').parsed
+        benchmark.group = diff_fixture
+        if highlighter == 'difflib':
+            with mock.patch.object(diffs, '_highlight_inline_diff', _highlight_inline_diff_difflib):
+                benchmark(diffs.as_html, parsed_lines=parsed)
+        else:
+            benchmark(diffs.as_html, parsed_lines=parsed)
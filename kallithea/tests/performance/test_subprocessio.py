@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import subprocess
+
+import pytest
+
+from kallithea.lib.vcs.subprocessio import SubprocessIOChunker
+from kallithea.model.db import Repository
+from kallithea.tests import base
+
+
+def _chunker(cmd, inputdata):
+    out = SubprocessIOChunker(cmd, inputstream=io.BytesIO(inputdata))
+    try:
+        return sum(len(chunk) for chunk in out)
+    finally:
+        out.close()
+
+
+def _communicate(cmd, inputdata):
+    """ Reference: let subprocess buffer all output in memory. """
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate(inputdata)
+    return len(out)
+
+
+@pytest.mark.skipif("'TEST_PERFORMANCE' not in os.environ", reason="skipping performance tests, set TEST_PERFORMANCE in environment if desired")
+@pytest.mark.parametrize('run', [_chunker, _communicate])
+class TestSubprocessIOPerformance(base.TestController):
+
+    def test_clone_git(self, benchmark, run):
+        """ Stream a pack with all refs of the test repository, like a clone over smart HTTP does. """
+        repo_path = Repository.get_by_repo_name(base.GIT_REPO).repo_full_path
+        refs = subprocess.check_output(['git', 'upload-pack', '--stateless-rpc', '--advertise-refs', repo_path])
+        shas = sorted(set(line[4:44] for line in refs.splitlines()[2:] if len(line) > 44))
+        request = b''.join(b'0032want %s\n' % sha for sha in shas) + b'00000009done\n'
+        benchmark.group = 'clone'
+        size = benchmark(run, ['git', 'upload-pack', '--stateless-rpc', repo_path], request)
+        assert size > 1000000
+
+    def test_throughput(self, benchmark, run):
+        """ Stream 64 MB in and out of a process. """
+        benchmark.group = 'throughput'
+        assert benchmark(run, ['cat'], b'x' * (64 << 20)) == 64 << 20
@@ -35,3 +35,21 @@ class TestVCSPerformance(base.TestController):
 
     def test_graphmod_git(self, benchmark):
         benchmark(self.graphmod, base.GIT_REPO)
+
+    def file_history_page(self, repo, path):
+        """ The first changelog page of a file, as shown by the changelog. """
+        tip = Repository.get_by_repo_name(repo).scm_instance.get_changeset()
+        return [entry.raw_id for entry in tip.iter_file_history(path, limit=21)]
+
+    def file_history_full(self, repo, path):
+        """ The full history of a file, as created before the changelog was paged. """
+        scm_inst = Repository.get_by_repo_name(repo).scm_instance
+        tip = scm_inst.get_changeset()
+        so = scm_inst.run_git_command(['log', '--pretty=format:%H', '-s', tip.raw_id, '--', path])
+        return [scm_inst.get_changeset(sha).raw_id for sha in so.split()]
+
+    def test_file_history_page_git(self, benchmark):
+        benchmark(self.file_history_page, base.GIT_REPO, 'setup.py')
+
+    def test_file_history_full_git(self, benchmark):
+        benchmark(self.file_history_full, base.GIT_REPO, 'setup.py')
@@ -6,7 +6,7 @@ import pytest
 
 from kallithea.lib import vcs
 from kallithea.lib.vcs.backends.base import BaseChangeset
-from kallithea.lib.vcs.exceptions import BranchDoesNotExistError, ChangesetDoesNotExistError, EmptyRepositoryError, RepositoryError
+from kallithea.lib.vcs.exceptions import BranchDoesNotExistError, ChangesetDoesNotExistError, ChangesetError, EmptyRepositoryError, RepositoryError
 from kallithea.lib.vcs.nodes import AddedFileNodesGenerator, ChangedFileNodesGenerator, FileNode, RemovedFileNodesGenerator
 from kallithea.tests.vcs.base import _BackendTestMixin
 
@@ -118,6 +118,27 @@ class _ChangesetsWithCommitsTestCaseixin(_BackendTestMixin):
             branch_name=self.repo.DEFAULT_BRANCH_NAME)
         assert doc_changeset not in default_branch_changesets
 
+    def test_get_changelog_respects_branch_name(self):
+        tip = self.repo.get_changeset()
+        self.imc.add(vcs.nodes.FileNode('docs/index.txt',
+            content='Documentation\n'))
+        doc_changeset = self.imc.commit(
+            message='New branch: docs',
+            author='joe',
+            branch='docs',
+        )
+        self.imc.add(vcs.nodes.FileNode('newfile', content=''))
+        default_tip = self.imc.commit(
+            message='Back in default branch',
+            author='joe',
+            parents=[tip],
+        )
+        changelog = self.repo.get_changelog(branch_name=self.repo.DEFAULT_BRANCH_NAME)
+        assert doc_changeset not in list(changelog)
+        assert changelog[0] == default_tip
+        assert len(changelog) == len(list(changelog))
+        assert [cs.raw_id for cs in changelog[1:3]] == [cs.raw_id for cs in list(changelog)[1:3]]
+
     def test_get_changeset_by_branch(self):
         for branch, sha in self.repo.branches.items():
             assert sha == self.repo.get_changeset(branch).raw_id
@@ -235,6 +256,28 @@ class _ChangesetsTestCaseMixin(_BackendTestMixin):
             self.repo.get_changesets(reverse=True)]
         assert changesets_id_list == list(reversed(self.repo.revisions))
 
+    def test_get_changelog(self):
+        changelog = self.repo.get_changelog()
+        assert len(changelog) == 5
+        assert [cs.raw_id for cs in changelog] == list(reversed(self.repo.revisions))
+        assert [cs.raw_id for cs in changelog[1:3]] == self.repo.revisions[2:4][::-1]
+        assert [cs.raw_id for cs in changelog[4:10]] == self.repo.revisions[:1]
+        assert list(changelog[10:20]) == []
+        assert changelog[-1].raw_id == self.repo.revisions[0]
+
+    def test_get_changelog_respects_end(self):
+        changelog = self.repo.get_changelog(end=self.repo.revisions[2])
+        assert len(changelog) == 3
+        assert [cs.raw_id for cs in changelog[0:2]] == self.repo.revisions[1:3][::-1]
+
+    def test_get_changelog_raise_errors(self):
+        with pytest.raises(ChangesetDoesNotExistError):
+            self.repo.get_changelog(end='foobar')
+        with pytest.raises(BranchDoesNotExistError):
+            self.repo.get_changelog(branch_name='foobar')
+        with pytest.raises(EmptyRepositoryError):
+            self.setup_empty_repo(self.backend_class).get_changelog()
+
     def test_get_filenodes_generator(self):
         tip = self.repo.get_changeset()
         filepaths = [node.path for node in tip.get_filenodes_generator()]
@@ -348,6 +391,53 @@ class _ChangesetsChangesTestCaseMixin(_BackendTestMixin):
         assert len(changeset.removed) == 1
         assert list(changeset.removed)[0].path == 'qwe'
 
+    def test_get_changesets_metadata(self):
+        metadata = list(self.repo.get_changesets_metadata())
+        assert [m.revision for m in metadata] == [0, 1]
+        for m in metadata:
+            changeset = self.repo.get_changeset(m.revision)
+            assert m.raw_id == changeset.raw_id
+            assert m.author == changeset.author
+            assert m.date == changeset.date
+            assert m.message == changeset.message
+            assert m.parents == [p.raw_id for p in changeset.parents]
+        assert sorted(metadata[0].added) == ['foo/bar', 'foo/bał', 'foobar', 'qwe']
+        assert metadata[0].changed == metadata[0].removed == []
+        assert metadata[1].added == ['fallout']
+        assert sorted(metadata[1].changed) == ['foo/bar', 'foobar']
+        assert metadata[1].removed == ['qwe']
+        assert [m.revision for m in self.repo.get_changesets_metadata(1)] == [1]
+        assert [m.revision for m in self.repo.get_changesets_metadata(0, 1)] == [0]
+
+    def test_iter_file_history(self):
+        tip = self.repo.get_changeset()
+        history = list(tip.iter_file_history('foobar'))
+        assert [e.revision for e in history] == [1, 0]
+        for e in history:
+            changeset = self.repo.get_changeset(e.raw_id)
+            assert e.revision == changeset.revision
+            assert e.author == changeset.author
+            assert e.date == changeset.date
+            assert e.message == changeset.message
+        assert [e.revision for e in tip.iter_file_history('foobar', limit=1)] == [1]
+        assert [e.revision for e in tip.iter_file_history('foobar', offset=1)] == [0]
+        assert list(tip.iter_file_history('foobar', offset=2)) == []
+        assert [e.revision for e in tip.iter_file_history('fallout')] == [1]
+        assert [cs.raw_id for cs in tip.get_file_history('foobar')] == [e.raw_id for e in history]
+        assert tip.get_file_changeset('foobar').revision == 1
+        with pytest.raises(ChangesetError):
+            list(tip.iter_file_history('foo'))
+
+    def test_get_changed_files(self):
+        added, changed, removed = self.repo.get_changed_files(0, 1)
+        assert added == ['fallout']
+        assert sorted(changed) == ['foo/bar', 'foobar']
+        assert removed == ['qwe']
+        added, changed, removed = self.repo.get_changed_files(1, 0)
+        assert added == ['qwe']
+        assert removed == ['fallout']
+        assert self.repo.get_changed_files(1, 1) == ([], [], [])
+
     def test_get_filemode(self):
         changeset = self.repo.get_changeset()
         assert 33188 == changeset.get_file_mode('foo/bar')
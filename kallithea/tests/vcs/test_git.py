@@ -6,8 +6,11 @@ import mock
 import pytest
 
 from kallithea.lib.vcs.backends.git import GitChangeset, GitRepository
+from kallithea.lib.vcs.backends.git.revindex import INDEX_FILENAME
+from kallithea.lib.vcs.backends.git.treecache import tree_cache
 from kallithea.lib.vcs.exceptions import NodeDoesNotExistError, RepositoryError, VCSError
 from kallithea.lib.vcs.nodes import DirNode, FileNode, NodeKind, NodeState
+from kallithea.lib.vcs.utils import ascii_bytes
 from kallithea.model.scm import ScmModel
 from kallithea.tests.vcs.base import _BackendTestMixin
 from kallithea.tests.vcs.conf import TEST_GIT_REPO, TEST_GIT_REPO_CLONE, TESTS_TMP_PATH, get_new_dir
@@ -259,6 +262,27 @@ class TestGitChangeset(object):
         tip = self.repo.get_changeset()
         assert tip.root is tip.get_node('')
 
+    def test_tree_cache(self):
+        tree_cache.clear()
+        commit_id = '2a13f185e4525f9d4b59882791a2d397b90d5ddc'
+        chset = self.repo.get_changeset(commit_id)
+        node = chset.get_node('vcs/backends/hg.py')
+        assert node.is_file()
+        # only the trees of the directories in the path have been read
+        assert len(tree_cache._entries) == 3
+        # trees are shared by changeset instances
+        other = GitRepository(TEST_GIT_REPO).get_changeset(commit_id)
+        assert other.get_node('vcs/backends')._tree is chset.get_node('vcs/backends')._tree
+        assert len(tree_cache._entries) == 3
+        with pytest.raises(NodeDoesNotExistError):
+            other.get_node('vcs/backends/hg.py/foo')
+        with pytest.raises(NodeDoesNotExistError):
+            other.get_node('vcs/foo/hg.py')
+        with mock.patch('kallithea.lib.vcs.conf.settings.GIT_TREE_CACHE_SIZE', 2):
+            tree_cache.clear()
+            self.repo.get_changeset(commit_id).get_node('vcs/backends/hg.py')
+            assert len(tree_cache._entries) == 2
+
     def test_lazy_fetch(self):
         """
         Test if changeset's nodes expands and are cached as we walk through
@@ -587,6 +611,21 @@ class TestGitChangeset(object):
             'vcs/nodes.py']
         assert set(changed) == set([f.path for f in chset.changed])
 
+    def test_changesets_metadata_of_merges(self):
+        # merges are diffed against each parent - like changesets, unlike
+        # Mercurial that only compares to the first parent
+        cs = self.repo.get_changeset('6f40c09042beb1a1c98bfb00731e77cfd5965ac8')
+        metadata, = self.repo.get_changesets_metadata(cs.revision, cs.revision + 1)
+        assert len(metadata.parents) == 2
+        assert metadata.added == [n.path for n in cs.added]
+        assert metadata.changed == [n.path for n in cs.changed]
+        assert metadata.removed == [n.path for n in cs.removed]
+        _added, first_parent_changed, _removed = self.repo.get_changed_files(metadata.parents[0], cs.raw_id)
+        assert 'tests/utils.py' not in first_parent_changed # only changed relative to the second parent
+        assert 'tests/utils.py' in metadata.changed
+        following = list(self.repo.get_changesets_metadata(cs.revision, cs.revision + 2))
+        assert [m.raw_id for m in following] == self.repo.revisions[cs.revision:cs.revision + 2]
+
     def test_commit_message_is_str(self):
         for cs in self.repo:
             assert isinstance(cs.message, str)
@@ -768,6 +807,59 @@ class TestGitRegression(_BackendTestMixin):
         assert paths(*cs.get_nodes('bot/templates/')) == ['bot/templates/404.html', 'bot/templates/500.html']
 
 
+class TestGitStateToken(_BackendTestMixin):
+    backend_alias = 'git'
+
+    def test_token_changes_with_each_ref_update(self):
+        ref_path = os.path.join(self.repo._repo.controldir(), 'refs', 'heads', 'master')
+        tokens = [self.repo.get_state_token()]
+        for rev in self.repo.revisions[:2]:
+            # update the same loose ref file in place - like a ref update that
+            # gets the inode of the previous ref file
+            with open(ref_path, 'w') as f:
+                f.write(rev + '\n')
+            tokens.append(self.repo.get_state_token())
+        assert len(set(tokens)) == len(tokens)
+
+
+class TestGitRevisionIndex(_BackendTestMixin):
+    backend_alias = 'git'
+
+    def test_index_is_persisted(self):
+        revs = list(GitRepository(self.repo.path).revisions)
+        assert revs == list(self.repo.revisions)
+        index_path = os.path.join(self.repo._repo.controldir(), INDEX_FILENAME)
+        assert os.path.isfile(index_path)
+
+        repo = GitRepository(self.repo.path)
+        assert list(repo.revisions) == revs
+        assert repo.count() == 2
+        assert repo.revisions.index(revs[1]) == 1
+        assert revs[0] in repo.revisions
+        assert 'f' * 40 not in repo.revisions
+        assert repo.revisions[-1:] == revs[-1:]
+        assert repo.revisions == revs
+        assert repo.revisions != revs[:1]
+        assert [cs.raw_id for cs in repo[0:2]] == revs
+
+    def test_index_is_extended(self):
+        repo = GitRepository(self.repo.path)
+        revs = list(repo.revisions)
+        repo.in_memory_changeset.add(FileNode('extended', content='more'))
+        tip = repo.in_memory_changeset.commit(message='More', author='Joe Doe <joe.doe@example.com>')
+
+        repo = GitRepository(self.repo.path)
+        assert list(repo.revisions) == revs + [tip.raw_id]
+        assert repo.get_changeset(tip.raw_id).revision == 2
+
+    def test_index_is_rebuilt_after_history_rewrite(self):
+        first = GitRepository(self.repo.path).revisions[0]
+        self.repo._repo.refs[b'refs/heads/master'] = ascii_bytes(first)
+
+        repo = GitRepository(self.repo.path)
+        assert list(repo.revisions) == [first]
+
+
 class TestGitHooks(object):
     """
     Tests related to hook functionality of Git repositories.
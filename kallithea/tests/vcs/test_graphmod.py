@@ -0,0 +1,80 @@
+import datetime
+import os
+
+from kallithea.lib import graphmod
+from kallithea.lib.vcs.nodes import FileNode
+from kallithea.tests.vcs.base import _BackendTestMixin
+
+
+class GraphLayoutTestCaseMixin(_BackendTestMixin):
+
+    @classmethod
+    def _get_commits(cls):
+        start_date = datetime.datetime(2010, 1, 1, 20)
+        for x in range(5):
+            yield {
+                'message': 'Commit %d' % x,
+                'author': 'Joe Doe <joe.doe@example.com>',
+                'date': start_date + datetime.timedelta(hours=12 * x),
+                'added': [
+                    FileNode('file_%d.txt' % x, content='Foobar %d' % x),
+                ],
+            }
+
+    def _branch_and_merge(self, n):
+        repo = self.backend_class(self.repo.path)
+        imc = repo.in_memory_changeset
+        imc.add(FileNode('branch_%d.txt' % n, content='branch'))
+        branch_tip = imc.commit(message='Branch %d' % n, author='joe',
+                                branch='branch%d' % n, parents=[repo.get_changeset(1)])
+        imc.add(FileNode('default_%d.txt' % n, content='default'))
+        default_tip = imc.commit(message='Default %d' % n, author='joe',
+                                 branch=self.backend_class.DEFAULT_BRANCH_NAME,
+                                 parents=[repo.get_changeset(repo.revisions[-2])])
+        imc.commit(message='Merge %d' % n, author='joe',
+                   branch=self.backend_class.DEFAULT_BRANCH_NAME,
+                   parents=[default_tip, branch_tip])
+
+    def _layout_rows(self):
+        layout = graphmod.get_graph_layout(self.backend_class(self.repo.path))
+        return [layout.row(pos) for pos in range(layout.count)]
+
+    def test_changelog_graph_data_matches_graph_data(self):
+        self._branch_and_merge(1)
+        repo = self.backend_class(self.repo.path)
+        revs = list(range(len(repo.revisions)))[::-1]
+        assert graphmod.changelog_graph_data(repo, revs) == graphmod.graph_data(repo, revs)
+        assert os.path.exists(graphmod._layout_path(repo))
+
+    def test_changelog_graph_data_slices_full_layout(self):
+        self._branch_and_merge(1)
+        repo = self.backend_class(self.repo.path)
+        revs = list(range(len(repo.revisions)))[::-1]
+        assert graphmod.changelog_graph_data(repo, revs[2:5]) == graphmod.changelog_graph_data(repo, revs)[2:5]
+
+    def test_layout_is_extended_incrementally(self):
+        self._branch_and_merge(1)
+        self._layout_rows()
+        self._branch_and_merge(2)
+        extended = self._layout_rows()
+        os.unlink(graphmod._layout_path(self.repo))
+        assert extended == self._layout_rows()
+        assert len(extended) == 11
+
+
+class TestGitGraphLayout(GraphLayoutTestCaseMixin):
+    backend_alias = 'git'
+
+    def test_layout_follows_branch_heads(self):
+        self._branch_and_merge(1)
+        before = self._layout_rows()
+        repo = self.backend_class(self.repo.path)
+        repo._repo.refs[b'refs/heads/feature'] = repo.revisions[-2].encode('ascii')
+        updated = self._layout_rows()
+        os.unlink(graphmod._layout_path(self.repo))
+        assert updated == self._layout_rows()
+        assert updated != before
+
+
+class TestHgGraphLayout(GraphLayoutTestCaseMixin):
+    backend_alias = 'hg'
@@ -4,6 +4,7 @@ import pytest
 
 from kallithea.lib.vcs.exceptions import ChangesetDoesNotExistError
 from kallithea.lib.vcs.nodes import FileNode
+from kallithea.lib.vcs.pool import RepositoryPool
 from kallithea.tests.vcs import TEST_USER_CONFIG_FILE
 from kallithea.tests.vcs.base import _BackendTestMixin
 
@@ -50,6 +51,41 @@ class TestHgRepositoryBase(RepositoryBaseTest):
     backend_alias = 'hg'
 
 
+class RepositoryPoolTest(_BackendTestMixin):
+
+    def test_pool(self):
+        pool = RepositoryPool()
+        factory = lambda: self.backend_class(self.repo.path)
+        repo = pool.get(self.repo.path, factory)
+        assert pool.get(self.repo.path, factory) is repo
+
+        pool.invalidate(self.repo.path)
+        repo2 = pool.get(self.repo.path, factory)
+        assert repo2 is not repo
+        assert pool.get(self.repo.path, factory) is repo2
+
+        pool.invalidate()
+        repo3 = pool.get(self.repo.path, factory)
+        assert repo3 is not repo2
+
+        # changing the repository through another instance makes it stale
+        imc = self.backend_class(self.repo.path).in_memory_changeset
+        imc.add(FileNode('pool', content='pool'))
+        tip = imc.commit(message='Pool', author='Joe Doe <joe.doe@example.com>')
+        repo4 = pool.get(self.repo.path, factory)
+        assert repo4 is not repo3
+        assert repo4.get_changeset().raw_id == tip.raw_id
+        assert pool.get(self.repo.path, factory) is repo4
+
+
+class TestGitRepositoryPool(RepositoryPoolTest):
+    backend_alias = 'git'
+
+
+class TestHgRepositoryPool(RepositoryPoolTest):
+    backend_alias = 'hg'
+
+
 class RepositoryGetDiffTest(_BackendTestMixin):
 
     @classmethod